@@ -1,4 +1,3 @@
-import io
 import streamlit as st
 import uuid
 
@@ -35,8 +34,13 @@ from openai import OpenAI
 from os import getenv
 from streamlit_mic_recorder import mic_recorder
 
-from krembot_tools import rag_tool_answer
+from krembot_tools import preload_tool_modules, rag_tool_answer
+from krembot_answer_cache import answer_cache, is_context_independent, replay_answer
+from krembot_audio import prepare_for_transcription, transcribe
 from krembot_db import ConversationDatabase, work_prompts
+from krembot_documents import DocumentIndex
+from krembot_history import thread_history
+from krembot_usage import start_request, tracked_chat_completion
 #from krembot_stui import *
 from krembot_funcs import *
 
@@ -45,7 +49,7 @@ from streamlit_feedback import streamlit_feedback
 mprompts = work_prompts()
 
 with st.expander("Promptovi"):
-    st.write(mprompts)
+    st.write(dict(mprompts))
 import os
 client_folder = os.getenv("CLIENT_FOLDER")
 # avatar_bg = os.path.join("Clients", client_folder, "bg.png")
@@ -62,6 +66,7 @@ default_values = {
     "vrsta": False,
     "messages": {},
     "image_ai": None,
+    "document_index": DocumentIndex,
     "thread_id": str(uuid.uuid4()),
     "filtered_messages": "",
     "selected_question": None,
@@ -77,8 +82,16 @@ initialize_session_state(default_values)
 if st.session_state.thread_id not in st.session_state.messages:
     st.session_state.messages[st.session_state.thread_id] = [{'role': 'system', 'content': mprompts["sys_ragbot"]}]
 
+# Stalna uputstva idu odmah iza sistemskog prompta, a kontekst alata i pitanje na kraj poruka,
+# tako da je pocetak zahteva isti iz poteza u potez i OpenAI ga kesira (prompt caching)
+ANSWER_INSTRUCTIONS = """Answer the user's question using the context that comes with it, directly from our database.
+All the provided context is relevant and trustworthy, so make sure to base your answer strictly on that information.
+Always provide corresponding links from established knowledge base and do NOT generate or suggest any links that do not exist within it."""
+
 client = OpenAI(api_key=getenv("OPENAI_API_KEY"))
 file_reader = FileReader()
+# alati uvoze teske biblioteke tek kad zatrebaju, ovde ih zagrevamo u pozadini (jednom po procesu)
+preload_tool_modules(getenv("APP_ID"))
 
 
 CATEGORY_DEVICE_MAPPING = {
@@ -351,6 +364,17 @@ def reset_memory() -> None:
     st.session_state.filtered_messages = ""
 
 def main():
+    # svaki rerun je jedan zahtev, tokeni se skupljaju i upisuju na kraju,
+    # i kada se rerun prekine (st.rerun, rani return, izuzetak koji hvata check_openai_errors)
+    usage = start_request(st.session_state.app_name)
+    try:
+        handle_rerun()
+    finally:
+        usage.flush()
+
+def handle_rerun():
+    keep_queued_media()
+
     if 'tool_outputs' not in st.session_state:
         st.session_state.tool_outputs = []
 
@@ -430,7 +454,7 @@ def main():
                     stop_prompt="⏹ Završi snimanje i pošalji ",
                     just_once=False,
                     use_container_width=False,
-                    format="webm",
+                    format="wav",
                 )
                 #predlozi
                 st.session_state.toggle_state = st.toggle('✎ Predlozi pitanja/odgovora', key='toggle_button_predlog', help = "Predlažze sledeće pitanje")
@@ -452,35 +476,73 @@ def main():
             id = audio['id']
             if id > st.session_state._last_speech_to_text_transcript_id:
                 st.session_state._last_speech_to_text_transcript_id = id
-                audio_bio = io.BytesIO(audio['bytes'])
-                audio_bio.name = 'audio.webm'
+                # tisina se odseca, 16 kHz mono, manji upload; svaki pokusaj dobija nov bafer
+                prepared = prepare_for_transcription(audio['bytes'], 'audio.' + audio.get('format', 'webm'))
                 st.session_state.success = False
                 err = 0
                 while not st.session_state.success and err < 3:
                     try:
-                        transcript = client.audio.transcriptions.create(
-                            model="whisper-1",
-                            file=audio_bio,
-                            language="sr"
-                        )
+                        # dug snimak se deli na segmente po tisini koji se transkribuju paralelno
+                        transcript = transcribe(client, prepared, model="whisper-1", language="sr")
                     except Exception as e:
                         st.error(f"Neočekivana Greška : {str(e)} pokušajte malo kasnije.")
                         err += 1
                         
                     else:
                         st.session_state.success = True
-                        st.session_state.prompt = transcript.text
+                        st.session_state.prompt = transcript
 
     # Main conversation answer
     if st.session_state.prompt:
-        if getenv("APP_ID") == "DentyBot":
+        # ponovljena (samostalna) pitanja se odgovaraju iz kesa, bez rutiranja, pretrage i modela
+        cache = answer_cache(st.session_state.app_name)
+        cache_scope = str(selected_device) if getenv("APP_ID") == "DentyBot" else ""
+        cacheable = (
+            cache is not None
+            and not st.session_state.image_ai
+            and is_context_independent(st.session_state.prompt, st.session_state.messages[current_thread_id])
+        )
+        cached, candidate, question_embedding = None, None, None
+        if cacheable:
+            try:
+                question_embedding = cache.embed(client, st.session_state.prompt)
+                candidate = cache.similar(question_embedding, cache_scope)
+            except Exception as e:
+                print(f"Answer cache lookup failed: {e}")
+            # bez pretrage se ponavlja samo isto pitanje; parafraza mora posle pretrage dati isti alat i kontekst
+            if cache.replayable(candidate, st.session_state.prompt):
+                cached = candidate
+
+        if cached is not None:
+            result, tool = cached.context, cached.tool
+        elif getenv("APP_ID") == "DentyBot":
             x = selected_device
             if not x:
                 st.error("Niste izabrali uređaj.")
             else:
                 result, tool = rag_tool_answer(st.session_state.prompt, selected_device)
+        elif getenv("APP_ID") == "InteliBot":
+            # izvestaji za vise kupaca se prikazuju kako koji stigne, ali samo prvih nekoliko;
+            # za veliki batch bi to bile hiljade elemenata, ceo pregled je u odgovoru
+            report_status = None
+            shown_reports = int(getenv("INTELISALE_STATUS_REPORTS", "10"))
+
+            def show_report(report, done, total):
+                nonlocal report_status
+                if report_status is None:
+                    report_status = st.status(f"Izveštaji po kupcima: 0/{total}")
+                if done <= shown_reports:
+                    report_status.markdown(report)
+                if done == total and total > shown_reports:
+                    report_status.caption(f"... i još {total - shown_reports} kupaca.")
+                if done <= shown_reports or done == total or done % 100 == 0:
+                    report_status.update(label=f"Izveštaji po kupcima: {done}/{total}", state="complete" if done == total else "running")
+
+            result, tool = rag_tool_answer(st.session_state.prompt, 1, on_report=show_report)
         else:
             result, tool = rag_tool_answer(st.session_state.prompt, 1)
+        if cacheable and cached is None:
+            cached = cache.get(tool, cache_scope, st.session_state.prompt, result, candidate, question_embedding is not None)
         # After getting the tool output
         st.session_state.tool_outputs.append({
             'user_message': st.session_state.prompt,
@@ -495,6 +557,7 @@ def main():
             st.divider()
             st.write("Istorija konverzacije: \n", st.session_state.messages[current_thread_id])
         
+        answer_instructions = []
         if result=="CALENDLY":
             full_prompt=""
             full_response=""
@@ -502,7 +565,9 @@ def main():
 
         elif st.session_state.image_ai:
             if st.session_state.vrsta:
-                full_prompt = st.session_state.prompt + st.session_state.image_ai
+                # dokumenti se ne salju celi uz svako pitanje, vec samo delovi relevantni za pitanje
+                st.session_state.document_index.sync(file_reader.documents)
+                full_prompt = st.session_state.prompt + st.session_state.document_index.context(client, st.session_state.prompt)
                 temp_full_prompt = {
                     "role": "user",
                     "content": [
@@ -516,14 +581,10 @@ def main():
                 with st.chat_message("user", avatar=avatar_user):
                     st.markdown(st.session_state.prompt)
         else:
-            temp_full_prompt = {"role": "user", "content": [{"type": "text", "text": f"""
-                Answer the following question from the user:
-                {st.session_state.prompt}
-                Using the following context, which comes directly from our database:
-                {result}
-                All the provided context is relevant and trustworthy, so make sure to base your answer strictly on the information above.
-                Always provide corresponding links from established knowledge base and do NOT generate or suggest any links that do not exist within it. 
-                """}]}
+            answer_instructions = [{"role": "system", "content": ANSWER_INSTRUCTIONS}]
+            temp_full_prompt = {"role": "user", "content": [{"type": "text", "text": (
+                f"Context from our database:\n{result}\n\nQuestion from the user:\n{st.session_state.prompt}"
+            )}]}
                     #If you cannot find the relevant information within the context, clearly state that the information is not currently available, but do not invent or guess.
             # print(f"temp_full_prompt: {temp_full_prompt}")
     
@@ -534,7 +595,11 @@ def main():
             with st.chat_message("user", avatar=avatar_user):
                 st.markdown(st.session_state.prompt)
 
-        
+
+        # predlozi pitanja dolaze na kraju istog odgovora, bez posebnog poziva posle njega
+        if st.session_state.toggle_state and SUGGESTIONS_INLINE and result != "CALENDLY":
+            answer_instructions = answer_instructions + [{"role": "system", "content": SUGGESTIONS_INSTRUCTIONS}]
+
         # mislim da sve ovo ide samo ako nije kalendly
         if result!="CALENDLY":    
         # Generate and display the assistant's response using the temporary messages list
@@ -543,30 +608,55 @@ def main():
 
             with st.chat_message("assistant", avatar=avatar_ai):
                 # cc_messages = [msg for msg in st.session_state.messages[current_thread_id] if msg.get("role") != "tool"][:-1] + [temp_full_prompt]
-                cc_messages = [msg for msg in st.session_state.messages[current_thread_id] if msg.get("role") != "tool"][:-1]
-                cc_messages.append(temp_full_prompt)
-                print(f"\n\n\ncc_messages: {cc_messages}")
-                message_placeholder = st.empty()
-                full_response = ""
-                for response in client.chat.completions.create(
-                    model=getenv("OPENAI_MODEL"),
-                    temperature=0.0,
-                    messages=cc_messages,
-                    stream=True,
-                    stream_options={"include_usage":True},
-                    ):
-                    try:
-                        full_response += (response.choices[0].delta.content or "")
-                        message_placeholder.markdown(full_response + "▌")
-                    except Exception as e:
-                            pass
+                history = thread_history(current_thread_id)
+                if cached is not None:
+                    pieces = replay_answer(cached.answer)
+                else:
+                    # starije poruke idu kao sazetak, poslednjih nekoliko poteza doslovno; budzet vazi samo za istoriju
+                    cc_messages = [msg for msg in st.session_state.messages[current_thread_id] if msg.get("role") != "tool"][:-1]
+                    # window() stavlja sistemske poruke (prompt pa uputstva) na pocetak, istim redom i bez izmena
+                    cc_messages = history.window(cc_messages + answer_instructions)
+                    cc_messages.append(temp_full_prompt)
+                    print(f"\n\n\ncc_messages: {cc_messages}")
+                    pieces = (
+                        response.choices[0].delta.content or ""
+                        for response in tracked_chat_completion(
+                            client,
+                            "main_completion",
+                            model=getenv("OPENAI_MODEL"),
+                            temperature=0.0,
+                            messages=cc_messages,
+                            stream=True,
+                            stream_options={"include_usage":True},
+                        )
+                        if response.choices  # poslednji chunk nosi samo usage
+                    )
+                # sekcija sa predlozima se odvaja iz strima, ne prikazuje se i ne izgovara
+                pieces = splitter = SuggestionSplitter(pieces)
+                # odgovor se ne salje ceo na svaki delta, vec u ritmu i samo blok koji se jos pise
+                renderer = StreamRenderer()
+                # glasovni odgovor krece posle prve recenice, dok se ostatak teksta jos generise
+                speech = SpeechPipeline(client) if st.session_state.button_clicks else None
+                for piece in pieces:
+                    renderer.write(piece)
+                    if speech is not None:
+                        speech.feed(piece)
             
 
-            message_placeholder.markdown(full_response)
+            full_response = renderer.close()
+            if speech is not None:
+                speech.close()
+            if cacheable and cached is None:
+                cache.put(tool, cache_scope, st.session_state.prompt, result, full_response, question_embedding)
             #copy_to_clipboard(full_response)
             # Append assistant's response to the conversation
             st.session_state.messages[current_thread_id].append({"role": "tool", "content": str(tool)})
             st.session_state.messages[current_thread_id].append({"role": "assistant", "content": full_response})
+            history.update(
+                client,
+                [msg for msg in st.session_state.messages[current_thread_id] if msg.get("role") != "tool"],
+                st.session_state.app_name,
+            )
             st.session_state.filtered_messages = ""
             # da pise i tool
             filtered_data = [entry for entry in st.session_state.messages[current_thread_id] if entry['role'] in ["user", "assistant", "tool"]]
@@ -585,15 +675,9 @@ def main():
                                     key='fb_k')
                 st.form_submit_button('Save feedback', on_click=handle_feedback)
 
-            # ako su oba async, ako ne onda redovno
-            if st.session_state.button_clicks and st.session_state.toggle_state:
-                process_request(client, temp_full_prompt, full_response, getenv("OPENAI_API_KEY"))
-            else:
-                if st.session_state.button_clicks: # ako treba samo da cita odgovore
-                    play_audio_from_stream_s(full_response)
-        
-                if st.session_state.toggle_state:  # ako treba samo da prikaze podpitanja
-                    predlozeni_odgovori(temp_full_prompt)
+            # odgovor je vec izgovoren tokom strimovanja (SpeechPipeline), ostaju samo predlozi
+            if st.session_state.toggle_state:  # ako treba samo da prikaze podpitanja
+                show_suggestions(splitter.suggestions or follow_up_suggestions(st.session_state.prompt, full_response))
     
             if st.session_state.vrsta:
                 st.info(f"Dokument je učitan ({st.session_state.vrsta}) - uklonite ga iz uploadera kada ne želite više da pričate o njegovom sadržaju.")
@@ -0,0 +1,293 @@
+import hashlib
+import re
+import threading
+import time
+
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from krembot_db import prompt_version
+from krembot_history import count_tokens
+from krembot_usage import record_usage, tracked_embedding
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Alati ciji odgovor zavisi samo od pitanja i baze znanja; Orders (status porudzbine), Natop (top liste sa
+# delfi.rs) i InteliBot su zivi podaci
+CACHEABLE_TOOLS = {"ClientDirect", "Hybrid", "Opisi", "Korice", "Graphp", "Pineg"}
+# Kontekst ovih alata sadrzi i zive podatke o proizvodima (cena, stanje sa delfi.rs API-ja): odgovor se
+# koristi samo posle pretrage, kad je kontekst isti (get), nikad pre nje (replayable)
+LIVE_CONTEXT_TOOLS = {"Graphp", "Pineg"}
+DEFAULT_APPS = "DelfiBot,DentyBot,ECDBot"
+# Reci koje upucuju na prethodni deo razgovora; takvo pitanje nije samostalno
+REFERRING_WORDS = {
+    "to", "taj", "ta", "te", "tu", "tog", "toga", "tom", "ovo", "ovaj", "ova", "ove", "ovog", "ovoga", "ono", "onaj",
+    "njega", "nju", "njih", "njemu", "njoj", "prethodni", "prethodno", "gore", "isto", "takođe", "takodje", "još", "jos",
+    "it", "that", "this", "these", "those", "they", "them", "above", "previous", "same",
+}
+
+
+class CachedAnswer(NamedTuple):
+    tool: str
+    question: str
+    context: Any
+    answer: str
+    created: float
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalizes a question for the exact cache key: case folded, punctuation removed, whitespace collapsed.
+    """
+    return " ".join(re.findall(r"\w+", (question or "").casefold()))
+
+
+def context_hash(context: Any) -> str:
+    """
+    Returns a stable hash of the retrieved context.
+    """
+    return hashlib.sha256(str(context).encode("utf-8")).hexdigest()
+
+
+def is_context_independent(question: str, messages: List[Dict[str, Any]]) -> bool:
+    """
+    Decides whether a question can be answered from the cache: the first question of a thread, or a
+    question of at least three words that does not refer to the earlier conversation ('a koliko to košta?').
+
+    Args:
+        question (str): The user question.
+        messages (List[Dict[str, Any]]): The thread history before the question.
+
+    Returns:
+        bool: True if the answer does not depend on the conversation.
+    """
+    if not any(message.get("role") == "user" for message in messages):
+        return True
+    words = normalize_question(question).split()
+    return len(words) >= 3 and not set(words) & REFERRING_WORDS
+
+
+def replay_answer(answer: str, words_per_chunk: int = 3, delay: Optional[float] = None) -> Iterator[str]:
+    """
+    Yields a cached answer in small pieces, so it is shown through the same streaming UI as a completion.
+
+    Args:
+        answer (str): The cached answer.
+        words_per_chunk (int, optional): Words per piece. Defaults to 3.
+        delay (Optional[float], optional): Pause between pieces in seconds. Defaults to the environment
+                                           variable 'ANSWER_CACHE_REPLAY_DELAY' or 0.01.
+
+    Returns:
+        Iterator[str]: The pieces; joined they give `answer` unchanged.
+    """
+    delay = float(getenv("ANSWER_CACHE_REPLAY_DELAY", "0.01")) if delay is None else delay
+    pieces = re.findall(r"\S+\s*|\s+", answer)
+    for start in range(0, len(pieces), words_per_chunk):
+        yield "".join(pieces[start:start + words_per_chunk])
+        if delay:
+            time.sleep(delay)
+
+
+class AnswerCache:
+    """
+    Answers of one app, reusable for repeated questions.
+
+    There are two lookups:
+    - `similar`, before routing and retrieval: the question embedding is compared (cosine) with the
+      embeddings of cached questions and the most similar one above `threshold` is the candidate. Only a
+      candidate with the same normalized question (`replayable`) is replayed without the router, the
+      retrieval and the completion: questions that differ in one token ('CEREC AC' and 'CEREC AF') have
+      nearly equal embeddings but need different answers.
+    - `get`, after retrieval: the exact key (tool, scope, normalized question, retrieved context hash), or
+      else the paraphrase candidate if the retrieval for this question used the same tool and returned the
+      same context, skips the completion.
+
+    Entries expire after `ttl` seconds, the least recently used are dropped beyond `max_entries`, and the
+    whole cache is cleared when the prompt version (`krembot_db.prompt_version`) or the index version
+    ('ANSWER_CACHE_INDEX_VERSION', to bump after re-indexing the knowledge base) changes. The scope holds
+    whatever else the answer depends on, e.g. the selected device in DentyBot.
+    """
+
+    def __init__(self, app_id: str, ttl: Optional[float] = None, threshold: Optional[float] = None, max_entries: int = 2000) -> None:
+        """
+        Initializes an empty cache.
+
+        Args:
+            app_id (str): The application identifier.
+            ttl (Optional[float], optional): Entry lifetime in seconds. Defaults to the environment variable
+                                             'ANSWER_CACHE_TTL_SECONDS' or 86400.
+            threshold (Optional[float], optional): Minimum cosine similarity of a paraphrase. Defaults to the
+                                                   environment variable 'ANSWER_CACHE_SIMILARITY' or 0.95.
+            max_entries (int, optional): Maximum number of cached answers. Defaults to 2000.
+        """
+        self.app_id: str = app_id
+        self.ttl: float = ttl if ttl is not None else float(getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+        self.threshold: float = threshold if threshold is not None else float(getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+        self.max_entries: int = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, str, str], CachedAnswer]" = OrderedDict()
+        self._vectors: Dict[Tuple[str, str, str, str], np.ndarray] = {}
+        self._matrix: Optional[Tuple[List[Tuple[str, str, str, str]], np.ndarray]] = None
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _check_version(self) -> None:
+        version = f"{prompt_version()}|{getenv('ANSWER_CACHE_INDEX_VERSION', '')}"
+        if version != self._version:
+            self._entries.clear()
+            self._vectors.clear()
+            self._matrix = None
+            self._version = version
+
+    def _live(self, key: Tuple[str, str, str, str]) -> Optional[CachedAnswer]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.created > self.ttl:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _drop(self, key: Tuple[str, str, str, str]) -> None:
+        self._entries.pop(key, None)
+        if self._vectors.pop(key, None) is not None:
+            self._matrix = None
+
+    def embed(self, client: Any, question: str) -> np.ndarray:
+        """
+        Returns the normalized embedding of a question.
+        """
+        response = tracked_embedding(client, "answer_cache", input=[question], model=EMBEDDING_MODEL)
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def similar(self, embedding: np.ndarray, scope: str = "") -> Optional[CachedAnswer]:
+        """
+        Returns the cached answer of the most similar question within the scope, if it is similar enough.
+        The answer is a candidate: replay it before retrieval only if it is `replayable`, otherwise pass it
+        to `get` after retrieval.
+
+        Args:
+            embedding (np.ndarray): The normalized question embedding (see `embed`).
+            scope (str, optional): The scope of the answer. Defaults to ''.
+
+        Returns:
+            Optional[CachedAnswer]: The cached answer, or None.
+        """
+        with self._lock:
+            self._check_version()
+            if self._matrix is None:
+                keys = list(self._vectors)
+                self._matrix = (keys, np.vstack([self._vectors[key] for key in keys]) if keys else np.zeros((0, len(embedding)), np.float32))
+            keys, matrix = self._matrix
+            if not keys:
+                return None
+            scores = matrix @ embedding
+            for position in np.argsort(-scores)[:5]:
+                if scores[position] < self.threshold:
+                    break
+                if keys[position][1] == scope:
+                    entry = self._live(keys[position])
+                    if entry is not None:
+                        return entry
+            return None
+
+    def replayable(self, candidate: Optional[CachedAnswer], question: str) -> bool:
+        """
+        Decides whether a `similar` candidate can be replayed before retrieval: only for the same question
+        (normalized, see `normalize_question`), and not for `LIVE_CONTEXT_TOOLS`.
+        """
+        if candidate is None or candidate.tool in LIVE_CONTEXT_TOOLS:
+            return False
+        if normalize_question(candidate.question) != normalize_question(question):
+            return False
+        record_usage("answer_cache", getenv("OPENAI_MODEL"), question_hits=1)
+        return True
+
+    def get(
+        self,
+        tool: str,
+        scope: str,
+        question: str,
+        context: Any,
+        candidate: Optional[CachedAnswer] = None,
+        embedded: bool = False
+    ) -> Optional[CachedAnswer]:
+        """
+        Returns the cached answer for exactly this tool, scope, question and retrieved context, or else the
+        paraphrase candidate found by `similar` if it was answered by the same tool from the same context.
+
+        Args:
+            tool (str): The tool that produced the context.
+            scope (str): The scope of the answer.
+            question (str): The user question.
+            context (Any): The retrieved context.
+            candidate (Optional[CachedAnswer], optional): The `similar` candidate. Defaults to None.
+            embedded (bool, optional): Whether the question was embedded for `similar`; on a miss the
+                                       embedding tokens are logged as 'miss_embedding_tokens'. Defaults to False.
+
+        Returns:
+            Optional[CachedAnswer]: The cached answer, or None.
+        """
+        with self._lock:
+            self._check_version()
+            entry = self._live((tool, scope, normalize_question(question), context_hash(context)))
+        if entry is not None:
+            record_usage("answer_cache", getenv("OPENAI_MODEL"), exact_hits=1)
+            return entry
+        if candidate is not None and candidate.tool == tool and context_hash(candidate.context) == context_hash(context):
+            record_usage("answer_cache", getenv("OPENAI_MODEL"), similar_hits=1)
+            return candidate
+        record_usage("answer_cache", EMBEDDING_MODEL, misses=1, miss_embedding_tokens=count_tokens(question) if embedded else 0)
+        return None
+
+    def put(self, tool: str, scope: str, question: str, context: Any, answer: str, embedding: Optional[np.ndarray] = None) -> None:
+        """
+        Caches an answer (only for `CACHEABLE_TOOLS` and non-empty answers).
+
+        Args:
+            tool (str): The tool that produced the context.
+            scope (str): The scope of the answer (see the class description).
+            question (str): The user question.
+            context (Any): The retrieved context the answer is based on.
+            answer (str): The answer shown to the user.
+            embedding (Optional[np.ndarray], optional): The question embedding, for paraphrase lookups.
+        """
+        if tool not in CACHEABLE_TOOLS or not answer.strip():
+            return
+        key = (tool, scope, normalize_question(question), context_hash(context))
+        with self._lock:
+            self._check_version()
+            self._entries[key] = CachedAnswer(tool, question, context, answer, time.time())
+            self._entries.move_to_end(key)
+            if embedding is not None:
+                self._vectors[key] = embedding
+                self._matrix = None
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+
+_caches: Dict[str, AnswerCache] = {}
+_caches_lock = threading.Lock()
+
+
+def answer_cache(app_id: Optional[str] = None) -> Optional[AnswerCache]:
+    """
+    Returns the process-wide answer cache of an app, or None if the app does not cache answers
+    (see the environment variable 'ANSWER_CACHE_APPS', a comma-separated list of APP_IDs).
+
+    Args:
+        app_id (Optional[str], optional): The application identifier. Defaults to the 'APP_ID' environment variable.
+
+    Returns:
+        Optional[AnswerCache]: The cache, or None.
+    """
+    app_id = app_id or getenv("APP_ID")
+    if app_id not in [app.strip() for app in getenv("ANSWER_CACHE_APPS", DEFAULT_APPS).split(",")]:
+        return None
+    with _caches_lock:
+        if app_id not in _caches:
+            _caches[app_id] = AnswerCache(app_id)
+        return _caches[app_id]
@@ -0,0 +1,136 @@
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import threading
+
+from typing import Any, Awaitable, Optional
+
+HTTP_CONNECTIONS = 20
+HTTP_TIMEOUT_SECONDS = 60
+
+
+class BackgroundLoop:
+    """
+    One asyncio event loop per process, running in a daemon thread, with a shared aiohttp session.
+
+    Streamlit reruns the script in a new thread for every interaction, so `asyncio.run` there creates and
+    tears down a loop (and every `aiohttp.ClientSession` a new TCP + TLS connection) on every turn. Here
+    the loop and the session live for the whole process: connections to api.openai.com are pooled and
+    kept alive between turns.
+
+    Coroutines are submitted from any thread with `submit` / `run`. They run with the context variables of
+    the submitting thread (e.g. the usage collector of the request), and `run` cancels a coroutine that
+    does not finish within its timeout.
+    """
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session: Any = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        The event loop, started on first use.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="krembot-event-loop", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        return self._loop
+
+    async def session(self) -> Any:
+        """
+        Returns the shared aiohttp session (created on first use; must be awaited on the background loop).
+        """
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=HTTP_CONNECTIONS, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS),
+            )
+        return self._session
+
+    def submit(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """
+        Schedules a coroutine on the background loop.
+
+        Args:
+            coro (Awaitable[Any]): The coroutine.
+
+        Returns:
+            concurrent.futures.Future: Its result; cancelling the future cancels the coroutine.
+        """
+        context = contextvars.copy_context()
+
+        async def with_context() -> Any:
+            # task ima svoj kontekst, u njega se prenose promenljive pozivaoca (npr. kolektor tokena)
+            for variable, value in context.items():
+                variable.set(value)
+            return await coro
+
+        return asyncio.run_coroutine_threadsafe(with_context(), self.loop)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = HTTP_TIMEOUT_SECONDS) -> Any:
+        """
+        Runs a coroutine on the background loop and waits for its result.
+
+        Args:
+            coro (Awaitable[Any]): The coroutine.
+            timeout (Optional[float], optional): Seconds to wait; None waits indefinitely. Defaults to 60.
+
+        Returns:
+            Any: The result of the coroutine.
+
+        Raises:
+            TimeoutError: If the coroutine did not finish in time (it is cancelled).
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Background task did not finish within {timeout} s")
+
+    def close(self) -> None:
+        """
+        Closes the shared session and stops the loop.
+        """
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return
+        if self._session is not None and not self._session.closed:
+            try:
+                asyncio.run_coroutine_threadsafe(self._session.close(), loop).result(5)
+            except Exception as e:
+                print(f"Error closing HTTP session: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+_background_loop = BackgroundLoop()
+
+
+def background_loop() -> BackgroundLoop:
+    """
+    Returns the process-wide background loop.
+    """
+    return _background_loop
+
+
+async def http_session() -> Any:
+    """
+    Returns the shared aiohttp session of the background loop (use only in coroutines run by it).
+    """
+    return await _background_loop.session()
+
+
+def run_async(coro: Awaitable[Any], timeout: Optional[float] = HTTP_TIMEOUT_SECONDS) -> Any:
+    """
+    Runs a coroutine on the process-wide background loop and returns its result (see `BackgroundLoop.run`).
+    """
+    return _background_loop.run(coro, timeout)
@@ -0,0 +1,286 @@
+import contextvars
+import io
+import re
+import shutil
+import subprocess
+import time
+import wave
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from krembot_usage import record_usage, tracked_transcription
+
+TARGET_RATE = 16000
+FRAME_MS = 30
+PADDING_MS = 250
+SEGMENT_SECONDS = 30.0
+OVERLAP_SECONDS = 1.0
+
+
+class PreparedAudio(NamedTuple):
+    data: bytes
+    name: str
+    original_bytes: int
+    duration: float
+    trimmed: float
+    samples: Optional[np.ndarray] = None  # 16 kHz mono, None ako snimak nije dekodiran
+
+
+def decode_audio(data: bytes) -> Tuple[np.ndarray, int]:
+    """
+    Decodes audio bytes into float32 samples (frames x channels) and the sample rate.
+
+    WAV, FLAC and OGG are read with soundfile (stdlib `wave` for WAV if soundfile is not installed);
+    anything else (e.g. the webm/opus of the browser recorder) is decoded with ffmpeg when it is on PATH.
+
+    Args:
+        data (bytes): The encoded audio.
+
+    Returns:
+        Tuple[np.ndarray, int]: The samples in [-1, 1] and the sample rate.
+
+    Raises:
+        ValueError: If the audio cannot be decoded.
+    """
+    try:
+        import soundfile as sf
+
+        samples, rate = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+        return samples, rate
+    except ImportError:
+        if data[:4] == b"RIFF":
+            return _read_wav(data)
+    except Exception:
+        pass
+    if shutil.which("ffmpeg"):
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-i", "pipe:0", "-f", "wav", "-acodec", "pcm_s16le", "pipe:1"],
+            input=data,
+            capture_output=True,
+            timeout=60,
+        )
+        if result.returncode == 0:
+            return _read_wav(result.stdout)
+    raise ValueError("Unsupported audio format")
+
+
+def _read_wav(data: bytes) -> Tuple[np.ndarray, int]:
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        width, channels, rate = wav.getsampwidth(), wav.getnchannels(), wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+    if width != 2:
+        raise ValueError(f"Unsupported WAV sample width: {width}")
+    samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    return samples.reshape(-1, channels), rate
+
+
+def trim_silence(samples: np.ndarray, rate: int, frame_ms: int = FRAME_MS, padding_ms: int = PADDING_MS) -> np.ndarray:
+    """
+    Trims leading and trailing silence with an energy-based voice activity detector.
+
+    A frame is voiced when its RMS level (dBFS) is at least 12 dB above the noise floor (the 10th percentile
+    of the frame levels) and above -55 dBFS. Everything before the first and after the last voiced frame,
+    minus `padding_ms`, is cut; silence inside the recording is kept.
+
+    Args:
+        samples (np.ndarray): Mono samples.
+        rate (int): The sample rate.
+        frame_ms (int, optional): Frame length in milliseconds. Defaults to 30.
+        padding_ms (int, optional): Audio kept around the voiced part. Defaults to 250.
+
+    Returns:
+        np.ndarray: The trimmed samples (unchanged if no frame is voiced).
+    """
+    frame = max(int(rate * frame_ms / 1000), 1)
+    count = len(samples) // frame
+    if count < 2:
+        return samples
+    energy = np.sqrt(np.mean(samples[:count * frame].reshape(count, frame) ** 2, axis=1))
+    level = 20 * np.log10(np.maximum(energy, 1e-10))
+    voiced = np.flatnonzero(level >= max(np.percentile(level, 10) + 12, -55))
+    if not len(voiced):
+        return samples
+    padding = int(rate * padding_ms / 1000)
+    return samples[max(voiced[0] * frame - padding, 0):min((voiced[-1] + 1) * frame + padding, len(samples))]
+
+
+def resample(samples: np.ndarray, rate: int, target: int = TARGET_RATE) -> np.ndarray:
+    """
+    Resamples mono audio (moving-average low-pass before downsampling, then linear interpolation).
+    """
+    if rate == target or not len(samples):
+        return samples
+    if rate > target:
+        width = int(round(rate / target))
+        if width > 1:
+            samples = np.convolve(samples, np.ones(width, dtype=np.float32) / width, mode="same")
+    positions = np.arange(int(len(samples) * target / rate)) * (rate / target)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def encode_audio(samples: np.ndarray, rate: int) -> Tuple[bytes, str]:
+    """
+    Encodes mono audio compactly for upload: OGG/Opus, else FLAC (soundfile), else 16-bit WAV.
+
+    Returns:
+        Tuple[bytes, str]: The encoded audio and a file name with the matching extension.
+    """
+    try:
+        import soundfile as sf
+
+        for fmt, subtype, name in (("OGG", "OPUS", "audio.ogg"), ("FLAC", "PCM_16", "audio.flac")):
+            try:
+                buffer = io.BytesIO()
+                sf.write(buffer, samples, rate, format=fmt, subtype=subtype)
+                return buffer.getvalue(), name
+            except Exception:
+                continue
+    except ImportError:
+        pass
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes((np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes())
+    return buffer.getvalue(), "audio.wav"
+
+
+def prepare_for_transcription(data: bytes, name: str = "audio.webm") -> PreparedAudio:
+    """
+    Prepares a recording for Whisper: silence trimmed, downmixed to mono, resampled to 16 kHz and re-encoded.
+
+    If the audio cannot be decoded, or the result is not smaller than the original, the original bytes
+    are returned unchanged. The bytes saved are recorded under the 'stt_preprocess' stage of the usage summary.
+
+    Args:
+        data (bytes): The recorded audio.
+        name (str, optional): The file name of the recording (its extension tells Whisper the format).
+                              Defaults to 'audio.webm'.
+
+    Returns:
+        PreparedAudio: The audio to upload, its file name, the original size, the duration before and after
+                       trimming (seconds) and the prepared 16 kHz samples (for `transcribe`).
+    """
+    start = time.perf_counter()
+    try:
+        samples, rate = decode_audio(data)
+        mono = samples.mean(axis=1) if samples.ndim > 1 else samples
+        duration = len(mono) / rate
+        mono = resample(trim_silence(mono, rate), rate)
+        encoded, encoded_name = encode_audio(mono, TARGET_RATE)
+        prepared = PreparedAudio(encoded, encoded_name, len(data), duration, len(mono) / TARGET_RATE, mono)
+    except Exception as e:
+        print(f"Audio preprocessing skipped: {e}")
+        prepared = None
+    if prepared is None:
+        prepared = PreparedAudio(data, name, len(data), 0.0, 0.0)
+    elif len(prepared.data) >= len(data):
+        prepared = prepared._replace(data=data, name=name)
+    record_usage(
+        "stt_preprocess",
+        "local",
+        time.perf_counter() - start,
+        audio_bytes_in=len(data),
+        audio_bytes_out=len(prepared.data),
+        audio_bytes_saved=len(data) - len(prepared.data),
+    )
+    return prepared
+
+
+def audio_file(prepared: PreparedAudio) -> io.BytesIO:
+    """
+    Returns a fresh, named buffer for one upload attempt (a consumed buffer would upload nothing on retry).
+    """
+    buffer = io.BytesIO(prepared.data)
+    buffer.name = prepared.name
+    return buffer
+
+
+def split_at_silence(
+    samples: np.ndarray,
+    rate: int = TARGET_RATE,
+    segment_seconds: float = SEGMENT_SECONDS,
+    overlap_seconds: float = OVERLAP_SECONDS,
+    search_seconds: float = 5.0
+) -> List[Tuple[int, int]]:
+    """
+    Splits long audio into segments of about `segment_seconds`, cut at the quietest frame within
+    `search_seconds` of each nominal boundary and extended by `overlap_seconds` on both sides, so a word on
+    a boundary is heard whole by at least one segment.
+
+    Args:
+        samples (np.ndarray): Mono samples.
+        rate (int, optional): The sample rate. Defaults to 16000.
+        segment_seconds (float, optional): Target segment length. Defaults to 30.
+        overlap_seconds (float, optional): Overlap between neighbouring segments. Defaults to 1.
+        search_seconds (float, optional): How far from the nominal boundary a cut may move. Defaults to 5.
+
+    Returns:
+        List[Tuple[int, int]]: (start, end) sample ranges, in order.
+    """
+    frame = int(rate * FRAME_MS / 1000)
+    count = len(samples) // frame
+    energy = np.mean(samples[:count * frame].reshape(count, frame) ** 2, axis=1) if count else np.zeros(0)
+    segment, search, overlap = int(segment_seconds * rate), int(search_seconds * rate), int(overlap_seconds * rate)
+    cuts = [0]
+    # zadnji segment moze da bude do 1.5x duzi, da ne ostane kratak rep
+    while len(samples) - cuts[-1] > segment * 1.5:
+        low = (cuts[-1] + segment - search) // frame
+        high = min((cuts[-1] + segment + search) // frame, count)
+        quietest = low + int(np.argmin(energy[low:high])) if high > low else (cuts[-1] + segment) // frame
+        cuts.append(quietest * frame + frame // 2)
+    cuts.append(len(samples))
+    return [(max(start - overlap, 0), min(end + overlap, len(samples))) for start, end in zip(cuts, cuts[1:])]
+
+
+def merge_transcripts(texts: List[str], max_words: int = 20) -> str:
+    """
+    Joins the transcripts of overlapping segments, dropping the words an overlap made appear twice
+    (the longest run of up to `max_words` words that ends one text and starts the next, compared without
+    case and punctuation).
+    """
+    def norm(word: str) -> str:
+        return re.sub(r"\W+", "", word.casefold())
+
+    words: List[str] = []
+    for text in texts:
+        new = text.split()
+        limit = min(max_words, len(words), len(new))
+        tail, head = [norm(word) for word in words[-limit:]] if limit else [], [norm(word) for word in new[:limit]]
+        repeated = next((k for k in range(limit, 0, -1) if tail[-k:] == head[:k]), 0)
+        words += new[repeated:]
+    return " ".join(words)
+
+
+def transcribe(client: Any, prepared: PreparedAudio, max_workers: int = 8, **kwargs: Any) -> str:
+    """
+    Transcribes prepared audio. Short audio is one request; long audio is split at silence
+    (`split_at_silence`), the segments are transcribed concurrently and the texts joined with
+    `merge_transcripts`, so latency stays close to that of a single segment for any length.
+
+    Args:
+        client (Any): The OpenAI client.
+        prepared (PreparedAudio): The audio (see `prepare_for_transcription`).
+        max_workers (int, optional): Concurrent transcription requests. Defaults to 8.
+        **kwargs (Any): Arguments for `audio.transcriptions.create` (model, language, ...).
+
+    Returns:
+        str: The transcript.
+    """
+    samples = prepared.samples
+    if samples is None or len(samples) <= SEGMENT_SECONDS * 1.5 * TARGET_RATE:
+        return tracked_transcription(client, "stt", file=audio_file(prepared), **kwargs).text
+
+    def transcribe_segment(start: int, end: int) -> str:
+        data, name = encode_audio(samples[start:end], TARGET_RATE)
+        return tracked_transcription(client, "stt", file=audio_file(PreparedAudio(data, name, len(data), 0.0, 0.0)), **kwargs).text
+
+    spans = split_at_silence(samples)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stt") as pool:
+        # svaki segment dobija svoju kopiju konteksta (kolektor tokena ovog zahteva)
+        futures = [pool.submit(contextvars.copy_context().run, transcribe_segment, start, end) for start, end in spans]
+        return merge_transcripts([future.result() for future in futures])
@@ -1,6 +1,6 @@
 import json
 import pyodbc
-import streamlit as st
+import threading
 
 from os import getenv
 
@@ -8,7 +8,42 @@ from os import getenv
 import json
 import pyodbc
 import os
-from typing import Any, Dict, List, Optional, Tuple
+import time
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+def like_pattern(search_text: str) -> str:
+    """
+    Builds a '%...%' LIKE pattern for a literal search text, escaping the SQL Server wildcards.
+
+    Args:
+        search_text (str): The text to search for.
+
+    Returns:
+        str: The LIKE pattern.
+    """
+    escaped = search_text.replace("[", "[[]").replace("%", "[%]").replace("_", "[_]")
+    return f"%{escaped}%"
+
+
+def json_like_patterns(search_text: str) -> List[str]:
+    """
+    Builds LIKE patterns matching a search text inside JSON written by `json.dumps` (ASCII escapes).
+
+    Non-ASCII characters are stored escaped and the escapes of upper and lower case letters differ, so
+    the patterns cover the text as typed and the escaped lower and upper case forms.
+
+    Args:
+        search_text (str): The text to search for.
+
+    Returns:
+        List[str]: The distinct LIKE patterns.
+    """
+    variants = [search_text] + [json.dumps(text)[1:-1] for text in (search_text, search_text.lower(), search_text.upper())]
+    return [like_pattern(variant) for variant in dict.fromkeys(variants)]
+
+
 
 class ConversationDatabase:
     """
@@ -354,6 +389,265 @@ class ConversationDatabase:
             print(f"Error listing threads: {e}")
             raise
 
+    def query_feedback_page(
+        self,
+        app_name: str,
+        search_text: str = "",
+        offset: int = 0,
+        limit: int = 50
+    ) -> Tuple[List[tuple], int]:
+        """
+        Retrieves one page of feedback records for an application, filtered on the server.
+
+        The text filter is a case-insensitive LIKE over the question, tool answer, given answer and
+        feedback text. Paging uses OFFSET/FETCH over an order made unique by the 'id' column (see
+        `add_feedback_id`), so pages never repeat or skip rows, and the total number of matching rows is
+        returned by the same query (COUNT(*) OVER ()).
+
+        Args:
+            app_name (str): The name of the application.
+            search_text (str, optional): Text to search for. Defaults to "" (no filter).
+            offset (int, optional): Number of matching rows to skip. Defaults to 0.
+            limit (int, optional): Maximum number of rows to return. Defaults to 50.
+
+        Returns:
+            Tuple[List[tuple], int]: The rows (thread_id, previous_question, tool_answer, given_answer,
+                                          Thumbs, Feedback_text) and the total number of matching rows.
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        where_sql = "WHERE app_name = ?"
+        params: List[Any] = [app_name]
+        if search_text:
+            columns = ["previous_question", "tool_answer", "given_answer", "Feedback_text"]
+            pattern = like_pattern(search_text)
+            where_sql += " AND (" + " OR ".join(f"{column} LIKE ?" for column in columns) + ")"
+            params += [pattern] * len(columns)
+        query_sql = f"""
+        SELECT thread_id, previous_question, tool_answer, given_answer, Thumbs, Feedback_text, COUNT(*) OVER () AS total_rows
+        FROM Feedback
+        {where_sql}
+        ORDER BY thread_id, previous_question, id
+        OFFSET ? ROWS FETCH NEXT ? ROWS ONLY
+        """
+        try:
+            self.cursor.execute(query_sql, (*params, offset, limit))
+            rows = self.cursor.fetchall()
+        except Exception as e:
+            print(f"Error querying feedback page: {e}")
+            raise
+        total = rows[0].total_rows if rows else self._count_past_end("Feedback", where_sql, params, offset)
+        return [tuple(row)[:6] for row in rows], total
+
+    def query_conversation_page(
+        self,
+        app_name: str,
+        user_name: str,
+        search_text: str = "",
+        offset: int = 0,
+        limit: int = 50,
+        preview_chars: int = 300
+    ) -> Tuple[List[tuple], int]:
+        """
+        Retrieves one page of conversations for an application and user, filtered on the server.
+
+        Conversations that contain only the system prompt are excluded, and the text filter is a LIKE
+        over the stored JSON. Because the JSON is written with ASCII escapes, the search text is matched
+        both as typed and in its escaped form (e.g. 'č' is stored as '\\u010d'). Only a preview of each
+        conversation is returned; the full text is loaded for the selected thread.
+
+        Args:
+            app_name (str): The name of the application.
+            user_name (str): The name of the user.
+            search_text (str, optional): Text to search for. Defaults to "" (no filter).
+            offset (int, optional): Number of matching rows to skip. Defaults to 0.
+            limit (int, optional): Maximum number of rows to return. Defaults to 50.
+            preview_chars (int, optional): Length of the returned conversation preview. Defaults to 300.
+
+        Returns:
+            Tuple[List[tuple], int]: The rows (id, thread_id, preview) ordered from newest to oldest
+                                          and the total number of matching rows.
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        # json.dumps upisuje poruke kao {"role": "user", ...}, pa ovo iskljucuje razgovore sa samo sistemskim promptom
+        where_sql = """WHERE app_name = ? AND user_name = ? AND conversation LIKE '%"role": "user"%'"""
+        params: List[Any] = [app_name, user_name]
+        if search_text:
+            patterns = json_like_patterns(search_text)
+            where_sql += " AND (" + " OR ".join("conversation LIKE ?" for _ in patterns) + ")"
+            params += patterns
+        query_sql = f"""
+        SELECT id, thread_id, SUBSTRING(conversation, 1, ?) AS preview, COUNT(*) OVER () AS total_rows
+        FROM conversations
+        {where_sql}
+        ORDER BY id DESC
+        OFFSET ? ROWS FETCH NEXT ? ROWS ONLY
+        """
+        try:
+            self.cursor.execute(query_sql, (preview_chars, *params, offset, limit))
+            rows = self.cursor.fetchall()
+        except Exception as e:
+            print(f"Error querying conversation page: {e}")
+            raise
+        total = rows[0].total_rows if rows else self._count_past_end("conversations", where_sql, params, offset)
+        return [tuple(row)[:3] for row in rows], total
+
+    def _count_past_end(self, table: str, where_sql: str, params: List[Any], offset: int) -> int:
+        """
+        Counts the matching rows when a page came back empty (the offset may be past the end).
+        """
+        if offset == 0:
+            return 0
+        self.cursor.execute(f"SELECT COUNT(*) FROM {table} {where_sql}", tuple(params))
+        return self.cursor.fetchone()[0]
+
+    def iter_conversation_batches(
+        self,
+        after_id: int = 0,
+        batch_size: int = 500,
+        app_name: Optional[str] = None
+    ) -> Iterator[List[tuple]]:
+        """
+        Streams conversations in primary key order, one `fetchmany` batch at a time.
+
+        A single ordered query is executed and rows are pulled from the server cursor in batches, so
+        memory stays bounded by `batch_size` regardless of the table size. The last `id` of a batch is
+        a keyset checkpoint: passing it as `after_id` resumes the stream right after that row.
+
+        Args:
+            after_id (int, optional): Only conversations with a larger id are returned. Defaults to 0.
+            batch_size (int, optional): Number of rows per batch. Defaults to 500.
+            app_name (Optional[str], optional): Restrict the stream to one application. Defaults to None.
+
+        Yields:
+            List[tuple]: Rows (id, app_name, user_name, thread_id, conversation).
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        query_sql = "SELECT id, app_name, user_name, thread_id, conversation FROM conversations WHERE id > ?"
+        params: List[Any] = [after_id]
+        if app_name:
+            query_sql += " AND app_name = ?"
+            params.append(app_name)
+        query_sql += " ORDER BY id"
+        try:
+            self.cursor.execute(query_sql, tuple(params))
+            while True:
+                rows = self.cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [tuple(row) for row in rows]
+        except Exception as e:
+            print(f"Error streaming conversations: {e}")
+            raise
+
+    def add_feedback_id(self) -> None:
+        """
+        Adds an identity column 'id' to the 'Feedback' table if it does not have one.
+
+        The table was created without a key; the identity gives every row a unique, increasing id that
+        the bulk export uses as its keyset checkpoint and the viewer as the last key of its page order. Existing rows are numbered when the column is added,
+        and inserts that list their columns (see `insert_feedback`) are not affected.
+
+        Returns:
+            None
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        alter_sql = """
+        IF COL_LENGTH('Feedback', 'id') IS NULL
+            ALTER TABLE Feedback ADD id INT IDENTITY(1,1) NOT NULL;
+        """
+        try:
+            self.cursor.execute(alter_sql)
+            self.conn.commit()
+        except Exception as e:
+            print(f"Error adding feedback id: {e}")
+            raise
+
+    def iter_feedback_batches(
+        self,
+        after_id: int = 0,
+        batch_size: int = 500,
+        app_name: Optional[str] = None
+    ) -> Iterator[List[tuple]]:
+        """
+        Streams feedback records in id order, one `fetchmany` batch at a time.
+
+        Works like `iter_conversation_batches`: the last `id` of a batch is a keyset checkpoint, and
+        passing it as `after_id` resumes the stream right after that row. Needs the 'id' column
+        (see `add_feedback_id`).
+
+        Args:
+            after_id (int, optional): Only feedback records with a larger id are returned. Defaults to 0.
+            batch_size (int, optional): Number of rows per batch. Defaults to 500.
+            app_name (Optional[str], optional): Restrict the stream to one application. Defaults to None.
+
+        Yields:
+            List[tuple]: Rows (id, thread_id, app_name, previous_question, tool_answer, given_answer, Thumbs, Feedback_text).
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        query_sql = """
+        SELECT id, thread_id, app_name, previous_question, tool_answer, given_answer, Thumbs, Feedback_text
+        FROM Feedback
+        WHERE id > ?
+        """
+        params: List[Any] = [after_id]
+        if app_name:
+            query_sql += " AND app_name = ?"
+            params.append(app_name)
+        query_sql += " ORDER BY id"
+        try:
+            self.cursor.execute(query_sql, tuple(params))
+            while True:
+                rows = self.cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [tuple(row) for row in rows]
+        except Exception as e:
+            print(f"Error streaming feedback: {e}")
+            raise
+
+    def create_viewer_indexes(self) -> None:
+        """
+        Creates the indexes used by the conversation and feedback viewer (zz_export_from_mssql.py, which calls
+        this once per process), if they do not already exist, and the 'id' column of 'Feedback' that its
+        paging needs (`add_feedback_id`).
+
+        The indexes serve the equality filters, the page order and the thread lookups: a conversation page
+        is a seek on (app_name, user_name) read in id order, a feedback page a seek on app_name, and a selected
+        thread is found by thread_id. The text filter is a LIKE with a leading wildcard, so no index can seek
+        on it; it is evaluated only over the rows of the selected app and user.
+
+        Returns:
+            None
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        index_sql = """
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_conversations_app_user')
+            CREATE INDEX IX_conversations_app_user ON conversations (app_name, user_name, id DESC) INCLUDE (thread_id);
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_conversations_thread')
+            CREATE INDEX IX_conversations_thread ON conversations (thread_id);
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_Feedback_app_thread')
+            CREATE INDEX IX_Feedback_app_thread ON Feedback (app_name, thread_id);
+        """
+        self.add_feedback_id()
+        try:
+            self.cursor.execute(index_sql)
+            self.conn.commit()
+        except Exception as e:
+            print(f"Error creating viewer indexes: {e}")
+            raise
+
     def add_token_record_openai(
         self,
         app_id: str,
@@ -398,6 +692,38 @@ class ConversationDatabase:
             print(f"Error adding token record: {e}")
             raise
 
+    def add_token_records_openai(
+        self,
+        records: List[Tuple[str, str, int, int, int, int, int]]
+    ) -> None:
+        """
+        Inserts several token usage records into the 'chatbot_token_log' table in a single batch.
+
+        Args:
+            records (List[Tuple[str, str, int, int, int, int, int]]): Rows in the order
+                (app_id, model_name, embedding_tokens, prompt_tokens, completion_tokens, stt_tokens, tts_tokens).
+
+        Returns:
+            None
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        if not records:
+            return
+        insert_sql = """
+        INSERT INTO chatbot_token_log (app_id, model_name, embedding_tokens, prompt_tokens, completion_tokens, stt_tokens, tts_tokens)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """
+        try:
+            self.cursor.fast_executemany = True
+            self.cursor.executemany(insert_sql, records)
+            self.conn.commit()
+        except Exception as e:
+            print(f"Error adding token records: {e}")
+            self.conn.rollback()
+            raise
+
     def insert_feedback(
         self,
         thread_id: str,
@@ -592,6 +918,38 @@ class PromptDatabase:
             prompt_dict[result[0]] = result[1]
         return prompt_dict
 
+    def query_prompt_strings_version(
+        self,
+        prompt_names: List[str]
+    ) -> str:
+        """
+        Computes a cheap version stamp for the given prompt names.
+
+        The stamp is the number of matching rows together with a SHA-256 over the ordered list of the
+        per-prompt SHA-256 hashes of name and string. Unlike an XOR-based CHECKSUM_AGG, swapping or editing
+        prompts always changes it (barring a hash collision). It is computed entirely on the server, so
+        polling it does not transfer the prompt texts (needs SQL Server 2017 or later for STRING_AGG).
+
+        Args:
+            prompt_names (List[str]): A list of prompt names to include in the version stamp.
+
+        Returns:
+            str: The version stamp in the form '<count>:<hash>'.
+
+        Raises:
+            pyodbc.Error: If there is an error executing the SQL statement.
+        """
+        query = f"""
+        SELECT COUNT(*), CONVERT(VARCHAR(64), HASHBYTES('SHA2_256', STRING_AGG(
+            CONVERT(VARCHAR(MAX), HASHBYTES('SHA2_256', CONCAT(PromptName, NCHAR(31), PromptString)), 2), ','
+        ) WITHIN GROUP (ORDER BY PromptName)), 2)
+        FROM PromptStrings
+        WHERE PromptName IN ({','.join(['?'] * len(prompt_names))})
+        """
+        self.cursor.execute(query, tuple(prompt_names))
+        count, digest = self.cursor.fetchone()
+        return f"{count}:{digest}"
+
     def get_records(
         self,
         query: str,
@@ -1361,57 +1719,203 @@ class PromptDatabase:
             return []
 
 
-@st.cache_data
-def work_prompts() -> Dict[str, str]:
+DEFAULT_PROMPT = "You are a helpful assistant."
+
+PROMPT_NAMES = [
+    "text_from_image",
+    "contextual_compression",
+    "rag_self_query",
+    "hyde_rag",
+    "choose_rag",
+    "sys_ragbot",
+    "rag_answer_reformat",
+]
+
+
+class PromptStore(Mapping):
+    """
+    A hot-reloadable, versioned, read-only mapping of prompt names to prompt strings.
+
+    At startup the prompts are loaded from a local JSON snapshot, so the database is not on the
+    critical path. A background thread periodically compares a cheap version stamp computed by the
+    database with the active one and, when it changed, fetches the prompts, writes a new snapshot and
+    atomically swaps in the new version. Readers always see one complete version of the prompts.
+
+    The database is queried synchronously only when there is no usable snapshot (first start of an app).
     """
-    Retrieves and constructs a mapping of prompt names to their corresponding prompt strings.
 
-    This function performs the following steps:
-        1. Defines a default prompt string to be used as a fallback.
-        2. Initializes a dictionary of prompt names mapped to the default prompt.
-        3. Retrieves environment variable values corresponding to each prompt name.
-        4. Uses the `PromptDatabase` class to fetch prompt strings from the database based on the environment variable values.
-        5. Constructs the final `prompt_map` dictionary by:
-            - Assigning the fetched prompt string if available.
-            - Falling back to the default prompt if no database entry is found.
+    def __init__(
+        self,
+        snapshot_path: Optional[str] = None,
+        refresh_seconds: Optional[float] = None
+    ) -> None:
+        """
+        Initializes the store and loads the prompts from the snapshot (or the database if there is none).
+
+        Args:
+            snapshot_path (Optional[str], optional): Path of the JSON snapshot. Defaults to the environment
+                variable 'PROMPT_SNAPSHOT' or '.krembot_cache/prompts_<APP_ID>.json'.
+            refresh_seconds (Optional[float], optional): Interval between version checks. Defaults to the
+                environment variable 'PROMPT_REFRESH_SECONDS' or 60. A value of 0 disables the background refresh.
+        """
+        self.snapshot_path: str = snapshot_path or getenv("PROMPT_SNAPSHOT") or os.path.join(
+            ".krembot_cache", f"prompts_{getenv('APP_ID', 'default')}.json"
+        )
+        self.refresh_seconds: float = float(
+            refresh_seconds if refresh_seconds is not None else getenv("PROMPT_REFRESH_SECONDS", "60")
+        )
+        # Prompt names are stored in the database under the names found in the environment variables
+        self.env_map: Dict[str, Optional[str]] = {name: getenv(name.upper()) for name in PROMPT_NAMES}
+        self._state: Tuple[str, Dict[str, str]] = ("", dict.fromkeys(PROMPT_NAMES, DEFAULT_PROMPT))
+        self._refresh_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        if not self.load_snapshot():
+            try:
+                self.refresh(force=True)
+            except Exception as e:
+                print(f"Error loading prompts from the database, using defaults: {e}")
+
+    @property
+    def version(self) -> str:
+        """
+        The version stamp of the active prompts ('' if only the defaults are loaded).
+        """
+        return self._state[0]
+
+    def __getitem__(self, key: str) -> str:
+        return self._state[1][key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._state[1])
+
+    def __len__(self) -> int:
+        return len(self._state[1])
+
+    def _swap(self, version: str, prompts: Dict[str, str]) -> None:
+        """
+        Atomically replaces the active version and prompts.
+        """
+        merged = dict.fromkeys(PROMPT_NAMES, DEFAULT_PROMPT)
+        merged.update({name: text for name, text in prompts.items() if text is not None})
+        self._state = (version, merged)
+
+    def load_snapshot(self) -> bool:
+        """
+        Loads the prompts from the local snapshot file.
+
+        The snapshot is ignored if it was written for a different set of prompt environment variables.
+
+        Returns:
+            bool: `True` if a usable snapshot was loaded, `False` otherwise.
+        """
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if snapshot.get("env_map") != self.env_map:
+            return False
+        self._swap(snapshot.get("version", ""), snapshot.get("prompts", {}))
+        return True
+
+    def write_snapshot(self) -> None:
+        """
+        Writes the active prompts to the snapshot file (write to a temporary file, then rename).
+
+        Returns:
+            None
+        """
+        version, prompts = self._state
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "env_map": self.env_map, "prompts": prompts}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Checks the database version stamp and swaps in new prompts if it changed.
+
+        Args:
+            force (bool, optional): Fetch the prompts even if the version did not change. Defaults to False.
+
+        Returns:
+            bool: `True` if a new version was swapped in, `False` otherwise.
+
+        Raises:
+            pyodbc.Error: If there is an error querying the database.
+        """
+        db_names = [name for name in self.env_map.values() if name]
+        with self._refresh_lock:
+            with PromptDatabase() as db:
+                version = db.query_prompt_strings_version(db_names) if db_names else "0:"
+                if version == self.version and not force:
+                    return False
+                sql_results = db.query_sql_prompt_strings(db_names) if db_names else {}
+            prompts = {name: sql_results.get(env_var) for name, env_var in self.env_map.items()}
+            self._swap(version, prompts)
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                print(f"Error writing prompt snapshot: {e}")
+        print(f"Prompts reloaded, version {version}")
+        return True
+
+    def start_background_refresh(self) -> None:
+        """
+        Starts the daemon thread that periodically revalidates the prompts. Calling it again is a no-op.
+
+        Returns:
+            None
+        """
+        if self.refresh_seconds <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        def run() -> None:
+            # prva provera odmah, da snapshot sa diska ne ostane zastareo do prvog intervala
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Error refreshing prompts: {e}")
+                time.sleep(self.refresh_seconds)
+
+        self._thread = threading.Thread(target=run, name="prompt-refresh", daemon=True)
+        self._thread.start()
+
+
+_prompt_store: Optional[PromptStore] = None
+_prompt_store_lock = threading.Lock()
+
+
+def work_prompts() -> PromptStore:
+    """
+    Returns the process-wide prompt store, creating it on first use.
+
+    The returned `PromptStore` behaves like a read-only dictionary mapping each prompt name to its
+    prompt string, and always reflects the latest loaded version, so module-level references to it
+    pick up prompt edits without a restart. Prompts missing from the database fall back to a default prompt.
 
     Returns:
-        Dict[str, str]: A dictionary mapping each prompt name to its corresponding prompt string.
-                        If a prompt string is not found in the database, the default prompt is used.
+        PromptStore: The shared prompt store.
     """
-    default_prompt = "You are a helpful assistant."
-
-    all_prompts = {
-        "text_from_image": default_prompt,
-        "contextual_compression": default_prompt,
-        "rag_self_query": default_prompt,
-        "hyde_rag": default_prompt,
-        "choose_rag": default_prompt,
-        "sys_ragbot": default_prompt,
-        "rag_answer_reformat": default_prompt,
-    }
-
-    prompt_names = list(all_prompts.keys())
-
-    # Build a mapping from original prompt names to environment variable values
-    prompt_env_map = {name: getenv(name.upper()) for name in prompt_names}
-
-    # Extract the environment variable values
-    env_vars = list(prompt_env_map.values())
-
-    with PromptDatabase() as db:
-        # Fetch the prompt strings from the database using the environment variable values
-        sql_results = db.query_sql_prompt_strings(env_vars)
-
-    # Build the output dictionary with original prompt names as keys
-    prompt_map: Dict[str, str] = {}
-    for prompt_name in prompt_names:
-        env_var = prompt_env_map[prompt_name]
-        prompt_string = sql_results.get(env_var)
-        if prompt_string is not None:
-            prompt_map[prompt_name] = prompt_string
-        else:
-            # Use the default prompt if no result is found in the database
-            prompt_map[prompt_name] = all_prompts[prompt_name]
+    global _prompt_store
+    if _prompt_store is None:
+        with _prompt_store_lock:
+            if _prompt_store is None:
+                _prompt_store = PromptStore()
+                _prompt_store.start_background_refresh()
+    return _prompt_store
+
+
+def prompt_version() -> str:
+    """
+    Returns the version stamp of the active prompts, for caches that depend on prompt contents.
 
-    return prompt_map
\ No newline at end of file
+    Returns:
+        str: The active prompt version.
+    """
+    return work_prompts().version
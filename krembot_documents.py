@@ -0,0 +1,202 @@
+import hashlib
+import re
+
+from os import getenv
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from krembot_history import count_tokens
+from krembot_usage import record_usage, tracked_embedding
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+CHUNK_TOKENS = 400
+CHUNK_OVERLAP_TOKENS = 50
+EMBEDDING_BATCH = 100
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """
+    Splits a document into chunks of about `max_tokens` tokens, at paragraph boundaries where possible
+    (a paragraph longer than a chunk is split at sentences, then at words). Each chunk starts with about the
+    last `overlap_tokens` tokens of the previous one (whole paragraphs where they fit, else the last words
+    of the last paragraph), so text on a boundary is found with its context.
+
+    Args:
+        text (str): The document text.
+        max_tokens (int, optional): Tokens per chunk. Defaults to 400.
+        overlap_tokens (int, optional): Tokens repeated from the previous chunk. Defaults to 50.
+
+    Returns:
+        List[str]: The chunks, in document order.
+    """
+    pieces: List[Tuple[str, int]] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        size = count_tokens(paragraph)
+        if size <= max_tokens:
+            pieces.append((paragraph, size))
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            words = sentence.split()
+            # recenica duza od chunka se deli po recima
+            step = max(len(words) * max_tokens // max(count_tokens(sentence), 1), 1)
+            for start in range(0, len(words), step):
+                part = " ".join(words[start:start + step])
+                pieces.append((part, count_tokens(part)))
+
+    chunks: List[str] = []
+    current: List[Tuple[str, int]] = []
+    for piece in pieces:
+        if current and sum(size for _, size in current) + piece[1] > max_tokens:
+            chunks.append("\n\n".join(part for part, _ in current))
+            overlap: List[Tuple[str, int]] = []
+            room = overlap_tokens
+            for part, size in reversed(current):
+                if size <= room:
+                    overlap.insert(0, (part, size))
+                    room -= size
+                    continue
+                # od veceg dela (obican pasus) uzimaju se poslednje reci, srazmerno preostalim tokenima
+                words = part.split()
+                tail = " ".join(words[len(words) - len(words) * room // max(size, 1):]) if room > 0 else ""
+                if tail:
+                    overlap.insert(0, (tail, count_tokens(tail)))
+                break
+            current = overlap
+        current.append(piece)
+    if current:
+        chunks.append("\n\n".join(part for part, _ in current))
+    return chunks
+
+
+class DocumentIndex:
+    """
+    An in-session vector index of the uploaded documents.
+
+    Instead of appending the full text of every uploaded document to every prompt, the documents are
+    chunked (`chunk_text`) and embedded once; the normalized embeddings are kept in one NumPy matrix. For
+    each question only the most similar chunks that fit in the token budget are sent. Documents small
+    enough to fit in the budget whole are sent whole and never embedded. Documents are identified by the
+    hash of their name and text, so a document that stays in the uploader is not embedded again, and the
+    chunks of a removed document are dropped.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes an empty index.
+        """
+        self.documents: Dict[str, Tuple[str, str, int]] = {}
+        self.chunks: List[str] = []
+        self.sources: List[str] = []
+        self.doc_keys: List[str] = []
+        self.matrix: np.ndarray = np.zeros((0, 0), dtype=np.float32)
+
+    def _embed(self, client: Any, texts: List[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), EMBEDDING_BATCH):
+            response = tracked_embedding(client, "document_index", input=texts[start:start + EMBEDDING_BATCH], model=EMBEDDING_MODEL)
+            vectors += [item.embedding for item in response.data]
+        matrix = np.asarray(vectors, dtype=np.float32)
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    def sync(self, documents: Dict[str, str]) -> None:
+        """
+        Brings the index in line with the uploaded documents: removed documents and their chunks are
+        dropped, new ones are added (they are chunked and embedded on the first question that needs it).
+
+        Args:
+            documents (Dict[str, str]): The uploaded documents, file name to text.
+        """
+        wanted = {
+            hashlib.sha256(f"{name}\0{text}".encode("utf-8")).hexdigest(): (name, text)
+            for name, text in documents.items()
+        }
+        keep = np.array([key in wanted for key in self.doc_keys], dtype=bool)
+        if not keep.all():
+            self.chunks = [chunk for chunk, kept in zip(self.chunks, keep) if kept]
+            self.sources = [source for source, kept in zip(self.sources, keep) if kept]
+            self.doc_keys = [key for key, kept in zip(self.doc_keys, keep) if kept]
+            self.matrix = self.matrix[keep]
+        self.documents = {
+            key: self.documents.get(key) or (name, text, count_tokens(text)) for key, (name, text) in wanted.items()
+        }
+
+    def _index(self, client: Any) -> None:
+        indexed = set(self.doc_keys)
+        for key, (name, text, _) in self.documents.items():
+            if key in indexed:
+                continue
+            chunks = chunk_text(text)
+            if not chunks:
+                continue
+            vectors = self._embed(client, chunks)
+            self.matrix = np.vstack([self.matrix, vectors]) if len(self.matrix) else vectors
+            self.chunks += chunks
+            self.sources += [name] * len(chunks)
+            self.doc_keys += [key] * len(chunks)
+
+    def _top(self, client: Any, question: str, k: int) -> List[int]:
+        self._index(client)
+        if not self.chunks:
+            return []
+        scores = self.matrix @ self._embed(client, [question])[0]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [int(i) for i in top[np.argsort(-scores[top])]]
+
+    def search(self, client: Any, question: str, k: int = 8) -> List[Tuple[str, str]]:
+        """
+        Returns the `k` chunks most similar to a question (cosine similarity), best first.
+
+        Args:
+            client (Any): The OpenAI client.
+            question (str): The user question.
+            k (int, optional): Number of chunks. Defaults to 8.
+
+        Returns:
+            List[Tuple[str, str]]: The file name and the text of each chunk.
+        """
+        return [(self.sources[i], self.chunks[i]) for i in self._top(client, question, k)]
+
+    def context(self, client: Any, question: str, budget: Optional[int] = None, k: int = 8) -> str:
+        """
+        Returns the document text to send with a question: the whole documents when they fit in the
+        budget, otherwise the most relevant chunks that fit, in document order. The tokens saved compared
+        to sending the whole documents are logged under the 'document_index' stage.
+
+        Args:
+            client (Any): The OpenAI client.
+            question (str): The user question.
+            budget (Optional[int], optional): Token budget of the document context. Defaults to the environment
+                                    variable 'DOCUMENT_TOKEN_BUDGET' or 2000.
+            k (int, optional): Maximum number of chunks. Defaults to 8.
+
+        Returns:
+            str: The document context, each part preceded by its file name.
+        """
+        budget = budget if budget is not None else int(getenv("DOCUMENT_TOKEN_BUDGET", "2000"))
+        total = sum(tokens for _, _, tokens in self.documents.values())
+        if total <= budget:
+            # mali dokumenti idu celi, kao ranije, bez embedovanja
+            return self._format([(name, text) for name, text, _ in self.documents.values()])
+        chosen, used = [], 0
+        for i in self._top(client, question, k):
+            size = count_tokens(self.chunks[i])
+            if used + size <= budget:
+                chosen.append(i)
+                used += size
+        record_usage("document_index", EMBEDDING_MODEL, saved_tokens=total - used)
+        return self._format([(self.sources[i], self.chunks[i]) for i in sorted(chosen)])
+
+    @staticmethod
+    def _format(parts: List[Tuple[str, str]]) -> str:
+        text, source = "", None
+        for name, part in parts:
+            if name != source:
+                text += f"\n\n{name}: "
+                source = name
+            text += f"\n{part}"
+        return text
@@ -0,0 +1,228 @@
+import hashlib
+import io
+import multiprocessing
+import re
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from os import getenv
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+from krembot_usage import record_usage
+
+TEXT_EXTENSIONS = (".txt", ".js", ".py", ".md")
+PDF_PARALLEL_PAGES = 16
+PDF_PAGES_PER_TASK = 8
+
+
+class ParsedFile(NamedTuple):
+    text: str
+    preview: Any  # sta se prikazuje korisniku (tekst, ili DataFrame za CSV)
+
+
+def extract_pdf_pages(data: bytes, start: int, end: int) -> List[str]:
+    """
+    Extracts the text of the pages [start, end) of a PDF; runs in a worker process of the PDF pool.
+    """
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    return [reader.pages[page].extract_text() or "" for page in range(start, min(end, len(reader.pages)))]
+
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+
+def pdf_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool for PDF extraction (started on first use, 'PDF_WORKERS' processes, default
+    the CPU count). Processes are spawned, not forked, because the Streamlit server is multi-threaded.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            workers = int(getenv("PDF_WORKERS", "0")) or None
+            _pdf_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+
+def iter_pdf_pages(data: bytes, pages_per_task: int = PDF_PAGES_PER_TASK) -> Iterator[Tuple[int, int, str]]:
+    """
+    Extracts the text of a PDF page by page, yielding the pages in order as soon as they are ready.
+
+    PDFs with at least `PDF_PARALLEL_PAGES` pages are split into tasks of `pages_per_task` pages that are
+    extracted in parallel in the PDF process pool; smaller ones are extracted in this process.
+
+    Args:
+        data (bytes): The PDF.
+        pages_per_task (int, optional): Pages per pool task. Defaults to 8.
+
+    Returns:
+        Iterator[Tuple[int, int, str]]: The page number (from 1), the number of pages and the page text.
+    """
+    import PyPDF2
+
+    total = len(PyPDF2.PdfReader(io.BytesIO(data)).pages)
+    if total < PDF_PARALLEL_PAGES:
+        for number, text in enumerate(extract_pdf_pages(data, 0, total), 1):
+            yield number, total, text
+        return
+    futures = [pdf_pool().submit(extract_pdf_pages, data, start, start + pages_per_task) for start in range(0, total, pages_per_task)]
+    number = 0
+    try:
+        for future in futures:
+            for text in future.result():
+                number += 1
+                yield number, total, text
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def clean_pdf_text(text: str) -> str:
+    """
+    Removes bullet points and fixes the spaces PyPDF2 puts between single letters.
+    """
+    text = text.replace("•", "")
+    return re.sub(r"(?<=\b\w) (?=\w\b)", "", text)
+
+
+def parse_pdf(data: bytes, progress: Optional[Callable[[int, int], None]] = None) -> ParsedFile:
+    """
+    Extracts the text of a PDF (see `iter_pdf_pages`), reporting progress after every page.
+
+    Args:
+        data (bytes): The PDF.
+        progress (Optional[Callable[[int, int], None]], optional): Called with the pages done and the total.
+
+    Returns:
+        ParsedFile: The cleaned text.
+    """
+    pages = []
+    for number, total, text in iter_pdf_pages(data):
+        pages.append(text)
+        if progress is not None:
+            progress(number, total)
+    text = clean_pdf_text("".join(pages))
+    return ParsedFile(text, text)
+
+
+def parse_docx(data: bytes) -> ParsedFile:
+    """
+    Extracts the paragraphs of a Word document.
+    """
+    from docx import Document
+
+    text = "\n".join(paragraph.text for paragraph in Document(io.BytesIO(data)).paragraphs)
+    return ParsedFile(text, text)
+
+
+def parse_txt(data: bytes) -> ParsedFile:
+    """
+    Decodes a UTF-8 text file.
+    """
+    text = data.decode("utf-8")
+    return ParsedFile(text, text)
+
+
+def parse_csv(data: bytes) -> ParsedFile:
+    """
+    Reads a CSV file; the text is the table as a string, the preview the DataFrame.
+    """
+    import pandas as pd
+
+    frame = pd.read_csv(io.BytesIO(data))
+    return ParsedFile(frame.to_string(), frame)
+
+
+def file_parser(filename: str) -> Optional[Callable[..., ParsedFile]]:
+    """
+    Returns the parser for a file name, or None if the type is not supported.
+    """
+    if filename.endswith(TEXT_EXTENSIONS):
+        return parse_txt
+    if filename.endswith(".docx"):
+        return parse_docx
+    if filename.endswith(".pdf"):
+        return parse_pdf
+    if filename.endswith(".csv"):
+        return parse_csv
+    return None
+
+
+class ParseCache:
+    """
+    Parsed uploads, keyed by the parser and the SHA-256 of the file content.
+
+    Streamlit reruns the script on every interaction while a file sits in the uploader; with the cache
+    a file is parsed once per process, not once per rerun, and the same file uploaded again (by any user)
+    is not parsed at all. The least recently used entries are dropped beyond `max_chars` characters of text.
+    """
+
+    def __init__(self, max_chars: Optional[int] = None) -> None:
+        """
+        Initializes an empty cache.
+
+        Args:
+            max_chars (Optional[int], optional): Characters of text kept. Defaults to the environment variable
+                                                 'FILE_CACHE_MAX_CHARS' or 50 million.
+        """
+        self.max_chars: int = max_chars if max_chars is not None else int(getenv("FILE_CACHE_MAX_CHARS", "50000000"))
+        self._entries: "OrderedDict[str, ParsedFile]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[ParsedFile]:
+        """
+        Returns the parsed file for a key, or None.
+        """
+        with self._lock:
+            parsed = self._entries.get(key)
+            if parsed is not None:
+                self._entries.move_to_end(key)
+            return parsed
+
+    def put(self, key: str, parsed: ParsedFile) -> None:
+        """
+        Caches a parsed file, dropping the least recently used ones beyond the size cap.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._chars -= len(self._entries.pop(key).text)
+            self._entries[key] = parsed
+            self._chars += len(parsed.text)
+            while self._chars > self.max_chars and len(self._entries) > 1:
+                self._chars -= len(self._entries.popitem(last=False)[1].text)
+
+
+_parse_cache = ParseCache()
+
+
+def parse_file(filename: str, data: bytes, progress: Optional[Callable[[int, int], None]] = None) -> Optional[ParsedFile]:
+    """
+    Parses an uploaded file, from the parse cache when the same content was parsed before.
+
+    Args:
+        filename (str): The file name (its extension selects the parser).
+        data (bytes): The file content.
+        progress (Optional[Callable[[int, int], None]], optional): Progress callback for PDFs (see `parse_pdf`).
+
+    Returns:
+        Optional[ParsedFile]: The parsed file, or None if the type is not supported.
+    """
+    parser = file_parser(filename)
+    if parser is None:
+        return None
+    key = f"{parser.__name__}:{hashlib.sha256(data).hexdigest()}"
+    start = time.perf_counter()
+    parsed = _parse_cache.get(key)
+    if parsed is not None:
+        record_usage("file_parse", "local", time.perf_counter() - start, cache_hits=1)
+        return parsed
+    parsed = parser(data, progress) if parser is parse_pdf else parser(data)
+    _parse_cache.put(key, parsed)
+    record_usage("file_parse", "local", time.perf_counter() - start, parsed_bytes=len(data))
+    return parsed
@@ -1,18 +1,18 @@
-import aiohttp
-import asyncio
 import base64
-import io
-import pandas as pd
-import PyPDF2
+import hashlib
 import re
-import soundfile as sf
 import streamlit as st
+import time
 import uuid
 
-from docx import Document
+from krembot_async import HTTP_TIMEOUT_SECONDS, background_loop
+from krembot_files import TEXT_EXTENSIONS, parse_file
+from krembot_tts_cache import cached_speech_async
+from krembot_usage import record_usage, tracked_chat_completion
 from openai import OpenAI, APIConnectionError, APIError, RateLimitError
+from collections import OrderedDict
 from os import getenv
-from typing import List, Dict, Any, Tuple, Union, Optional, Callable
+from typing import List, Dict, Any, Tuple, Union, Optional, Callable, Iterable, Iterator
 
 client = OpenAI(api_key=getenv("OPENAI_API_KEY"))
 
@@ -82,6 +82,122 @@ def initialize_session_state(defaults: Dict[str, Any]) -> None:
             else:
                 st.session_state[key] = value
 
+
+_BLOCK_MARKS = re.compile(r"```|\n(?=\n)")
+
+
+class StreamRenderer:
+    """
+    Renders a streamed answer into the page with bounded overhead, as a fixed-cadence throttle.
+
+    Re-rendering the whole answer on every delta sends O(n^2) bytes over the websocket and re-parses the
+    markdown each time. Instead:
+        - Deltas are buffered and flushed at most every `interval` seconds, or as soon as `min_chars` new
+          characters arrived.
+        - Completed blocks (text up to a blank line, outside code fences) are written once into their own
+          element and never re-sent; only the block in progress is re-rendered. Block ends and code fences
+          are tracked as the text arrives, so each character is scanned once.
+
+    There is no backpressure: `markdown()` only queues a delta on the server and returns, so the script
+    cannot observe how far behind the browser is. The fixed cadence bounds the messages per second instead.
+
+    The number of flushes, the bytes sent (and what re-rendering everything would have sent) and the render
+    time are recorded under the 'render' stage of the usage summary when the stream is closed.
+    """
+
+    def __init__(
+        self,
+        container: Any = None,
+        interval: float = 0.05,
+        min_chars: int = 200,
+        cursor: str = "▌"
+    ) -> None:
+        """
+        Initializes the renderer.
+
+        Args:
+            container (Any, optional): The Streamlit container to render into. Defaults to a new `st.container()`.
+            interval (float, optional): Minimum seconds between flushes. Defaults to 0.05.
+            min_chars (int, optional): New characters that force a flush. Defaults to 200.
+            cursor (str, optional): Shown after the text while streaming. Defaults to '▌'.
+        """
+        self.container = container if container is not None else st.container()
+        self.interval = interval
+        self.min_chars = min_chars
+        self.cursor = cursor
+        self.text = ""
+        self._frozen = 0  # duzina teksta koji je vec upisan u zavrsene blokove
+        self._scanned = 0  # dokle je tekst pregledan (``` i prazni redovi)
+        self._in_fence = False
+        self._block_end = 0  # kraj poslednjeg zavrsenog bloka van ``` bloka koda
+        self._rendered = 0
+        self._last_flush = 0.0
+        self._tail = self.container.empty()
+        self.stats = {"flushes": 0, "bytes": 0, "naive_bytes": 0, "blocks": 0, "seconds": 0.0}
+
+    def write(self, delta: str) -> None:
+        """
+        Appends a delta and flushes if the interval passed or enough text is pending.
+        """
+        if not delta:
+            return
+        self.text += delta
+        self.stats["naive_bytes"] += len(self.text) + len(self.cursor)
+        now = time.perf_counter()
+        if now - self._last_flush >= self.interval or len(self.text) - self._rendered >= self.min_chars:
+            self._flush(self.cursor)
+
+    def close(self) -> str:
+        """
+        Renders the final text (without the cursor), records the render statistics and returns the text.
+        """
+        self._flush("")
+        record_usage(
+            "render",
+            "streamlit",
+            self.stats["seconds"],
+            render_flushes=self.stats["flushes"],
+            render_blocks=self.stats["blocks"],
+            render_bytes=self.stats["bytes"],
+            render_naive_bytes=self.stats["naive_bytes"],
+        )
+        return self.text
+
+    def _flush(self, cursor: str) -> None:
+        start = time.perf_counter()
+        self._scan()
+        pending = self.text[self._frozen:]
+        split = self._block_end - self._frozen
+        if split > 0:
+            # zavrseni blok ostaje u svom elementu, dalje se renderuje samo novi rep
+            self._tail.markdown(pending[:split])
+            self.stats["bytes"] += split
+            self.stats["blocks"] += 1
+            self._frozen += split
+            self._tail = self.container.empty()
+            pending = pending[split:]
+        self._tail.markdown(pending.lstrip("\n") + cursor)
+        self.stats["bytes"] += len(pending) + len(cursor)
+        self.stats["flushes"] += 1
+        self._rendered = len(self.text)
+        self._last_flush = time.perf_counter()
+        self.stats["seconds"] += self._last_flush - start
+
+    def _scan(self) -> None:
+        """
+        Scans the text that arrived since the last flush for code fences and blank lines, updating the end
+        of the last complete block (after its blank line, outside a ``` block).
+        """
+        end = self._scanned
+        for match in _BLOCK_MARKS.finditer(self.text, self._scanned):
+            if match.group() == "```":
+                self._in_fence = not self._in_fence
+            elif not self._in_fence and match.start() > self._frozen:
+                self._block_end = match.start() + 2
+            end = match.end()
+        # zadnja dva znaka mogu biti pocetak ``` ili praznog reda iz sledeceg delta
+        self._scanned = max(end, len(self.text) - 2, self._scanned)
+
     
 class FileReader:
     """
@@ -89,7 +205,9 @@ class FileReader:
 
     This class provides methods to read `.docx`, `.txt`, `.csv`, and `.pdf` files. It utilizes
     Streamlit's file uploader to handle multiple file uploads and processes each file based on its
-    extension. The extracted content is stored in the `documents` dictionary attribute.
+    extension. Parsing is done by `krembot_files.parse_file`, cached by file content, so a file that stays
+    in the uploader is not parsed again on every rerun. The content of the files currently uploaded is
+    stored in the `documents` dictionary attribute.
     """
 
     def __init__(self) -> None:
@@ -111,9 +229,8 @@ class FileReader:
         """
         Reads a `.docx` file and extracts its text content.
 
-        This method processes a Word document by extracting text from each paragraph and
-        concatenating them into a single string. The extracted text is displayed using
-        Streamlit's `st.write` and returned.
+        This method extracts the text of each paragraph of a Word document (or takes it from the parse
+        cache), displays it using Streamlit's `st.write` and returns it.
 
         Args:
             file (Any): A file-like object representing the `.docx` file to be read.
@@ -121,9 +238,7 @@ class FileReader:
         Returns:
             str: The extracted text content from the `.docx` file.
         """
-        doc = Document(file)
-        full_text = [para.text for para in doc.paragraphs]
-        text_data = '\n'.join(full_text)
+        text_data = parse_file(file.name, file.getvalue()).text
         st.write(text_data)
         return text_data
 
@@ -140,7 +255,7 @@ class FileReader:
         Returns:
             str: The extracted text content from the `.txt` file.
         """
-        txt_data = file.getvalue().decode("utf-8")
+        txt_data = parse_file(file.name, file.getvalue()).text
         with st.expander("Prikaži tekst"):
             st.write(txt_data)
         return txt_data
@@ -149,9 +264,9 @@ class FileReader:
         """
         Reads a `.csv` file and extracts its content.
 
-        This method utilizes Pandas to read the uploaded CSV file, displays the data within
-        an expandable section using Streamlit's `st.expander`, converts the DataFrame to a
-        string, and returns the CSV content as a string.
+        This method utilizes Pandas to read the uploaded CSV file (or takes it from the parse cache),
+        displays the data within an expandable section using Streamlit's `st.expander`, and returns the
+        CSV content as a string.
 
         Args:
             file (Any): A file-like object representing the `.csv` file to be read.
@@ -159,19 +274,19 @@ class FileReader:
         Returns:
             str: The string representation of the CSV content.
         """
-        csv_data = pd.read_csv(file)
+        parsed = parse_file(file.name, file.getvalue())
         with st.expander("Prikaži CSV podatke"):
-            st.write(csv_data)
-        csv_content = csv_data.to_string()
-        return csv_content
+            st.write(parsed.preview)
+        return parsed.text
 
     def read_pdf(self, file: Any) -> str:
         """
         Reads a `.pdf` file and extracts its text content.
 
-        This method processes a PDF document by extracting text from each page using PyPDF2.
-        It cleans the extracted text by removing bullet points and fixing space issues, displays
-        the content within an expandable section using Streamlit's `st.expander`, and returns the text.
+        This method extracts the text of each page with PyPDF2 (large PDFs page-parallel in a process pool,
+        see `krembot_files.iter_pdf_pages`) while a progress bar shows the pages done, or takes it from the
+        parse cache. The text is cleaned of bullet points and space issues, displayed within an expandable
+        section using Streamlit's `st.expander`, and returned.
 
         Args:
             file (Any): A file-like object representing the `.pdf` file to be read.
@@ -179,17 +294,17 @@ class FileReader:
         Returns:
             str: The extracted and cleaned text content from the `.pdf` file.
         """
-        pdf_reader = PyPDF2.PdfReader(file)
-        num_pages = len(pdf_reader.pages)
-        text_content = ""
+        bar = None
 
-        for page in range(num_pages):
-            page_obj = pdf_reader.pages[page]
-            text_content += page_obj.extract_text()
+        def progress(done: int, total: int) -> None:
+            nonlocal bar
+            if bar is None:
+                bar = st.progress(0.0)
+            bar.progress(done / total, text=f"{file.name}: stranica {done}/{total}")
 
-        # Remove bullet points and fix space issues
-        text_content = text_content.replace("•", "")
-        text_content = re.sub(r"(?<=\b\w) (?=\w\b)", "", text_content)
+        text_content = parse_file(file.name, file.getvalue(), progress).text
+        if bar is not None:
+            bar.empty()
         with st.expander("Prikaži tekst"):
             st.write(text_content)
         return text_content
@@ -201,8 +316,9 @@ class FileReader:
         This method allows users to upload multiple files via Streamlit's file uploader. It iterates
         over each uploaded file, determines the file type based on its extension, and calls the
         appropriate reading method (`read_txt`, `read_docx`, `read_pdf`, or `read_csv`). The extracted
-        contents are stored in the `documents` dictionary attribute. If any file has an unsupported
-        extension, an error message is displayed.
+        contents of the files in the uploader are stored in the `documents` dictionary attribute (files
+        removed from the uploader are dropped). If any file has an unsupported extension, an error message
+        is displayed.
 
         Returns:
             Tuple[Union[str, bool], bool]: 
@@ -211,10 +327,11 @@ class FileReader:
                 - The second element is a boolean indicating whether the file reading was successful (`True`) or not (`False`).
         """
         uploaded_files = st.file_uploader("Choose file(s)", accept_multiple_files=True)
+        self.documents = {}
         if uploaded_files:
             for file in uploaded_files:
                 filename = file.name
-                if filename.endswith('.txt') or filename.endswith('.js') or filename.endswith('.py') or filename.endswith('.md'):
+                if filename.endswith(TEXT_EXTENSIONS):
                     self.documents[filename] = self.read_txt(file)
                 elif filename.endswith('.docx'):
                     self.documents[filename] = self.read_docx(file)
@@ -248,142 +365,47 @@ def callback() -> Optional[bytes]:
         return st.session_state.my_recorder_output['bytes']
     
 
-async def fetch_spoken_response(
-    client: Any,
-    user_message: str,
-    full_response: str,
-    api_key: str
-    ) -> bytes:
-    """
-    Fetches a spoken audio response from the OpenAI API based on the provided input.
-
-    This asynchronous function sends a POST request to the OpenAI audio speech API endpoint with the specified
-    model and voice parameters. It processes the API response and retrieves the audio data in bytes format.
-    If the API request fails (i.e., returns a non-200 status code), it raises an exception with the corresponding
-    status code.
-
-    Args:
-        client (Any): An instance of the client making the request (unused in the current implementation).
-        user_message (str): The message from the user (unused in the current implementation).
-        full_response (str): The full textual response to be converted into speech.
-        api_key (str): The API key for authenticating with the OpenAI API.
-
-    Returns:
-        bytes: The audio data returned by the OpenAI API.
-
-    Raises:
-        Exception: If the API request fails with a status code other than 200.
-    """
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        response = await session.post(
-            url="https://api.openai.com/v1/audio/speech",
-            headers=headers,
-            json={"model": "tts-1-hd", "voice": "nova", "input": full_response},
-        )
-
-        if response.status != 200:
-            raise Exception(f"API request failed with status {response.status}")
-
-        audio_data = await response.read()
-        return audio_data
+system_message = {
+        "role": "system",
+        "content":         
+            f"You are an AI language model assistant for a company's chatbot. Your task is to generate "
+            f"3 different possible continuation sentences that a user might say based on the given context. "
+            f"These continuations should be in the form of questions or statements that naturally follow from "
+            f"the conversation.\n\n"
+            f"Your goal is to help guide the user through the Q&A process by predicting their next possible inputs. "
+            f"Ensure these continuations are from the user's perspective and relevant to the context provided.\n\n"
+            f"Provide these sentences separated by newlines, without numbering.\n\n"
+            f"Original context:\n"}
 
 
-async def suggest_questions(
-    prompt: str,
-    api_key: Optional[str] = None
-    ) -> str:
+def handle_question_click(question: str) -> None:
     """
-    Generates suggested continuation questions or statements based on the provided prompt using OpenAI's Chat API.
+    Sets the selected question in the Streamlit session state.
 
-    This asynchronous function sends a POST request to the OpenAI chat completions API endpoint with a system
-    message guiding the model to generate three possible continuation sentences. The generated suggestions are
-    intended to help guide the user through a Q&A process by predicting their next possible inputs.
+    This function updates the `selected_question` key in Streamlit's session state with the provided
+    question. It is typically used as a callback for Streamlit button clicks to store the user's
+    selected question for further processing.
 
     Args:
-        prompt (str): The context or conversation history based on which suggestions are to be generated.
-        api_key (Optional[str], optional): The API key for authenticating with the OpenAI API.
-                                        Defaults to the 'OPENAI_API_KEY' environment variable.
+        question (str): The question or statement selected by the user via a Streamlit button.
 
     Returns:
-        str: A string containing three suggested continuation sentences, separated by newlines.
-
-    Raises:
-        Exception: If the API request fails or the response format is unexpected.
+        None
     """
-    user_message = {
-        "role": "user",
-        "content": f"""You are an AI language model assistant for a company's chatbot. Your task is to generate 3 different possible continuation sentences that a user might say based on the given context. These continuations should be in the form of questions or statements that naturally follow from the conversation.
-
-                    Your goal is to help guide the user through the Q&A process by predicting their next possible inputs. Ensure these continuations are from the user's perspective and relevant to the context provided.
-
-                    Provide these sentences separated by newlines, without numbering.
-
-                    Original context:
-                    {prompt}
-                    """
-    }
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    async with aiohttp.ClientSession() as session:
-        response = await session.post(
-            url="https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json={
-                "model": getenv("OPENAI_MODEL"),
-                "messages": [system_message, user_message],
-            },
-        )
-        data = await response.json()
-        odgovor = data['choices'][0]['message']['content']
-        return odgovor
+    """Set the selected question in the session state."""
+    st.session_state.selected_question = question
 
 
-async def handle_async_tasks(
-    client: Any,
-    user_message: str,
-    full_response: str,
-    api_key: str
-    ) -> None:
+def show_suggestions(questions: List[str]) -> None:
     """
-    Handles concurrent asynchronous tasks for fetching spoken responses and suggesting questions.
-
-    This asynchronous function concurrently executes two tasks:
-        1. Fetches a spoken audio response based on the user's message and full response.
-        2. Suggests possible continuation questions or statements based on the user's message.
-
-    After fetching the responses, it processes the suggested questions by creating interactive buttons
-    within a Streamlit application. When a question is selected, it updates the session state accordingly.
-    Additionally, it processes the fetched audio data to be played within the Streamlit app.
+    Shows suggested questions as buttons; a clicked suggestion becomes the next prompt.
 
     Args:
-        client (Any): An instance of the client making the requests.
-        user_message (str): The message from the user.
-        full_response (str): The full textual response to be converted into speech.
-        api_key (str): The API key for authenticating with the OpenAI API.
+        questions (List[str]): The suggested questions or statements (shorter than 11 characters are skipped).
 
     Returns:
         None
-
-    Raises:
-        Exception: Propagates exceptions from the asynchronous tasks if they are not handled within them.
     """
-    # Fetch spoken response and suggestions concurrently
-    audio_data, odgovor = await asyncio.gather(
-        fetch_spoken_response(client, user_message, full_response, api_key),
-        suggest_questions(prompt=user_message, api_key=api_key),
-    )
-    
-    try:
-        questions = odgovor.split('\n')
-    except:
-        questions = []
-
     # Create buttons for each question
     st.caption("Predložena pitanja/odgovori:")
     for question in questions:
@@ -394,238 +416,334 @@ async def handle_async_tasks(
     if 'selected_question' in st.session_state:
         st.session_state.prompt = st.session_state.selected_question
         st.session_state['selected_question'] = None
-    
-    # Get the audio data and samplerate
-    audio_base64, samplerate = play_audio_from_stream(audio_data)
-    
-    # Display the audio in the Streamlit app
-    st.audio(f"data:audio/wav;base64,{audio_base64}", format="audio/wav")
 
 
-def play_audio_from_stream(spoken_response: bytes) -> Tuple[str, int]:
-    """
-    Converts spoken audio bytes into a base64-encoded string and retrieves the sample rate.
-
-    This function processes the audio data received as bytes, reads it using the SoundFile library to extract
-    audio samples and the sample rate, and then encodes the audio into a base64 string suitable for streaming
-    in a web application. It returns both the encoded audio string and the sample rate.
+SUGGESTIONS_MARKER = "[[PREDLOZI]]"
+# Predlozi se traze u istom pozivu kao odgovor, kao poslednji deo odgovora iza markera
+SUGGESTIONS_INSTRUCTIONS = f"""After the answer, write a line containing only {SUGGESTIONS_MARKER}, followed by 3 different
+possible continuation sentences the user might say next: questions or statements that naturally follow from the
+conversation, from the user's perspective, in the language of the user. One per line, without numbering."""
+SUGGESTIONS_INLINE = getenv("SUGGESTIONS_INLINE", "1") != "0"
+SUGGESTIONS_MODEL = getenv("SUGGESTIONS_MODEL", "gpt-4o-mini")
 
-    Args:
-        spoken_response (bytes): The raw audio data in bytes format.
 
-    Returns:
-        Tuple[str, int]: 
-            - A base64-encoded string of the audio data in WAV format.
-            - The sample rate of the audio data.
+class SuggestionSplitter:
+    """
+    Separates the suggestions section (see `SUGGESTIONS_INSTRUCTIONS`) from a streamed answer.
 
-    Raises:
-        Exception: If there is an error in processing the audio data.
+    Iterating yields the answer pieces unchanged up to the marker; text that could be the start of the
+    marker is held back until it is decided, so the marker and the suggestions are never rendered or spoken.
+    After the stream ends, `suggestions` holds the parsed suggestions (empty if the model did not write any).
     """
-    buffer = io.BytesIO(spoken_response)  # Directly pass the bytes object to BytesIO
-    buffer.seek(0)
 
-    with sf.SoundFile(buffer, 'r') as sound_file:
-        data = sound_file.read(dtype='int16')
-        samplerate = sound_file.samplerate
+    def __init__(self, pieces: Iterable[str], marker: str = SUGGESTIONS_MARKER) -> None:
+        """
+        Initializes the splitter.
 
-    # Create a new buffer to save the audio in WAV format
-    wav_buffer = io.BytesIO()
-    with sf.SoundFile(wav_buffer, 'w', samplerate=samplerate, channels=1, format='WAV') as wav_file:
-        wav_file.write(data)
+        Args:
+            pieces (Iterable[str]): The streamed answer.
+            marker (str, optional): The line that starts the suggestions. Defaults to `SUGGESTIONS_MARKER`.
+        """
+        self.pieces = pieces
+        self.marker = marker
+        self.tail: Optional[str] = None
+
+    def __iter__(self) -> Iterator[str]:
+        buffer = ""
+        for piece in self.pieces:
+            if self.tail is not None:
+                self.tail += piece
+                continue
+            buffer += piece
+            position = buffer.find(self.marker)
+            if position >= 0:
+                self.tail = buffer[position + len(self.marker):]
+                if buffer[:position].rstrip():
+                    yield buffer[:position].rstrip()
+                buffer = ""
+                continue
+            # zadrzava se kraj koji moze biti pocetak markera, i razmak ispred njega
+            held = next((k for k in range(min(len(self.marker) - 1, len(buffer)), 0, -1) if buffer.endswith(self.marker[:k])), 0)
+            ready = buffer[:len(buffer) - held].rstrip()
+            if ready:
+                yield ready
+                buffer = buffer[len(ready):]
+        if buffer:
+            yield buffer
+
+    @property
+    def suggestions(self) -> List[str]:
+        """
+        The suggestions written after the marker, without numbering or bullets (at most 3).
+        """
+        if not self.tail:
+            return []
+        lines = (re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip() for line in self.tail.splitlines())
+        return [line for line in lines if line][:3]
 
-    # Encode the WAV data to base64
-    wav_buffer.seek(0)
-    audio_base64 = base64.b64encode(wav_buffer.read()).decode('utf-8')
 
-    return audio_base64, samplerate
+_follow_up_cache: "OrderedDict[str, List[str]]" = OrderedDict()
 
 
-def process_request(
-    client: Any,
-    full_prompt: str,
-    full_response: str,
-    api_key: str
-    ) -> None:
+def follow_up_suggestions(question: str, answer: str, max_entries: int = 500) -> List[str]:
     """
-    Processes a user request by executing asynchronous tasks to fetch audio responses and suggest questions.
+    Suggests follow-up questions for an answer with the small model `SUGGESTIONS_MODEL`, when the answer
+    did not come with its own suggestions (a cached answer, or a model that ignored the instructions).
 
-    This function orchestrates the handling of a user's request by scheduling and running asynchronous tasks
-    that fetch a spoken audio response and generate suggested continuation questions. It leverages asyncio's
-    event loop to execute these tasks concurrently, ensuring efficient processing and timely responses.
+    Suggestions are cached per (question, answer), so a replayed cached answer needs no request.
 
     Args:
-        client (Any): An instance of the client handling the requests.
-        full_prompt (str): The complete prompt or context based on which suggestions and audio are generated.
-        full_response (str): The full textual response to be converted into speech.
-        api_key (str): The API key for authenticating with the OpenAI API.
+        question (str): The user question.
+        answer (str): The answer shown to the user.
+        max_entries (int, optional): Answers whose suggestions are kept. Defaults to 500.
 
     Returns:
-        None
-
-    Raises:
-        Exception: If an error occurs during the execution of asynchronous tasks.
+        List[str]: The suggested questions or statements.
     """
-    asyncio.run(handle_async_tasks(client, full_prompt, full_response, api_key))
-
-
-system_message = {
-        "role": "system",
-        "content":         
-            f"You are an AI language model assistant for a company's chatbot. Your task is to generate "
-            f"3 different possible continuation sentences that a user might say based on the given context. "
-            f"These continuations should be in the form of questions or statements that naturally follow from "
-            f"the conversation.\n\n"
-            f"Your goal is to help guide the user through the Q&A process by predicting their next possible inputs. "
-            f"Ensure these continuations are from the user's perspective and relevant to the context provided.\n\n"
-            f"Provide these sentences separated by newlines, without numbering.\n\n"
-            f"Original context:\n"}
+    key = hashlib.sha256(f"{question}\0{answer}".encode("utf-8")).hexdigest()
+    if key in _follow_up_cache:
+        _follow_up_cache.move_to_end(key)
+        record_usage("suggestions", SUGGESTIONS_MODEL, cache_hits=1)
+        return _follow_up_cache[key]
+    try:
+        response = tracked_chat_completion(
+            client,
+            "suggestions",
+            model=SUGGESTIONS_MODEL,
+            messages=[system_message, {"role": "user", "content": f"Question: {question}\n\nAnswer: {answer}"}],
+        )
+        questions = [line.strip() for line in (response.choices[0].message.content or "").split("\n") if line.strip()]
+    except Exception as e:
+        print(f"Error suggesting follow-up questions: {e}")
+        return []
+    _follow_up_cache[key] = questions
+    while len(_follow_up_cache) > max_entries:
+        _follow_up_cache.popitem(last=False)
+    return questions
 
 
-def suggest_questions_s(
-    system_message: Dict[str, str],
-    user_message: Dict[str, str]
-    ) -> str:
+def play_audio(audio: bytes, mime: str = "audio/mpeg") -> None:
     """
-    Generates suggested continuation questions or statements based on the provided user message.
+    Plays audio within the Streamlit application, in the format it was received (no decoding or re-encoding).
 
-    This function sends a chat completion request to the OpenAI API with the given system and user messages.
-    It retrieves the AI-generated response, which consists of three suggested continuation sentences
-    that naturally follow from the provided context.
+    Depending on the user's device preference specified in the query parameters, the audio is shown in a
+    player with controls and autoplay (mobile), or played hidden through the page's playback queue.
 
     Args:
-        system_message (Dict[str, str]): A dictionary containing the system prompt for the AI model.
-                                         Typically includes instructions or context for the assistant.
-        user_message (Dict[str, str]): A dictionary containing the user's message or query that the AI
-                                       should respond to with suggestions.
+        audio (bytes): The encoded audio, e.g. the mp3 returned by the TTS API.
+        mime (str, optional): The MIME type of the audio. Defaults to 'audio/mpeg'.
 
     Returns:
-        str: A string containing three suggested continuation sentences, separated by newlines.
-
-    Raises:
-        Exception: If the API request fails or the response format is unexpected.
+        None
     """
-    
-    response = client.chat.completions.create(
-                    model=getenv("OPENAI_MODEL"),
-                    messages=[system_message, user_message],
-                    )
-               
-    odgovor =  response.choices[0].message.content
-    return odgovor
+    opcija = st.query_params.get('opcija', "mobile")
+    if opcija == "mobile":
+        st.audio(audio, format=mime, autoplay=True)
+    else:
+        queue_audio(audio, mime)
 
 
-def handle_question_click(question: str) -> None:
-    """
-    Sets the selected question in the Streamlit session state.
+MEDIA_MIN_BITRATE = 32000  # bit/s, najmanji bitrate TTS mp3, pa je procena trajanja gornja granica
 
-    This function updates the `selected_question` key in Streamlit's session state with the provided
-    question. It is typically used as a callback for Streamlit button clicks to store the user's
-    selected question for further processing.
+
+def media_url(data: bytes, mime: str) -> str:
+    """
+    Returns a URL for bytes served by Streamlit's media endpoint (the same storage `st.audio` uses), so
+    the page fetches the file instead of receiving it inlined; the file is kept until it has played (see
+    `keep_queued_media`). Falls back to a base64 data URL when the Streamlit runtime is not available.
 
     Args:
-        question (str): The question or statement selected by the user via a Streamlit button.
+        data (bytes): The file content.
+        mime (str): Its MIME type.
 
     Returns:
-        None
+        str: The URL of the file.
     """
-    """Set the selected question in the session state."""
-    st.session_state.selected_question = question
+    try:
+        from streamlit import runtime
+
+        if runtime.exists():
+            coordinates = f"krembot.audio.{uuid.uuid4()}"
+            url = runtime.get_instance().media_file_mgr.add(data, mime, coordinates)
+            # fajl se cuva dok se ne odsvira, i ako korisnik u medjuvremenu pokrene novi rerun
+            queued = st.session_state.setdefault("queued_media", [])
+            start = max([time.time()] + [expires for *_, expires in queued])
+            queued.append((data, mime, coordinates, start + len(data) * 8 / MEDIA_MIN_BITRATE + 30))
+            return url
+    except Exception as e:
+        print(f"Error registering media file: {e}")
+    return f"data:{mime};base64,{base64.b64encode(data).decode()}"
 
 
-def predlozeni_odgovori(user_message: Dict[str, str]) -> None:
+def keep_queued_media() -> None:
     """
-    Generates and displays suggested questions or answers based on the user's message.
+    Keeps the media files of queued audio alive until they have played.
 
-    This function utilizes the `suggest_questions_s` function to generate three possible continuation
-    sentences that a user might say based on the provided context. It then splits the AI-generated
-    suggestions into individual questions and creates interactive buttons for each. When a button is
-    clicked, the selected question is stored in the session state for further use.
-
-    Args:
-        user_message (Dict[str, str]): A dictionary containing the user's message or query to which
-                                       suggestions are to be generated.
-
-    Returns:
-        None
+    Streamlit drops a media file at the end of the first rerun that does not add it again, so a segment
+    still waiting in the page's playback queue would return 404 after any interaction. Every run re-adds
+    the queued files (same coordinates, same URL) until their estimated end of playback: the queue is
+    played in order, and the duration is estimated from the size at the lowest bitrate, `MEDIA_MIN_BITRATE`.
+    Call it at the start of every run.
     """
-    
-    odgovor=suggest_questions_s(system_message=system_message, user_message=user_message)
+    now = time.time()
+    queued = [item for item in st.session_state.get("queued_media", []) if item[3] > now]
+    st.session_state["queued_media"] = queued
+    if not queued:
+        return
     try:
-        questions = odgovor.split('\n')
-    except:
-        questions = []
+        from streamlit import runtime
 
-    # Create buttons for each question
-    st.caption("Predložena pitanja/odgovori:")
-    for question in questions:
-        if len(question) > 10:
-            st.button(question, on_click=handle_question_click, args=(question,), key=uuid.uuid4())
-        # Display the selected question
-        st.session_state.prompt = st.session_state.selected_question
-        st.session_state['selected_question'] = None
+        media_file_mgr = runtime.get_instance().media_file_mgr
+        for data, mime, coordinates, _ in queued:
+            media_file_mgr.add(data, mime, coordinates)
+    except Exception as e:
+        print(f"Error keeping media files: {e}")
+
+
+# Segmenti se pustaju redom iz jednog reda u roditeljskom prozoru, pa se nadovezuju bez preklapanja
+AUDIO_QUEUE_HTML = """
+<script>
+const w = window.parent;
+const q = w.__krembotAudioQueue = w.__krembotAudioQueue || {items: [], playing: false};
+q.items.push(%s);
+function next() {
+    if (q.playing || !q.items.length) return;
+    q.playing = true;
+    const audio = new w.Audio(q.items.shift());
+    let done = false;
+    // posle kraja, greske dekodiranja ili odbijenog autoplay-a red ide dalje (jednom po segmentu)
+    const advance = () => { if (done) return; done = true; q.playing = false; next(); };
+    audio.onended = advance;
+    audio.onerror = advance;
+    audio.play().catch(advance);
+}
+next();
+</script>
+"""
+_SENTENCE_END = re.compile(r"[.!?…:;][\"'»”)\]]*\s+|\n+")
+_MARKDOWN_NOISE = re.compile(r"[*_#`>|]+|!?\[([^\]]*)\]\([^)]*\)|https?://\S+")
+
+
+def speakable(text: str) -> str:
+    """
+    Strips markdown markup, links and URLs from text that is read out loud.
+    """
+    text = re.sub(r"(?m)^\s*(?:[-+]|\d+\.)\s+", "", text)
+    return re.sub(r"\s+", " ", _MARKDOWN_NOISE.sub(lambda match: match.group(1) or " ", text)).strip()
 
 
-def play_audio_from_stream_s(full_response: str) -> None:
+def queue_audio(audio: bytes, mime: str = "audio/mpeg") -> None:
+    """
+    Appends an audio segment to the page's playback queue; segments play one after another, in the order queued.
+    The page gets only the media URL of the segment (see `media_url`), not the audio itself.
     """
-    Converts a textual response into spoken audio and plays it within the Streamlit app.
+    import json
+    import streamlit.components.v1 as components
 
-    This function sends the provided textual response to the OpenAI API's audio speech endpoint to
-    generate spoken audio data. It then reads the returned audio bytes, encodes them in base64,
-    and invokes the `set_html_audio` function to embed and play the audio within the Streamlit application.
+    components.html(AUDIO_QUEUE_HTML % json.dumps(media_url(audio, mime)), height=0)
 
-    Args:
-        full_response (str): The complete textual response that needs to be converted into spoken audio.
-
-    Returns:
-        None
 
-    Raises:
-        Exception: If the API request fails or audio processing encounters an error.
-    """
-    spoken_response = client.audio.speech.create(
-        model="tts-1-hd",
-        voice="nova",
-        input=full_response,
-    )
-    spoken_response_bytes = spoken_response.read()
-    buffer = io.BytesIO(spoken_response_bytes)
-    buffer.seek(0)
-    audio_base64 = base64.b64encode(buffer.read()).decode()
-    set_html_audio(audio_base64)
-
-
-def set_html_audio(audio_base64: str) -> None:
+class SpeechPipeline:
     """
-    Embeds and plays base64-encoded audio within the Streamlit application using an HTML audio element.
+    Speaks an answer while it is being streamed.
 
-    Depending on the user's device preference specified in the query parameters, this function creates
-    an HTML audio element with appropriate controls and autoplay settings. The audio is either displayed
-    with controls for mobile devices or hidden with autoplay for other environments.
+    The streamed text is cut at sentence boundaries; every sentence (short ones are merged up to `min_chars`,
+    the first one is sent as soon as it ends) is synthesized as soon as it is complete, several at a time, on
+    the process-wide background loop (`krembot_async`), whose pooled HTTP session keeps the connection to the
+    speech API open between segments and turns. The mp3 segments are queued for playback strictly in order
+    (`queue_audio`).
+    Audio therefore starts one sentence after the text instead of after the whole answer and its TTS.
 
-    Args:
-        audio_base64 (str): The base64-encoded string of the audio data to be played.
+    Mobile browsers (query parameter 'opcija', default 'mobile') block the hidden queue's autoplay, so there
+    the segments are joined when the answer is complete and shown in a visible player (`play_audio`).
+    """
 
-    Returns:
-        None
+    def __init__(
+        self,
+        client: Any,
+        model: Optional[str] = None,
+        voice: str = "nova",
+        min_chars: int = 80,
+        max_workers: int = 4
+    ) -> None:
+        """
+        Initializes the pipeline.
 
-    Raises:
-        None: The function handles the embedding of audio without raising exceptions.
-    """
-    # Create an HTML audio element with autoplay
-    opcija = st.query_params.get('opcija', "mobile")
-    if opcija == "mobile":
-        audio_html = f"""
-            <audio controls autoplay>
-                <source src="data:audio/wav;base64,{audio_base64}" type="audio/wav">
-                Your browser does not support the audio element.
-            </audio>
-            """
-    else:
-        audio_html =  f"""
-            <audio autoplay style="display:none;">
-                <source src="data:audio/wav;base64,{audio_base64}" type="audio/wav">
-                Your browser does not support the audio element.
-            </audio>
-            """
-     # Display the HTML element in the Streamlit app
-    st.markdown(audio_html, unsafe_allow_html=True)
\ No newline at end of file
+        Args:
+            client (Any): The OpenAI client.
+            model (Optional[str], optional): The TTS model. Defaults to the environment variable 'TTS_MODEL' or 'tts-1-hd'.
+            voice (str, optional): The TTS voice. Defaults to 'nova'.
+            min_chars (int, optional): Minimum characters per segment after the first one (20). Defaults to 80.
+            max_workers (int, optional): Concurrent TTS requests. Defaults to 4.
+        """
+        import asyncio
+
+        self.client = client
+        self.model = model or getenv("TTS_MODEL", "tts-1-hd")
+        self.voice = voice
+        self.min_chars = min_chars
+        self._limit = asyncio.Semaphore(max_workers)
+        self._pending = ""
+        self._segments: List[Any] = []
+        self._played = 0
+        self.visible = st.query_params.get('opcija', "mobile") == "mobile"
+
+    def feed(self, delta: str) -> None:
+        """
+        Adds streamed text, sends the completed sentences to TTS and plays the segments that are ready.
+        """
+        self._pending += delta
+        end = 0
+        for match in _SENTENCE_END.finditer(self._pending):
+            # prva recenica ide odmah, da bi zvuk poceo sto pre
+            if match.end() - end >= (self.min_chars if self._segments else 20):
+                self._submit(self._pending[end:match.end()])
+                end = match.end()
+        self._pending = self._pending[end:]
+        if not self.visible:
+            self._play_ready()
+
+    def close(self) -> None:
+        """
+        Sends the rest of the text and plays the remaining segments in order (waits for them, a segment that
+        is not ready within `HTTP_TIMEOUT_SECONDS` is cancelled and skipped); on mobile, plays the whole answer
+        in one visible player.
+        """
+        self._submit(self._pending)
+        self._pending = ""
+        audio = [self._result(segment, HTTP_TIMEOUT_SECONDS) for segment in self._segments[self._played:]]
+        self._played = len(self._segments)
+        if self.visible:
+            # mp3 segmenti se mogu nadovezati bajt po bajt
+            if any(audio):
+                play_audio(b"".join(audio))
+            return
+        for segment in audio:
+            if segment:
+                queue_audio(segment)
+
+    def _submit(self, text: str) -> None:
+        text = speakable(text)
+        if text:
+            # petlja preuzima kontekst pozivaoca, TTS tokeni idu u kolektor ovog zahteva
+            self._segments.append(background_loop().submit(self._synthesize(text)))
+
+    async def _synthesize(self, text: str) -> bytes:
+        async with self._limit:
+            return await cached_speech_async(self.client.api_key, text, model=self.model, voice=self.voice)
+
+    def _play_ready(self) -> None:
+        while self._played < len(self._segments) and self._segments[self._played].done():
+            audio = self._result(self._segments[self._played])
+            if audio:
+                queue_audio(audio)
+            self._played += 1
+
+    @staticmethod
+    def _result(segment: Any, timeout: Optional[float] = None) -> bytes:
+        try:
+            return segment.result(timeout)
+        except Exception as e:
+            segment.cancel()
+            print(f"Error synthesizing speech: {e}")
+            return b""
@@ -0,0 +1,216 @@
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import getenv
+from typing import Any, Dict, List, Optional
+
+from krembot_usage import record_usage, start_request, tracked_chat_completion
+
+SUMMARY_MODEL = getenv("HISTORY_SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_PREFIX = "Sažetak ranijeg dela razgovora:\n"
+SUMMARY_INSTRUCTIONS = """You maintain a running summary of a conversation between a user and an assistant.
+You get the current summary (possibly empty) and the next part of the conversation.
+Return the updated summary in the language of the conversation, at most 200 words: the user's goals, facts,
+names, numbers and decisions that later questions may refer to. Do not add anything that was not said."""
+
+# Budzet istorije po aplikaciji (tokeni), HISTORY_TOKEN_BUDGET ima prednost
+APP_HISTORY_BUDGETS = {
+    "InteliBot": 6000,
+}
+DEFAULT_HISTORY_BUDGET = 3000
+MAX_THREADS = 1000
+
+_encoding: Any = None
+_summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens of a text with tiktoken (o200k_base), or estimates them (4 characters per token)
+    if tiktoken is not installed.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The number of tokens.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """
+    Counts the tokens of one chat message (text parts only, plus the per-message overhead).
+    """
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return count_tokens(str(content)) + 4
+
+
+def history_budget(app_id: Optional[str] = None) -> int:
+    """
+    Returns the history token budget of an app: 'HISTORY_TOKEN_BUDGET', else `APP_HISTORY_BUDGETS`, else
+    `DEFAULT_HISTORY_BUDGET`.
+    """
+    budget = getenv("HISTORY_TOKEN_BUDGET")
+    if budget:
+        return int(budget)
+    return APP_HISTORY_BUDGETS.get(app_id or getenv("APP_ID"), DEFAULT_HISTORY_BUDGET)
+
+
+def split_turns(messages: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """
+    Splits the dialog (user and assistant messages) into turns, each starting with a user message.
+    """
+    turns: List[List[Dict[str, Any]]] = []
+    for message in messages:
+        if message.get("role") == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+class ThreadHistory:
+    """
+    The history sent to the model for one conversation thread: the system messages, a rolling summary of
+    the older turns and the last `keep_turns` turns verbatim, capped at `budget` tokens.
+
+    The summary is updated in the background by a cheap model (`SUMMARY_MODEL`) after each turn, folding in
+    the turns that fell out of the verbatim window, and also the oldest of the last `keep_turns` when the
+    summary and the verbatim turns together exceed `budget` (the last turn always stays verbatim). The
+    budget covers the history only, not the system prompt or the current question and its tool context.
+    Turns the summary does not cover yet are always sent verbatim, so nothing is lost while a summary is
+    being written; until it catches up the history may exceed the budget.
+    """
+
+    def __init__(self, keep_turns: Optional[int] = None, budget: Optional[int] = None) -> None:
+        """
+        Initializes an empty history.
+
+        Args:
+            keep_turns (Optional[int], optional): Turns kept verbatim. Defaults to the environment variable
+                                                  'HISTORY_KEEP_TURNS' or 4.
+            budget (Optional[int], optional): Token budget of the history. Defaults to `history_budget()`.
+        """
+        self.keep_turns: int = keep_turns if keep_turns is not None else int(getenv("HISTORY_KEEP_TURNS", "4"))
+        self.budget: int = budget if budget is not None else history_budget()
+        self.summary: str = ""
+        self.summarized_turns: int = 0
+        self._future: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    def window(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Builds the messages to send instead of the full history, and logs the tokens saved.
+
+        Args:
+            messages (List[Dict[str, Any]]): The thread history (system, user and assistant messages).
+
+        Returns:
+            List[Dict[str, Any]]: System messages, the summary (if any) and the most recent turns.
+        """
+        system = [message for message in messages if message.get("role") == "system"]
+        turns = split_turns([message for message in messages if message.get("role") != "system"])
+        with self._lock:
+            summary, covered = self.summary, min(self.summarized_turns, len(turns))
+
+        result = list(system)
+        if summary:
+            result.append({"role": "system", "content": SUMMARY_PREFIX + summary})
+        # potezi koje sazetak jos ne pokriva se nikad ne izbacuju, budzet se postize sazimanjem (update)
+        result += [message for turn in turns[covered:] for message in turn]
+
+        saved = sum(message_tokens(message) for message in messages) - sum(message_tokens(message) for message in result)
+        if saved > 0:
+            record_usage("history", getenv("OPENAI_MODEL"), saved_tokens=saved)
+        return result
+
+    def update(self, client: Any, messages: List[Dict[str, Any]], app_id: Optional[str] = None) -> None:
+        """
+        Starts a background summary of the turns older than the verbatim window (or that do not fit in the
+        budget next to the summary), if there are new ones and no summary is being written.
+
+        Args:
+            client (Any): The OpenAI client.
+            messages (List[Dict[str, Any]]): The thread history after the turn.
+            app_id (Optional[str], optional): The application identifier for the token log.
+        """
+        turns = split_turns([message for message in messages if message.get("role") != "system"])
+        target = max(len(turns) - self.keep_turns, 0)
+        sizes = [sum(message_tokens(message) for message in turn) for turn in turns]
+        with self._lock:
+            available = self.budget - (message_tokens({"content": SUMMARY_PREFIX + self.summary}) if self.summary else 0)
+            # najstariji potezi se sazimaju dok ostatak ne stane u budzet, poslednji potez ostaje doslovno
+            target = max(target, self.summarized_turns)
+            while target < len(turns) - 1 and sum(sizes[target:]) > available:
+                target += 1
+            if target <= self.summarized_turns or (self._future is not None and not self._future.done()):
+                return
+            start, summary = self.summarized_turns, self.summary
+            self._future = _summarizer.submit(self._summarize, client, summary, turns[start:target], target, app_id)
+
+    def _summarize(self, client: Any, summary: str, turns: List[List[Dict[str, Any]]], target: int, app_id: Optional[str]) -> None:
+        """
+        Folds `turns` into the summary with the summary model; runs in the summarizer pool.
+        """
+        usage = start_request(app_id)
+        transcript = "\n".join(
+            f"{message['role']}: {message.get('content') or ''}" for turn in turns for message in turn
+        )
+        try:
+            response = tracked_chat_completion(
+                client,
+                "history_summary",
+                model=SUMMARY_MODEL,
+                temperature=0.0,
+                messages=[
+                    {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                    {"role": "user", "content": f"Current summary:\n{summary or '(empty)'}\n\nConversation:\n{transcript}"},
+                ],
+            )
+            new_summary = (response.choices[0].message.content or "").strip()
+        except Exception as e:
+            print(f"Error summarizing history: {e}")
+            return
+        finally:
+            usage.flush()
+        with self._lock:
+            if target > self.summarized_turns:
+                self.summary, self.summarized_turns = new_summary, target
+
+
+_histories: "OrderedDict[str, ThreadHistory]" = OrderedDict()
+_histories_lock = threading.Lock()
+
+
+def thread_history(thread_id: str) -> ThreadHistory:
+    """
+    Returns the history of a conversation thread, creating it on first use (the least recently used
+    threads are dropped beyond `MAX_THREADS`).
+
+    Args:
+        thread_id (str): The thread identifier.
+
+    Returns:
+        ThreadHistory: The history of the thread.
+    """
+    with _histories_lock:
+        history = _histories.get(thread_id)
+        if history is None:
+            history = _histories[thread_id] = ThreadHistory()
+            while len(_histories) > MAX_THREADS:
+                _histories.popitem(last=False)
+        _histories.move_to_end(thread_id)
+        return history
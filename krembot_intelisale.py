@@ -0,0 +1,982 @@
+import csv
+import json
+import re
+import threading
+import time
+import unicodedata
+
+from os import getenv
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from krembot_db import ConversationDatabase, like_pattern
+
+# Kolone snapshot-a, imenovane kao u izvornom upitu da bi formatiranje izvestaja ostalo isto
+SNAPSHOT_COLUMNS = [
+    "CustomerId",
+    "Code",
+    "cn",
+    "Branch",
+    "BlueCoatsNo",
+    "PlanCurrentYear",
+    "TurnoverCurrentYear",
+    "FullfilmentCurrentYear",
+    "PlaniraniIznosPoPoseti",
+    "CalculatedNumberOfVisits",
+    "PaymentAvgDays",
+    "BalanceOutOfLimit",
+    "BalanceCritical",
+    "PoslednjaBeleska",
+]
+
+SNAPSHOT_SELECT = """
+SELECT
+    CustomerId, Code, Name AS cn, Branch, BlueCoatsNo, PlanCurrentYear, TurnoverCurrentYear, FullfilmentCurrentYear,
+    PlannedAmountPerVisit AS PlaniraniIznosPoPoseti, CalculatedNumberOfVisits, PaymentAvgDays, BalanceOutOfLimit,
+    BalanceCritical, LastVisitNote AS PoslednjaBeleska
+FROM customer_snapshot
+"""
+
+# Isti rezultat kao snapshot, racunat direktno iz customers/activities (ROW_NUMBER umesto korelisanog MAX podupita)
+LIVE_SELECT = """
+SELECT
+    c.CustomerId, c.Code, c.Name AS cn, c.Branch, c.BlueCoatsNo, c.PlanCurrentYear, c.TurnoverCurrentYear,
+    c.FullfilmentCurrentYear,
+    CASE
+        WHEN c.CalculatedNumberOfVisits = 0 OR c.CalculatedNumberOfVisits IS NULL THEN 0
+        ELSE c.Plan12Months / 12 / NULLIF(c.CalculatedNumberOfVisits, 0)
+    END AS PlaniraniIznosPoPoseti,
+    c.CalculatedNumberOfVisits, c.PaymentAvgDays, c.BalanceOutOfLimit, c.BalanceCritical,
+    v.ActivityLogNoteContent AS PoslednjaBeleska
+FROM customers c
+OUTER APPLY (
+    SELECT TOP (1) a.ActivityLogNoteContent
+    FROM activities a
+    WHERE a.CustomerID = c.CustomerId AND a.VisitStartDayTypeDescription = 'Poseta'
+    ORDER BY a.VisitArrivalTime DESC
+) v
+"""
+
+_SQL_OPERATORS = {"eq": "=", "ne": "<>", "gt": ">", "ge": ">=", "lt": "<", "le": "<="}
+_COLUMN_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def selector_sql(selector: Dict[str, Any], alias: str = "") -> Tuple[str, List[Any]]:
+    """
+    Translates a customer selector into a SQL condition on the `customers` table.
+
+    A selector uses the same `column=value` / `column__op=value` form as the columnar engine
+    (`krembot_intelisale_data.IntelisaleData.where`), e.g. {"Branch": "DIY Sistemi", "BalanceOutOfLimit__gt": 0}.
+
+    Args:
+        selector (Dict[str, Any]): The conditions, combined with AND.
+        alias (str, optional): Table alias prefix, e.g. 'c.'. Defaults to ''.
+
+    Returns:
+        Tuple[str, List[Any]]: The condition (without WHERE) and its parameters.
+
+    Raises:
+        ValueError: If a column name or operator is not valid.
+    """
+    conditions, params = [], []
+    for key, value in selector.items():
+        column, _, op = key.partition("__")
+        op = op or "eq"
+        if not _COLUMN_RE.match(column):
+            raise ValueError(f"Invalid selector column: {column}")
+        if op in _SQL_OPERATORS:
+            conditions.append(f"{alias}{column} {_SQL_OPERATORS[op]} ?")
+            params.append(value)
+        elif op == "in":
+            conditions.append(f"{alias}{column} IN (SELECT value FROM OPENJSON(?))")
+            params.append(json.dumps([str(item) for item in value]))
+        elif op == "contains":
+            conditions.append(f"{alias}{column} LIKE ?")
+            params.append(like_pattern(str(value)))
+        else:
+            raise ValueError(f"Invalid selector operator: {op}")
+    return " AND ".join(conditions) or "1 = 1", params
+
+
+class IntelisaleDatabase(ConversationDatabase):
+    """
+    A connection to the Intelisale database that maintains and queries the `customer_snapshot` table.
+
+    The Intelisale report needs, per customer, the customer's plan and balance columns together with
+    the note of the latest visit. Computing the latest visit on every request (a correlated MAX subquery
+    per activity row) grows with the size of `activities`, so it is precomputed: `customer_snapshot`
+    holds one row per customer with everything the report needs, and a per-request lookup is a single
+    index seek. The snapshot is refreshed incrementally by `refresh_snapshot`, normally from the
+    background job started by `start_snapshot_refresh`.
+    """
+
+    def __init__(self, database: Optional[str] = None, **kwargs: Any) -> None:
+        """
+        Initializes the connection parameters.
+
+        Args:
+            database (Optional[str], optional): The database name. Defaults to the environment variable
+                                                'INTELISALE_DB' or 'IntelisaleTest'.
+            **kwargs (Any): host, user and password, as for `ConversationDatabase`.
+        """
+        super().__init__(database=database or getenv("INTELISALE_DB", "IntelisaleTest"), **kwargs)
+
+    def create_snapshot_table(self) -> None:
+        """
+        Creates the `customer_snapshot` and `customer_snapshot_state` tables and the supporting indexes.
+
+        Besides the snapshot itself this adds an index on `activities` that serves both the incremental
+        refresh (new visits since the watermark) and the live fallback query (latest visit per customer).
+
+        Returns:
+            None
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        create_sql = """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='customer_snapshot' AND xtype='U')
+        CREATE TABLE customer_snapshot (
+            CustomerId INT NOT NULL PRIMARY KEY,
+            Code NVARCHAR(50) NULL,
+            Name NVARCHAR(255) NULL,
+            Branch NVARCHAR(255) NULL,
+            BlueCoatsNo DECIMAL(18, 2) NULL,
+            PlanCurrentYear DECIMAL(18, 2) NULL,
+            TurnoverCurrentYear DECIMAL(18, 2) NULL,
+            FullfilmentCurrentYear DECIMAL(18, 2) NULL,
+            PlannedAmountPerVisit DECIMAL(18, 2) NULL,
+            CalculatedNumberOfVisits DECIMAL(18, 2) NULL,
+            PaymentAvgDays DECIMAL(18, 2) NULL,
+            BalanceOutOfLimit DECIMAL(18, 2) NULL,
+            BalanceCritical DECIMAL(18, 2) NULL,
+            LastVisitTime DATETIME2 NULL,
+            LastVisitNote NVARCHAR(MAX) NULL,
+            RefreshedAt DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+        );
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_customer_snapshot_Name')
+            CREATE INDEX IX_customer_snapshot_Name ON customer_snapshot (Name);
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_customer_snapshot_Code')
+            CREATE INDEX IX_customer_snapshot_Code ON customer_snapshot (Code);
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='customer_snapshot_state' AND xtype='U')
+        CREATE TABLE customer_snapshot_state (
+            Id INT NOT NULL PRIMARY KEY,
+            VisitWatermark DATETIME2 NULL,
+            RefreshedAt DATETIME2 NULL
+        );
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_activities_visit')
+            CREATE INDEX IX_activities_visit ON activities (VisitStartDayTypeDescription, CustomerID, VisitArrivalTime DESC)
+            INCLUDE (ActivityLogNoteContent);
+        """
+        try:
+            self.cursor.execute(create_sql)
+            self.conn.commit()
+        except Exception as e:
+            print(f"Error creating customer snapshot tables: {e}")
+            raise
+
+    def refresh_snapshot(self, full: bool = False) -> Dict[str, Any]:
+        """
+        Brings `customer_snapshot` up to date in one transaction.
+
+        The customer columns (plan, turnover, balances, planned amount per visit) are merged set-based
+        from `customers`, a single scan of the customer table. Visit notes are maintained incrementally:
+        only visits that arrived after the stored watermark are read, the latest one per customer is
+        picked with ROW_NUMBER, and it replaces the snapshot note only if it is newer. Customers that
+        have no note yet (new customers) are always looked up. A full refresh resets the watermark and
+        recomputes every note, which also picks up activities edited after they were first seen.
+
+        Args:
+            full (bool, optional): Recompute the visit notes from all activities. Defaults to False.
+
+        Returns:
+            Dict[str, Any]: The old and new watermark, the number of visit notes updated and the duration in seconds.
+
+        Raises:
+            Exception: If there is an error executing the SQL statements (the transaction is rolled back).
+        """
+        start = time.perf_counter()
+        merge_customers_sql = """
+        MERGE customer_snapshot AS s
+        USING (
+            SELECT
+                CustomerId, Code, Name, Branch, BlueCoatsNo, PlanCurrentYear, TurnoverCurrentYear, FullfilmentCurrentYear,
+                CASE
+                    WHEN CalculatedNumberOfVisits = 0 OR CalculatedNumberOfVisits IS NULL THEN 0
+                    ELSE Plan12Months / 12 / NULLIF(CalculatedNumberOfVisits, 0)
+                END AS PlannedAmountPerVisit,
+                CalculatedNumberOfVisits, PaymentAvgDays, BalanceOutOfLimit, BalanceCritical
+            FROM customers
+        ) AS c ON s.CustomerId = c.CustomerId
+        WHEN MATCHED THEN UPDATE SET
+            Code = c.Code, Name = c.Name, Branch = c.Branch, BlueCoatsNo = c.BlueCoatsNo,
+            PlanCurrentYear = c.PlanCurrentYear, TurnoverCurrentYear = c.TurnoverCurrentYear,
+            FullfilmentCurrentYear = c.FullfilmentCurrentYear, PlannedAmountPerVisit = c.PlannedAmountPerVisit,
+            CalculatedNumberOfVisits = c.CalculatedNumberOfVisits, PaymentAvgDays = c.PaymentAvgDays,
+            BalanceOutOfLimit = c.BalanceOutOfLimit, BalanceCritical = c.BalanceCritical, RefreshedAt = SYSUTCDATETIME()
+        WHEN NOT MATCHED BY TARGET THEN INSERT (
+            CustomerId, Code, Name, Branch, BlueCoatsNo, PlanCurrentYear, TurnoverCurrentYear, FullfilmentCurrentYear,
+            PlannedAmountPerVisit, CalculatedNumberOfVisits, PaymentAvgDays, BalanceOutOfLimit, BalanceCritical
+        ) VALUES (
+            c.CustomerId, c.Code, c.Name, c.Branch, c.BlueCoatsNo, c.PlanCurrentYear, c.TurnoverCurrentYear,
+            c.FullfilmentCurrentYear, c.PlannedAmountPerVisit, c.CalculatedNumberOfVisits, c.PaymentAvgDays,
+            c.BalanceOutOfLimit, c.BalanceCritical
+        )
+        WHEN NOT MATCHED BY SOURCE THEN DELETE;
+        """
+        merge_visits_sql = """
+        UPDATE s SET LastVisitTime = v.VisitArrivalTime, LastVisitNote = v.ActivityLogNoteContent
+        FROM customer_snapshot s
+        JOIN (
+            SELECT CustomerID, VisitArrivalTime, ActivityLogNoteContent,
+                   ROW_NUMBER() OVER (PARTITION BY CustomerID ORDER BY VisitArrivalTime DESC) AS rn
+            FROM activities
+            WHERE VisitStartDayTypeDescription = 'Poseta'
+              AND (
+                  ? IS NULL OR VisitArrivalTime > ?
+                  -- novi kupci (jos bez beleske) dobijaju poslednju posetu i ako je starija od watermark-a
+                  OR CustomerID IN (SELECT CustomerId FROM customer_snapshot WHERE LastVisitTime IS NULL)
+              )
+        ) v ON v.CustomerID = s.CustomerId AND v.rn = 1
+        WHERE s.LastVisitTime IS NULL OR v.VisitArrivalTime > s.LastVisitTime;
+        """
+        try:
+            self.cursor.execute("SELECT VisitWatermark FROM customer_snapshot_state WHERE Id = 1")
+            row = self.cursor.fetchone()
+            watermark = None if full or row is None else row[0]
+            self.cursor.execute(
+                "SELECT MAX(VisitArrivalTime) FROM activities WHERE VisitStartDayTypeDescription = 'Poseta'"
+            )
+            new_watermark = self.cursor.fetchone()[0]
+
+            self.cursor.execute(merge_customers_sql)
+            if full:
+                self.cursor.execute("UPDATE customer_snapshot SET LastVisitTime = NULL, LastVisitNote = NULL")
+            self.cursor.execute(merge_visits_sql, (watermark, watermark))
+            visits_updated = self.cursor.rowcount
+            self.cursor.execute(
+                """
+                MERGE customer_snapshot_state AS t
+                USING (SELECT 1 AS Id) AS src ON t.Id = src.Id
+                WHEN MATCHED THEN UPDATE SET VisitWatermark = ?, RefreshedAt = SYSUTCDATETIME()
+                WHEN NOT MATCHED THEN INSERT (Id, VisitWatermark, RefreshedAt) VALUES (1, ?, SYSUTCDATETIME());
+                """,
+                (new_watermark, new_watermark),
+            )
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error refreshing customer snapshot: {e}")
+            raise
+        return {
+            "watermark": watermark,
+            "new_watermark": new_watermark,
+            "visits_updated": visits_updated,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+    def fetch_customers_by_name(self, name: str) -> List[Any]:
+        """
+        Retrieves the report rows of the customers with the given name (an index seek on the snapshot).
+
+        Args:
+            name (str): The exact customer name.
+
+        Returns:
+            List[Any]: Rows with the columns listed in `SNAPSHOT_COLUMNS`.
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        self.cursor.execute(SNAPSHOT_SELECT + " WHERE Name = ?", (name,))
+        return self.cursor.fetchall()
+
+    def fetch_customers_by_ids(self, customer_ids: Sequence[int]) -> List[Any]:
+        """
+        Retrieves the report rows of the given customers from the snapshot, in one query.
+
+        Args:
+            customer_ids (Sequence[int]): The customer ids.
+
+        Returns:
+            List[Any]: Rows with the columns listed in `SNAPSHOT_COLUMNS`.
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        if not customer_ids:
+            return []
+        # OPENJSON drzi upit jednim parametrom bez obzira na broj kupaca
+        self.cursor.execute(
+            SNAPSHOT_SELECT + " WHERE CustomerId IN (SELECT CAST(value AS INT) FROM OPENJSON(?))",
+            (f"[{','.join(str(int(customer_id)) for customer_id in customer_ids)}]",),
+        )
+        return self.cursor.fetchall()
+
+    def fetch_customers_where(self, selector: Dict[str, Any]) -> List[Any]:
+        """
+        Retrieves the report rows of every customer matching a selector, in one set-based query.
+
+        Args:
+            selector (Dict[str, Any]): Conditions on the `customers` columns (see `selector_sql`).
+
+        Returns:
+            List[Any]: Rows with the columns listed in `SNAPSHOT_COLUMNS`.
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        condition, params = selector_sql(selector)
+        self.cursor.execute(
+            SNAPSHOT_SELECT + f" WHERE CustomerId IN (SELECT CustomerId FROM customers WHERE {condition})",
+            tuple(params),
+        )
+        return self.cursor.fetchall()
+
+    def fetch_branches(self) -> List[str]:
+        """
+        Retrieves the distinct customer branches.
+
+        Returns:
+            List[str]: The branch names.
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        self.cursor.execute("SELECT DISTINCT Branch FROM customers WHERE Branch IS NOT NULL")
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def fetch_customer_names(self) -> List[Tuple[int, str, str]]:
+        """
+        Retrieves the id, code and name of every customer, for building the name index.
+
+        Returns:
+            List[Tuple[int, str, str]]: (CustomerId, Code, Name) for every customer.
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        self.cursor.execute("SELECT CustomerId, Code, Name FROM customers")
+        return [(row[0], row[1], row[2]) for row in self.cursor.fetchall()]
+
+    def fetch_customers_live(
+        self,
+        name: Optional[str] = None,
+        customer_ids: Optional[Sequence[int]] = None,
+        selector: Optional[Dict[str, Any]] = None
+    ) -> List[Any]:
+        """
+        Computes the report rows directly from `customers` and `activities`, bypassing the snapshot.
+
+        Used when the snapshot table does not exist yet.
+
+        Args:
+            name (Optional[str], optional): The exact customer name.
+            customer_ids (Optional[Sequence[int]], optional): The customer ids, used instead of the name if given.
+            selector (Optional[Dict[str, Any]], optional): Conditions on the `customers` columns, used instead of
+                                                           the name and ids if given (see `selector_sql`).
+
+        Returns:
+            List[Any]: Rows with the columns listed in `SNAPSHOT_COLUMNS`.
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        if selector is not None:
+            condition, params = selector_sql(selector, alias="c.")
+            self.cursor.execute(LIVE_SELECT + f" WHERE {condition}", tuple(params))
+        elif customer_ids:
+            self.cursor.execute(
+                LIVE_SELECT + " WHERE c.CustomerId IN (SELECT CAST(value AS INT) FROM OPENJSON(?))",
+                (f"[{','.join(str(int(customer_id)) for customer_id in customer_ids)}]",),
+            )
+        else:
+            self.cursor.execute(LIVE_SELECT + " WHERE c.Name = ?", (name,))
+        return self.cursor.fetchall()
+
+
+def use_local_data() -> bool:
+    """
+    Returns True when Intelisale data is served from the local columnar exports instead of MSSQL
+    (environment variable 'INTELISALE_SOURCE' set to 'local').
+    """
+    return getenv("INTELISALE_SOURCE", "db").lower() == "local"
+
+
+def fetch_customer_rows(name: Optional[str] = None, customer_ids: Optional[Sequence[int]] = None) -> List[Any]:
+    """
+    Returns the report rows for a customer name or a list of CustomerIds, from the snapshot or, if it
+    is unavailable, live. With `use_local_data()` the rows come from the columnar exports instead.
+
+    Args:
+        name (Optional[str], optional): The exact customer name.
+        customer_ids (Optional[Sequence[int]], optional): The customer ids, used instead of the name if given.
+
+    Returns:
+        List[Any]: Rows with the columns listed in `SNAPSHOT_COLUMNS`.
+    """
+    if use_local_data():
+        from krembot_intelisale_data import intelisale_data
+
+        data = intelisale_data()
+        if not customer_ids:
+            customer_ids = data.where(Name=name)["CustomerId"].tolist()
+        return data.report_rows(customer_ids)
+
+    with IntelisaleDatabase() as db:
+        try:
+            if customer_ids:
+                return db.fetch_customers_by_ids(customer_ids)
+            return db.fetch_customers_by_name(name)
+        except Exception as e:
+            print(f"Customer snapshot unavailable, querying live: {e}")
+            return db.fetch_customers_live(name, customer_ids)
+
+
+def fetch_customer_rows_where(selector: Dict[str, Any]) -> List[Any]:
+    """
+    Returns the report rows of every customer matching a selector, in one query (or one vectorized
+    filter with `use_local_data()`).
+
+    Customer attributes are given under the key 'Attributes' as attribute name to value(s), e.g.
+    {"Branch": "DIY Sistemi", "Attributes": {"Ugovor": "Ne"}}. They are resolved to customer ids by
+    intersecting the bitmaps of the attribute matrix (`krembot_intelisale_data.AttributeMatrix`, built
+    from the Attributes export) and combined with the other conditions on the customer snapshot.
+
+    Args:
+        selector (Dict[str, Any]): Conditions on the customer columns (see `selector_sql`) and attributes.
+
+    Returns:
+        List[Any]: Rows with the columns listed in `SNAPSHOT_COLUMNS`.
+    """
+    conditions = {key: value for key, value in selector.items() if key != "Attributes"}
+    attributes = selector.get("Attributes")
+    if use_local_data():
+        from krembot_intelisale_data import attribute_matrix, intelisale_data
+
+        data = intelisale_data()
+        mask = data.mask(**conditions)
+        if attributes:
+            mask &= attribute_matrix().mask(attributes)
+        return data.report_rows(data.customers["CustomerId"].to_numpy()[mask].tolist())
+
+    if attributes:
+        from krembot_intelisale_data import attribute_matrix
+
+        customer_ids = attribute_matrix().customer_ids_where(attributes).tolist()
+        if not customer_ids:
+            return []
+        conditions["CustomerId__in"] = customer_ids
+    with IntelisaleDatabase() as db:
+        try:
+            return db.fetch_customers_where(conditions)
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"Customer snapshot unavailable, querying live: {e}")
+            return db.fetch_customers_live(selector=conditions)
+
+
+def growth_insights() -> Optional[Any]:
+    """
+    Returns the growth index over the PGP export (see `krembot_intelisale_data.GrowthIndex`), or None
+    when it is disabled ('INTELISALE_GROWTH' set to 0) or the exports cannot be loaded.
+
+    Returns:
+        Optional[Any]: The shared `GrowthIndex`, or None.
+    """
+    if getenv("INTELISALE_GROWTH", "1") == "0":
+        return None
+    try:
+        from krembot_intelisale_data import growth_index
+
+        return growth_index()
+    except Exception as e:
+        print(f"Growth insights unavailable: {e}")
+        return None
+
+
+_refresh_thread: Optional[threading.Thread] = None
+_refresh_lock = threading.Lock()
+
+
+def start_snapshot_refresh(interval_seconds: Optional[float] = None) -> None:
+    """
+    Starts the daemon thread that keeps `customer_snapshot` up to date. Calling it again is a no-op.
+
+    The first pass creates the snapshot tables if needed. With several app workers running each one
+    refreshes, which is harmless since the refresh is idempotent. To run the refresh from a scheduled
+    job instead, set the interval to 0 and call `IntelisaleDatabase().refresh_snapshot()` from the job.
+
+    Args:
+        interval_seconds (Optional[float], optional): Seconds between refreshes. Defaults to the environment
+            variable 'INTELISALE_SNAPSHOT_REFRESH_SECONDS' or 300. A value of 0 disables the job.
+
+    Returns:
+        None
+    """
+    global _refresh_thread
+    interval = float(
+        interval_seconds if interval_seconds is not None else getenv("INTELISALE_SNAPSHOT_REFRESH_SECONDS", "300")
+    )
+    with _refresh_lock:
+        if interval <= 0 or use_local_data() or (_refresh_thread is not None and _refresh_thread.is_alive()):
+            return
+
+        def run() -> None:
+            created = False
+            while True:
+                try:
+                    with IntelisaleDatabase() as db:
+                        if not created:
+                            db.create_snapshot_table()
+                            created = True
+                        stats = db.refresh_snapshot()
+                    print(f"Customer snapshot refreshed: {stats}")
+                except Exception as e:
+                    print(f"Error in customer snapshot job: {e}")
+                time.sleep(interval)
+
+        _refresh_thread = threading.Thread(target=run, name="customer-snapshot-refresh", daemon=True)
+        _refresh_thread.start()
+
+
+CUSTOMERS_CSV = "Clients/Intelisale/Intelisale_Customers.csv"
+CODE_KEYWORDS = {"sifra", "sifru", "sifrom", "sifre", "code", "kod", "koda"}
+
+_CYRILLIC = dict(zip(
+    "абвгдђежзијклљмнњопрстћуфхцчџш",
+    ["a", "b", "v", "g", "d", "dj", "e", "z", "z", "i", "j", "k", "l", "lj", "m", "n", "nj", "o", "p", "r", "s",
+     "t", "c", "u", "f", "h", "c", "c", "dz", "s"],
+))
+_SPECIAL = {"đ": "dj", "ß": "ss", "æ": "ae", "ø": "o", "ł": "l"}
+_TOKEN_RE = re.compile(r"[a-z]+|[0-9]+")
+
+
+def fold(text: str) -> str:
+    """
+    Normalizes text for name matching: lower case, Cyrillic transliterated, diacritics removed and
+    punctuation collapsed to single spaces, letters and digits split ('Đorđević d.o.o.' -> 'djordjevic d o o',
+    'Customer15' -> 'customer 15').
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The folded text.
+    """
+    text = "".join(_CYRILLIC.get(ch, _SPECIAL.get(ch, ch)) for ch in (text or "").lower())
+    text = "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+    return " ".join(_TOKEN_RE.findall(text))
+
+
+def levenshtein_ratio(a: str, b: str) -> float:
+    """
+    Returns 1 - edit_distance / max(len(a), len(b)), 1.0 for identical strings.
+    """
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return 1.0 - previous[-1] / len(a)
+
+
+def _trigrams(folded: str) -> List[str]:
+    padded = f" {folded} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class CustomerMatch(NamedTuple):
+    customer_id: int
+    name: str
+    code: str
+    score: float
+    matched_on: str
+
+
+class CustomerNameIndex:
+    """
+    An in-memory index that resolves customer names and codes mentioned in a user query to CustomerIds.
+
+    Names are folded (case, diacritics, Cyrillic, punctuation) so 'Đorđević' and 'djordjevic' are the
+    same key. A query is resolved in order of confidence: an exact folded name anywhere in the text, a
+    customer code (a zero-padded number or one introduced by 'šifra'/'code'), a number that appears in
+    exactly the customer's name ('klijent 44' -> 'Customer 44'), and finally fuzzy matching, where
+    trigram posting lists propose candidates for each word window of the query and a Levenshtein ratio
+    on the folded strings scores them. Only the rarest trigrams of a window are used for candidate
+    generation, so common words in names (e.g. 'doo') do not turn a lookup into a scan.
+    """
+
+    def __init__(self, customers: Iterable[Tuple[int, str, str]]) -> None:
+        """
+        Builds the index.
+
+        Args:
+            customers (Iterable[Tuple[int, str, str]]): (CustomerId, Code, Name) for every customer.
+        """
+        self.built_at: float = time.time()
+        self.entries: List[Tuple[int, str, str]] = []
+        self.folded: List[str] = []
+        self.by_name: Dict[str, List[int]] = {}
+        self.by_code: Dict[str, List[int]] = {}
+        self.by_number: Dict[str, List[int]] = {}
+        self.trigrams: Dict[str, List[int]] = {}
+        self.max_words: int = 1
+        for customer_id, code, name in customers:
+            entry = len(self.entries)
+            folded = fold(name)
+            self.entries.append((int(customer_id), code or "", name or ""))
+            self.folded.append(folded)
+            self.by_name.setdefault(folded, []).append(entry)
+            code = (code or "").strip().lower()
+            if code:
+                self.by_code.setdefault(code, []).append(entry)
+                if code.lstrip("0") and code.lstrip("0") != code:
+                    self.by_code.setdefault(code.lstrip("0"), []).append(entry)
+            words = folded.split()
+            self.max_words = max(self.max_words, len(words))
+            for number in {word.lstrip("0") or "0" for word in words if word.isdigit()}:
+                self.by_number.setdefault(number, []).append(entry)
+            for trigram in set(_trigrams(folded)):
+                self.trigrams.setdefault(trigram, []).append(entry)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _match(self, entry: int, score: float, matched_on: str) -> CustomerMatch:
+        customer_id, code, name = self.entries[entry]
+        return CustomerMatch(customer_id, name, code, score, matched_on)
+
+    def _fuzzy(self, window: str, min_score: float, max_candidates: int = 20) -> Dict[int, float]:
+        grams = sorted(set(_trigrams(window)), key=lambda g: len(self.trigrams.get(g, ())))
+        counts: Dict[int, int] = {}
+        for gram in grams[:8]:
+            for entry in self.trigrams.get(gram, ()):
+                counts[entry] = counts.get(entry, 0) + 1
+        best = sorted(counts, key=counts.__getitem__, reverse=True)[:max_candidates]
+        scores = {}
+        for entry in best:
+            score = levenshtein_ratio(window, self.folded[entry])
+            if score >= min_score:
+                scores[entry] = score
+        return scores
+
+    def resolve(self, text: str, limit: int = 5, min_score: float = 0.75) -> List[CustomerMatch]:
+        """
+        Finds the customers mentioned in a free-text query.
+
+        Args:
+            text (str): The user query (or just a name or code).
+            limit (int, optional): Maximum number of matches returned. Defaults to 5.
+            min_score (float, optional): Minimum fuzzy similarity. Defaults to 0.75.
+
+        Returns:
+            List[CustomerMatch]: Matches ordered by descending score (1.0 for exact name or code matches).
+        """
+        words = fold(text).split()
+        if not words:
+            return []
+        windows = [
+            (start, size, " ".join(words[start:start + size]))
+            for size in range(min(self.max_words, len(words)), 0, -1)
+            for start in range(len(words) - size + 1)
+        ]
+        # najduzi tacan naziv u tekstu ima prednost
+        for _, _, window in windows:
+            if window in self.by_name:
+                return [self._match(entry, 1.0, "name") for entry in self.by_name[window]][:limit]
+
+        scores: Dict[int, Tuple[float, str]] = {}
+        for i, word in enumerate(words):
+            if not word.isdigit():
+                continue
+            after_keyword = i > 0 and words[i - 1] in CODE_KEYWORDS
+            if word in self.by_code and (after_keyword or word.startswith("0") or word not in self.by_number):
+                for entry in self.by_code[word]:
+                    scores[entry] = (1.0, "code")
+            elif not after_keyword and len(self.by_number.get(word.lstrip("0") or "0", ())) == 1:
+                entry = self.by_number[word.lstrip("0") or "0"][0]
+                scores.setdefault(entry, (0.95, "number"))
+        if not scores:
+            for _, _, window in windows:
+                if len(window) < 3:
+                    continue
+                for entry, score in self._fuzzy(window, min_score).items():
+                    if score > scores.get(entry, (0.0, ""))[0]:
+                        scores[entry] = (score, "fuzzy")
+        ranked = sorted(scores.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        return [self._match(entry, score, matched_on) for entry, (score, matched_on) in ranked]
+
+    def resolve_ids(self, text: str, min_confidence: float = 0.9, margin: float = 0.05) -> Optional[List[int]]:
+        """
+        Resolves a query to CustomerIds only when the match is unambiguous.
+
+        The best match must score at least `min_confidence` and every other match with a different
+        name must score at least `margin` lower. Several customers sharing the best name are all
+        returned, as the exact-name SQL lookup did.
+
+        Args:
+            text (str): The user query.
+            min_confidence (float, optional): Minimum score of the best match. Defaults to 0.9.
+            margin (float, optional): Required lead over differently named matches. Defaults to 0.05.
+
+        Returns:
+            Optional[List[int]]: The CustomerIds, or None if the query is ambiguous or names no customer.
+        """
+        matches = self.resolve(text)
+        if not matches or matches[0].score < min_confidence:
+            return None
+        def key(match: CustomerMatch) -> Tuple[str, str]:
+            return ("code", match.code) if match.matched_on == "code" else ("name", fold(match.name))
+
+        best = matches[0]
+        top = [m for m in matches if key(m) == key(best)]
+        if any(m.score > best.score - margin for m in matches if m not in top):
+            return None
+        return [m.customer_id for m in top]
+
+
+def load_customer_names(csv_path: Optional[str] = None) -> List[Tuple[int, str, str]]:
+    """
+    Loads (CustomerId, Code, Name) for every customer from the Intelisale database, or from the CSV
+    export if the database is not reachable or `use_local_data()` is set.
+
+    Args:
+        csv_path (Optional[str], optional): The CSV export. Defaults to the environment variable
+                                            'INTELISALE_CUSTOMERS_CSV' or `CUSTOMERS_CSV`.
+
+    Returns:
+        List[Tuple[int, str, str]]: The customers.
+    """
+    if not use_local_data():
+        try:
+            with IntelisaleDatabase() as db:
+                return db.fetch_customer_names()
+        except Exception as e:
+            print(f"Loading customer names from CSV, database unavailable: {e}")
+    with open(csv_path or getenv("INTELISALE_CUSTOMERS_CSV", CUSTOMERS_CSV), "r", encoding="utf-8-sig", newline="") as f:
+        return [(int(row["CustomerId"]), row["Code"], row["Name"]) for row in csv.DictReader(f)]
+
+
+_name_index: Optional[CustomerNameIndex] = None
+_name_index_lock = threading.Lock()
+_name_index_rebuilding = False
+
+
+def customer_name_index() -> CustomerNameIndex:
+    """
+    Returns the process-wide customer name index, building it on first use.
+
+    When the index is older than 'INTELISALE_NAME_INDEX_SECONDS' (default 900) it is rebuilt in a
+    background thread, the current index keeps serving until the new one is swapped in.
+
+    Returns:
+        CustomerNameIndex: The shared index.
+    """
+    global _name_index, _name_index_rebuilding
+    if _name_index is None:
+        with _name_index_lock:
+            if _name_index is None:
+                _name_index = CustomerNameIndex(load_customer_names())
+        return _name_index
+
+    max_age = float(getenv("INTELISALE_NAME_INDEX_SECONDS", "900"))
+    if max_age > 0 and time.time() - _name_index.built_at > max_age and not _name_index_rebuilding:
+        _name_index_rebuilding = True
+
+        def rebuild() -> None:
+            global _name_index, _name_index_rebuilding
+            try:
+                _name_index = CustomerNameIndex(load_customer_names())
+            except Exception as e:
+                print(f"Error rebuilding customer name index: {e}")
+            finally:
+                _name_index_rebuilding = False
+
+        threading.Thread(target=rebuild, name="customer-name-index", daemon=True).start()
+    return _name_index
+
+
+# Reci koje oznacavaju upit za vise kupaca i uslovi koje prepoznajemo u upitu; 'sve'/'svi' nisu tu,
+# jer se javljaju i u pitanjima o jednom kupcu ('daj sve podatke')
+BATCH_WORDS = {
+    "kupci", "kupaca", "kupce", "kupcima", "klijenti", "klijenata", "klijente", "klijentima",
+}
+BRANCH_WORDS = {"bransa", "branse", "bransi", "bransu", "bransom", "grana", "grane", "grani"}
+OVER_LIMIT_PHRASES = ["preko limita", "van limita", "iznad limita", "izvan limita", "izvan valute", "van valute"]
+_PRIORITY_RE = re.compile(r"\bprioritet\w* (\d+)")
+# 'bez ugovora' -> Ugovor = Ne, 'sa ugovorom' -> Ugovor = Da (za atribute sa vrednostima Da/Ne)
+ATTRIBUTE_NEGATIONS = {"bez", "nema", "nemaju"}
+ATTRIBUTE_AFFIRMATIONS = {"sa", "ima", "imaju"}
+
+_branch_index: Optional[CustomerNameIndex] = None
+
+
+def load_branches(csv_path: Optional[str] = None) -> List[str]:
+    """
+    Loads the distinct customer branches from the Intelisale database, or from the CSV export if the
+    database is not reachable or `use_local_data()` is set.
+
+    Args:
+        csv_path (Optional[str], optional): The CSV export. Defaults to the environment variable
+                                            'INTELISALE_CUSTOMERS_CSV' or `CUSTOMERS_CSV`.
+
+    Returns:
+        List[str]: The branch names.
+    """
+    if not use_local_data():
+        try:
+            with IntelisaleDatabase() as db:
+                return db.fetch_branches()
+        except Exception as e:
+            print(f"Loading branches from CSV, database unavailable: {e}")
+    with open(csv_path or getenv("INTELISALE_CUSTOMERS_CSV", CUSTOMERS_CSV), "r", encoding="utf-8-sig", newline="") as f:
+        return sorted({row["Branch"].strip() for row in csv.DictReader(f) if row["Branch"].strip()})
+
+
+def branch_index() -> CustomerNameIndex:
+    """
+    Returns the process-wide index of branch names (a `CustomerNameIndex` whose ids are list positions).
+
+    Returns:
+        CustomerNameIndex: The shared branch index.
+    """
+    global _branch_index
+    if _branch_index is None:
+        with _name_index_lock:
+            if _branch_index is None:
+                _branch_index = CustomerNameIndex((i, "", branch) for i, branch in enumerate(load_branches()))
+    return _branch_index
+
+
+def load_attribute_values() -> Dict[str, List[str]]:
+    """
+    Returns the customer attributes and their values from the attribute matrix, or an empty dictionary
+    if the exports cannot be loaded.
+    """
+    try:
+        from krembot_intelisale_data import attribute_matrix
+
+        return attribute_matrix().values
+    except Exception as e:
+        print(f"Customer attributes unavailable: {e}")
+        return {}
+
+
+def parse_attributes(query: str, values: Dict[str, List[str]]) -> Dict[str, str]:
+    """
+    Finds attribute conditions in a query: an attribute name followed by one of its values
+    ('Ugovor = Ne', 'kanal kupca za cenovnik 2'), a yes/no attribute after 'bez'/'sa'
+    ('bez ugovora', 'sa klima stanicom') or the name of a single-valued attribute ('relevantan kupac').
+
+    Args:
+        query (str): The user query.
+        values (Dict[str, List[str]]): Attribute name to its values (see `load_attribute_values`).
+
+    Returns:
+        Dict[str, str]: Attribute name to value.
+    """
+    folded = fold(query)
+    attributes: Dict[str, str] = {}
+    for name, options in values.items():
+        key = fold(name)
+        by_folded = {fold(option): option for option in options}
+        match = re.search(rf"\b{re.escape(key)}\w* (?:je )?(\w+)", folded)
+        if match and match.group(1) in by_folded:
+            attributes[name] = by_folded[match.group(1)]
+        elif len(options) == 1 and re.search(rf"\b{re.escape(key)}\b", folded):
+            attributes[name] = options[0]
+        elif set(by_folded) == {"da", "ne"}:
+            stems = " ".join(word[:max(len(word) - 1, 3)] + r"\w*" for word in key.split())
+            match = re.search(rf"\b(\w+) {stems}", folded)
+            if match and match.group(1) in ATTRIBUTE_NEGATIONS | ATTRIBUTE_AFFIRMATIONS:
+                attributes[name] = by_folded["ne" if match.group(1) in ATTRIBUTE_NEGATIONS else "da"]
+    return attributes
+
+
+def parse_selector(query: str) -> Optional[Dict[str, Any]]:
+    """
+    Recognizes a request for a report over many customers and turns it into a customer selector.
+
+    The query must talk about customers in plural ('svi kupci', 'spisak klijenata') or about a branch,
+    and name at least one condition: a branch ('branša DIY Sistemi', matched like customer names,
+    including fuzzy matches), balance out of limit ('preko limita', 'izvan valute'), a priority
+    ('prioritet 12') or customer attributes ('bez ugovora', 'Eshop kupac Da', see `parse_attributes`).
+    'sve'/'svi' alone are not enough ('Customer 15, daj sve podatke' is about one customer), and a
+    customer named in the query takes precedence over the selector (see `route_query`).
+    Everything is matched locally, no model is called.
+
+    Args:
+        query (str): The user query.
+
+    Returns:
+        Optional[Dict[str, Any]]: The selector for `fetch_customer_rows_where`, or None if the query is
+                                  not a multi-customer request.
+    """
+    folded = fold(query)
+    words = set(folded.split())
+    if not words & (BATCH_WORDS | BRANCH_WORDS):
+        return None
+    selector: Dict[str, Any] = {}
+    if words & BRANCH_WORDS:
+        branches = branch_index()
+        matches = branches.resolve(query, limit=1, min_score=0.8)
+        if matches and matches[0].matched_on in ("name", "fuzzy"):
+            selector["Branch"] = matches[0].name
+    if any(phrase in folded for phrase in OVER_LIMIT_PHRASES):
+        selector["BalanceOutOfLimit__gt"] = 0
+    priority = _PRIORITY_RE.search(folded)
+    if priority:
+        selector["Priority"] = int(priority.group(1))
+    attributes = parse_attributes(query, load_attribute_values())
+    if attributes:
+        selector["Attributes"] = attributes
+    return selector or None
+
+
+def strip_conditions(query: str, selector: Dict[str, Any]) -> str:
+    """
+    Removes the conditions of a selector from a query, so that what remains can be checked for a named
+    customer: the priority and attribute values are numbers and the branch a name, and they must not be
+    taken for a customer number or name ('kupci prioritet 2' is not about Customer 2).
+
+    Args:
+        query (str): The user query.
+        selector (Dict[str, Any]): The selector parsed from the query (see `parse_selector`).
+
+    Returns:
+        str: The folded query without the conditions.
+    """
+    folded = _PRIORITY_RE.sub(" ", fold(query))
+    for name, value in selector.get("Attributes", {}).items():
+        folded = re.sub(rf"\b{re.escape(fold(name))}\w*(?: je)?(?: {re.escape(fold(value))}\b)?", " ", folded)
+    if "Branch" in selector:
+        folded = re.sub(rf"\b{re.escape(fold(selector['Branch']))}\b", " ", folded)
+    return folded
+
+
+def route_query(query: str) -> Tuple[Optional[List[int]], Optional[Dict[str, Any]]]:
+    """
+    Decides whether a query is about one customer or many: a customer named in the query (resolved
+    locally, see `CustomerNameIndex.resolve_ids`) takes precedence, and the selector of `parse_selector`
+    is used only when no customer is named.
+
+    Args:
+        query (str): The user query.
+
+    Returns:
+        Tuple[Optional[List[int]], Optional[Dict[str, Any]]]: The CustomerIds of a named customer, or the
+            selector of a multi-customer request; (None, None) if neither is recognized.
+    """
+    selector = parse_selector(query)
+    customer_ids = customer_name_index().resolve_ids(strip_conditions(query, selector) if selector else query)
+    if customer_ids is not None:
+        return customer_ids, None
+    return None, selector
@@ -0,0 +1,703 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+from collections import namedtuple
+from os import getenv
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from krembot_intelisale import SNAPSHOT_COLUMNS
+
+DATA_DIR = "Clients/Intelisale"
+FILES = {
+    "customers": "Intelisale_Customers.csv",
+    "attributes": "Intelisale_Attributes.csv",
+    "pgp": "Intelisale_PGP.csv",
+}
+
+# Tip svake kolone koja nije float; sve ostale numericke kolone se citaju kao float64
+CUSTOMER_TYPES = {
+    "CustomerId": "int",
+    "Code": "str",
+    "Name": "str",
+    "Smlturnover": "category",
+    "Sean": "category",
+    "Priority": "int",
+    "ExistTradeAgreement": "bool",
+    "CentralOffice": "bool",
+    "PaymentCondition": "category",
+    "OldestOpenInvDate": "date",
+    "LatestInvDate": "date",
+    "LatestPayDate": "date",
+    "FirstInvDate": "date",
+    "ExistOrsy": "bool",
+    "ExistOrsy100": "bool",
+    "TreasuryBill": "bool",
+    "CustPaymentMethod": "category",
+    "Color": "int",
+    "BillOfExchange": "bool",
+    "TopDivision": "category",
+    "Division": "category",
+    "TopBranch": "category",
+    "Branch": "category",
+    "SecBranch": "category",
+    "Status": "category",
+    "FinStatus": "category",
+    "BusinessUnitCode": "str",
+    "CustomerIsActive": "bool",
+    "CustPaymentConditionId": "int",
+    "DateLastPayment": "date",
+    "DateLastInvoice_": "date",
+    "CentralOfficeCode": "str",
+    "EmployeeId": "int",
+}
+ATTRIBUTE_TYPES = {
+    "CustomerId": "int",
+    "Id": "int",
+    "AttributeId": "int",
+    "AttributeValueId": "int",
+    "Name": "category",
+    "Description": "category",
+    "ShowOnPage": "bool",
+    "DisplayOrder": "int",
+    "Value": "category",
+}
+PGP_TYPES = {
+    "CustomerId": "int",
+    "CategoryOfItemsId": "int",
+    "NoOfItems": "int",
+    "Name": "category",
+}
+TYPES = {"customers": CUSTOMER_TYPES, "attributes": ATTRIBUTE_TYPES, "pgp": PGP_TYPES}
+# Kljucevi po kojima se tabele sortiraju i pretrazuju (np.searchsorted), moraju biti int64 bez praznih vrednosti
+KEY_COLUMNS = ("CustomerId", "CategoryOfItemsId")
+
+ReportRow = namedtuple("ReportRow", SNAPSHOT_COLUMNS)
+
+_OPERATORS = {
+    "eq": lambda column, value: column == value,
+    "ne": lambda column, value: column != value,
+    "gt": lambda column, value: column > value,
+    "ge": lambda column, value: column >= value,
+    "lt": lambda column, value: column < value,
+    "le": lambda column, value: column <= value,
+    "in": lambda column, value: column.isin(list(value)),
+    "contains": lambda column, value: column.astype(str).str.contains(value, case=False, regex=False),
+}
+
+
+def _typed_column(values: pd.Series, kind: str) -> pd.Series:
+    """
+    Converts a column read as text into its typed, columnar representation.
+    """
+    values = values.str.strip()
+    if kind == "str":
+        return values
+    if kind == "category":
+        return values.replace("", None).astype("category")
+    if kind == "bool":
+        return values.str.upper().isin(["TRUE", "1"])
+    if kind == "date":
+        dates = pd.to_datetime(values.replace("", None), format="%m/%d/%Y %H:%M:%S", errors="coerce")
+        # 01/01/1753 je SQL Server "prazan" datum
+        return dates.where(dates.dt.year > 1753)
+    numbers = pd.to_numeric(values.str.replace(",", ".", regex=False).replace("", None), errors="coerce")
+    if kind == "int":
+        # prazna vrednost nije 0: kolona sa praznim vrednostima postaje nullable Int64
+        return numbers.astype("Int64") if numbers.isna().any() else numbers.astype(np.int64)
+    return numbers.astype(np.float64)
+
+
+def read_table(path: str, types: Dict[str, str]) -> pd.DataFrame:
+    """
+    Reads one Intelisale CSV export into a typed DataFrame.
+
+    Every column is read as text and converted explicitly: dates (MM/DD/YYYY) become datetime64, decimals
+    (including the ones written with a decimal comma) float64, TRUE/FALSE flags bool and low-cardinality
+    text categorical. Columns not listed in `types` are treated as decimals. Values that do not parse
+    become NaN/NaT instead of failing the load; an integer column with missing values becomes a nullable
+    Int64 column (missing stays NA, not 0), except the `KEY_COLUMNS`, whose rows without a value are skipped.
+
+    Args:
+        path (str): The CSV file.
+        types (Dict[str, str]): Column kinds ('int', 'str', 'category', 'bool', 'date'), float by default.
+
+    Returns:
+        pd.DataFrame: The typed table.
+    """
+    raw = pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    frame = pd.DataFrame({column: _typed_column(raw[column], types.get(column, "float")) for column in raw.columns})
+    keys = [column for column in KEY_COLUMNS if column in frame.columns]
+    missing = frame[keys].isna().any(axis=1)
+    if missing.any():
+        print(f"Skipping {int(missing.sum())} rows without {', '.join(keys)} in {os.path.basename(path)}")
+        frame = frame[~missing].astype({column: np.int64 for column in keys}).reset_index(drop=True)
+    return frame
+
+
+class IntelisaleData:
+    """
+    The Intelisale Customers, Attributes and PGP exports held as typed, in-memory columnar tables.
+
+    `customers` is indexed by CustomerId, `attributes` and `pgp` are sorted by CustomerId, so lookups
+    for one customer are a binary search. Filters are vectorized column masks and aggregates and top-N
+    are pandas group-bys, so branch- or portfolio-level questions are answered locally in milliseconds
+    instead of with a database round trip per customer.
+
+    Filters are passed as keyword arguments, `column=value` for equality or `column__op=value` with op
+    one of eq, ne, gt, ge, lt, le, in, contains, e.g. `where(Branch="DIY Sistemi", BalanceOutOfLimit__gt=0)`.
+    """
+
+    def __init__(self, customers: pd.DataFrame, attributes: pd.DataFrame, pgp: pd.DataFrame) -> None:
+        """
+        Initializes the engine from typed tables (see `read_table`).
+
+        Args:
+            customers (pd.DataFrame): The customers table.
+            attributes (pd.DataFrame): The customer attributes (EAV) table.
+            pgp (pd.DataFrame): The per item category turnover and potential table.
+        """
+        customers = customers.copy()
+        visits = customers["CalculatedNumberOfVisits"].replace(0, np.nan)
+        customers["PlannedAmountPerVisit"] = (customers["Plan12Months"] / 12 / visits).fillna(0.0)
+        self.customers: pd.DataFrame = customers.set_index("CustomerId", drop=False).sort_index()
+        self.attributes: pd.DataFrame = attributes.sort_values("CustomerId", kind="stable").reset_index(drop=True)
+        self.pgp: pd.DataFrame = pgp.sort_values("CustomerId", kind="stable").reset_index(drop=True)
+        self.loaded_at: float = time.time()
+
+    def table(self, name: str) -> pd.DataFrame:
+        return {"customers": self.customers, "attributes": self.attributes, "pgp": self.pgp}[name]
+
+    def mask(self, table: str = "customers", **filters: Any) -> np.ndarray:
+        """
+        Builds a boolean row mask for the given filters.
+
+        Args:
+            table (str, optional): 'customers', 'attributes' or 'pgp'. Defaults to 'customers'.
+            **filters (Any): `column=value` or `column__op=value` conditions, combined with AND.
+
+        Returns:
+            np.ndarray: One bool per row of the table.
+
+        Raises:
+            KeyError: If a column or operator does not exist.
+        """
+        frame = self.table(table)
+        result = np.ones(len(frame), dtype=bool)
+        for key, value in filters.items():
+            column, _, op = key.partition("__")
+            matches = _OPERATORS[op or "eq"](frame[column], value)
+            # poredjenje sa praznom vrednoscu (NA u Int64 koloni) ne zadovoljava uslov
+            result &= matches.fillna(False).to_numpy(dtype=bool)
+        return result
+
+    def where(self, table: str = "customers", columns: Optional[Sequence[str]] = None, **filters: Any) -> pd.DataFrame:
+        """
+        Returns the rows of a table that match the filters.
+
+        Args:
+            table (str, optional): 'customers', 'attributes' or 'pgp'. Defaults to 'customers'.
+            columns (Optional[Sequence[str]], optional): Columns to return. Defaults to all.
+            **filters (Any): `column=value` or `column__op=value` conditions.
+
+        Returns:
+            pd.DataFrame: The matching rows.
+        """
+        frame = self.table(table)
+        selected = frame[self.mask(table, **filters)] if filters else frame
+        return selected[list(columns)] if columns else selected
+
+    def customer(self, customer_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Returns one customer as a dictionary, or None if it does not exist.
+        """
+        if customer_id not in self.customers.index:
+            return None
+        return self.customers.loc[customer_id].to_dict()
+
+    def rows_for(self, table: str, customer_ids: Sequence[int]) -> pd.DataFrame:
+        """
+        Returns the attribute or PGP rows of the given customers (binary search on the sorted CustomerId column).
+        """
+        frame = self.table(table)
+        keys = frame["CustomerId"].to_numpy()
+        ids = np.unique(np.asarray(customer_ids, dtype=keys.dtype))
+        starts, ends = np.searchsorted(keys, ids, "left"), np.searchsorted(keys, ids, "right")
+        positions = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(ids) else []
+        return frame.iloc[positions]
+
+    def aggregate(
+        self,
+        by: Any,
+        values: Sequence[str],
+        how: Any = "sum",
+        table: str = "customers",
+        **filters: Any
+    ) -> pd.DataFrame:
+        """
+        Groups the (filtered) rows and aggregates the given columns.
+
+        Args:
+            by (Any): Column name or list of column names to group by.
+            values (Sequence[str]): Columns to aggregate.
+            how (Any, optional): Aggregation(s) accepted by pandas `agg` ('sum', 'mean', ['sum', 'count'], ...).
+                                 Defaults to 'sum'.
+            table (str, optional): 'customers', 'attributes' or 'pgp'. Defaults to 'customers'.
+            **filters (Any): `column=value` or `column__op=value` conditions.
+
+        Returns:
+            pd.DataFrame: One row per group.
+        """
+        frame = self.where(table, **filters)
+        return frame.groupby(by, observed=True, sort=True)[list(values)].agg(how)
+
+    def top_n(
+        self,
+        column: str,
+        n: int = 10,
+        by: Optional[str] = None,
+        ascending: bool = False,
+        table: str = "customers",
+        columns: Optional[Sequence[str]] = None,
+        **filters: Any
+    ) -> pd.DataFrame:
+        """
+        Returns the top `n` rows by a column, overall or within every group of `by`.
+
+        Args:
+            column (str): The column to rank by.
+            n (int, optional): Rows per result (or per group). Defaults to 10.
+            by (Optional[str], optional): Group column, e.g. 'Branch' or 'Priority'. Defaults to None.
+            ascending (bool, optional): Rank the smallest values first. Defaults to False.
+            table (str, optional): 'customers', 'attributes' or 'pgp'. Defaults to 'customers'.
+            columns (Optional[Sequence[str]], optional): Columns to return. Defaults to all.
+            **filters (Any): `column=value` or `column__op=value` conditions.
+
+        Returns:
+            pd.DataFrame: The ranked rows.
+        """
+        frame = self.where(table, **filters)
+        ranked = frame.sort_values(column, ascending=ascending, kind="stable", na_position="last")
+        if by is not None:
+            ranked = ranked.groupby(by, observed=True, sort=False).head(n)
+        else:
+            ranked = ranked.head(n)
+        return ranked[list(columns)] if columns else ranked
+
+    def report_rows(self, customer_ids: Sequence[int]) -> List[ReportRow]:
+        """
+        Builds Intelisale report rows (the `customer_snapshot` columns) for the given customers.
+
+        The exports carry no activities, so the last visit note is always None.
+
+        Args:
+            customer_ids (Sequence[int]): The customer ids.
+
+        Returns:
+            List[ReportRow]: One row per existing customer.
+        """
+        found = self.customers.loc[self.customers.index.intersection(list(customer_ids))]
+        return [
+            ReportRow(
+                CustomerId=int(row.CustomerId),
+                Code=row.Code,
+                cn=row.Name,
+                Branch=row.Branch,
+                BlueCoatsNo=row.BlueCoatsNo,
+                PlanCurrentYear=row.PlanCurrentYear,
+                TurnoverCurrentYear=row.TurnoverCurrentYear,
+                FullfilmentCurrentYear=row.FullfilmentCurrentYear,
+                PlaniraniIznosPoPoseti=row.PlannedAmountPerVisit,
+                CalculatedNumberOfVisits=row.CalculatedNumberOfVisits,
+                PaymentAvgDays=row.PaymentAvgDays,
+                BalanceOutOfLimit=row.BalanceOutOfLimit,
+                BalanceCritical=row.BalanceCritical,
+                PoslednjaBeleska=None,
+            )
+            for row in found.itertuples(index=False)
+        ]
+
+
+def _source_key(data_dir: str) -> str:
+    stats = [os.stat(os.path.join(data_dir, file_name)) for file_name in FILES.values()]
+    return hashlib.sha1(repr([(s.st_size, s.st_mtime_ns) for s in stats]).encode()).hexdigest()[:16]
+
+
+def load_intelisale_data(data_dir: Optional[str] = None, cache_dir: Optional[str] = None) -> IntelisaleData:
+    """
+    Loads the Intelisale exports, from the columnar cache when the CSV files did not change.
+
+    Parsing the CSVs takes about a second, loading the cached typed tables a few milliseconds. The cache
+    key is the size and modification time of the three files; a cache that cannot be loaded is rebuilt,
+    and writing a new one deletes the caches of earlier versions of the files.
+
+    Args:
+        data_dir (Optional[str], optional): Directory of the CSV exports. Defaults to the environment variable
+                                            'INTELISALE_DATA_DIR' or `DATA_DIR`.
+        cache_dir (Optional[str], optional): Cache directory. Defaults to '.krembot_cache/intelisale'.
+
+    Returns:
+        IntelisaleData: The loaded engine.
+    """
+    data_dir = data_dir or getenv("INTELISALE_DATA_DIR", DATA_DIR)
+    cache_dir = cache_dir or os.path.join(".krembot_cache", "intelisale")
+    cache_path = os.path.join(cache_dir, f"tables_{_source_key(data_dir)}.pkl")
+    try:
+        with open(cache_path, "rb") as f:
+            tables = pickle.load(f)
+    except Exception as e:
+        # kes moze biti iz druge verzije pandas-a ili ostecen; tada se tabele citaju iz CSV-a ponovo
+        if not isinstance(e, FileNotFoundError):
+            print(f"Error reading Intelisale data cache, rebuilding: {e}")
+        tables = {name: read_table(os.path.join(data_dir, file_name), TYPES[name]) for name, file_name in FILES.items()}
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+            # kes ranijih verzija CSV fajlova se vise ne koristi
+            for file_name in os.listdir(cache_dir):
+                if file_name.startswith("tables_") and file_name.endswith(".pkl") and file_name != os.path.basename(cache_path):
+                    os.remove(os.path.join(cache_dir, file_name))
+        except OSError as e:
+            print(f"Error writing Intelisale data cache: {e}")
+    return IntelisaleData(tables["customers"], tables["attributes"], tables["pgp"])
+
+
+_data: Optional[IntelisaleData] = None
+_data_lock = threading.Lock()
+
+
+def intelisale_data() -> IntelisaleData:
+    """
+    Returns the process-wide Intelisale data engine, loading it on first use.
+
+    Returns:
+        IntelisaleData: The shared engine.
+    """
+    global _data
+    if _data is None:
+        with _data_lock:
+            if _data is None:
+                _data = load_intelisale_data()
+    return _data
+
+
+class GrowthIndex:
+    """
+    Precomputed "where to grow" insights over the PGP (turnover and potential per item category) table.
+
+    Everything is computed once, vectorized, and stored in flat NumPy arrays in CSR layout: for the
+    customer at position i of the sorted `customer_ids`, its entries are `[indptr[i]:indptr[i + 1]]` of
+    the per-customer arrays. A lookup is a binary search plus a slice, no scan of the PGP rows.
+
+    - Top unused potential: the `top_n` categories with the largest UnusedPotential per customer.
+    - Cross-sell: customers are compared by their category mix (turnover share per category, cosine
+      similarity); for each customer the `neighbours` most similar customers vote, weighted by
+      similarity, for categories they buy and the customer does not. The score is the similarity
+      weighted average share of the category among the neighbours (0-1). Similarities are computed in
+      chunks of rows, so memory stays at chunk x customers instead of customers x customers.
+    - Branch aggregates: turnover, potential and unused potential per (branch, category).
+    """
+
+    def __init__(
+        self,
+        data: IntelisaleData,
+        top_n: int = 5,
+        neighbours: int = 20,
+        cross_sell_n: int = 5,
+        chunk_size: int = 512
+    ) -> None:
+        """
+        Builds the index.
+
+        Args:
+            data (IntelisaleData): The loaded Intelisale tables.
+            top_n (int, optional): Unused potential categories kept per customer. Defaults to 5.
+            neighbours (int, optional): Similar customers used for cross-sell. Defaults to 20.
+            cross_sell_n (int, optional): Cross-sell categories kept per customer. Defaults to 5.
+            chunk_size (int, optional): Rows per similarity chunk. Defaults to 512.
+        """
+        start = time.perf_counter()
+        pgp = data.pgp
+        self.categories: np.ndarray = np.sort(pgp["CategoryOfItemsId"].unique())
+        names = pgp.drop_duplicates("CategoryOfItemsId").set_index("CategoryOfItemsId")["Name"]
+        self.category_names: List[str] = [str(names[category]) for category in self.categories]
+        self.customer_ids: np.ndarray = np.unique(pgp["CustomerId"].to_numpy())
+
+        rows = np.searchsorted(self.customer_ids, pgp["CustomerId"].to_numpy())
+        cols = np.searchsorted(self.categories, pgp["CategoryOfItemsId"].to_numpy())
+        unused = pgp["UnusedPotential"].to_numpy(dtype=np.float64)
+        turnover = pgp["Turnover"].to_numpy(dtype=np.float64)
+        potential = pgp["Potential"].to_numpy(dtype=np.float64)
+
+        # Top-N po kupcu: sortiranje po (kupac, -neiskorisceni potencijal) i rang unutar kupca
+        order = np.lexsort((-unused, rows))
+        sorted_rows = rows[order]
+        group_start = np.searchsorted(sorted_rows, sorted_rows, "left")
+        rank = np.arange(len(order)) - group_start
+        keep = order[(rank < top_n) & (unused[order] > 0)]
+        self.top_indptr: np.ndarray = np.searchsorted(rows[keep], np.arange(len(self.customer_ids) + 1))
+        self.top_category: np.ndarray = cols[keep].astype(np.int32)
+        self.top_unused_potential: np.ndarray = unused[keep]
+        self.top_turnover: np.ndarray = turnover[keep]
+        self.top_potential: np.ndarray = potential[keep]
+
+        # Profil kupca: udeo prometa po kategoriji, normalizovan za kosinusnu slicnost
+        mix = np.zeros((len(self.customer_ids), len(self.categories)), dtype=np.float32)
+        np.add.at(mix, (rows, cols), np.clip(turnover, 0, None).astype(np.float32))
+        buys = mix > 0
+        norms = np.linalg.norm(mix, axis=1, keepdims=True)
+        unit = np.divide(mix, norms, out=np.zeros_like(mix), where=norms > 0)
+        share = np.divide(mix, mix.sum(axis=1, keepdims=True), out=np.zeros_like(mix), where=norms > 0)
+
+        k = min(neighbours, max(len(self.customer_ids) - 1, 1))
+        cross_category, cross_score, cross_counts = [], [], []
+        for chunk_start in range(0, len(self.customer_ids), chunk_size):
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            similarity = unit[chunk] @ unit.T
+            similarity[np.arange(similarity.shape[0]), np.arange(chunk_start, chunk_start + similarity.shape[0])] = 0
+            nearest = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            weights = np.take_along_axis(similarity, nearest, axis=1)
+            total = weights.sum(axis=1, keepdims=True)
+            scores = np.einsum("ij,ijk->ik", weights, share[nearest])
+            scores = np.divide(scores, total, out=np.zeros_like(scores), where=total > 0)
+            scores[buys[chunk]] = 0
+            best = np.argsort(-scores, axis=1)[:, :cross_sell_n]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            valid = best_scores > 0
+            cross_category.append(best[valid].astype(np.int32))
+            cross_score.append(best_scores[valid].astype(np.float32))
+            cross_counts.append(valid.sum(axis=1))
+        self.cross_indptr: np.ndarray = np.concatenate([[0], np.cumsum(np.concatenate(cross_counts))])
+        self.cross_category: np.ndarray = np.concatenate(cross_category)
+        self.cross_score: np.ndarray = np.concatenate(cross_score)
+
+        frame = pgp.assign(Branch=data.customers["Branch"].reindex(pgp["CustomerId"]).to_numpy())
+        self.branch_categories: pd.DataFrame = (
+            frame.groupby(["Branch", "Name"], observed=True)[["Turnover", "Potential", "UnusedPotential"]]
+            .sum()
+            .assign(Customers=frame.groupby(["Branch", "Name"], observed=True)["CustomerId"].nunique())
+            .reset_index()
+            .sort_values(["Branch", "UnusedPotential"], ascending=[True, False], kind="stable")
+        )
+        self.build_seconds: float = time.perf_counter() - start
+
+    def _position(self, customer_id: int) -> Optional[int]:
+        position = int(np.searchsorted(self.customer_ids, customer_id))
+        if position < len(self.customer_ids) and self.customer_ids[position] == customer_id:
+            return position
+        return None
+
+    def top_unused(self, customer_id: int) -> List[Dict[str, Any]]:
+        """
+        Returns the categories with the largest unused potential of a customer, largest first.
+
+        Args:
+            customer_id (int): The customer id.
+
+        Returns:
+            List[Dict[str, Any]]: Dictionaries with category, unused_potential, turnover and potential
+                                  (empty if the customer has no PGP data).
+        """
+        position = self._position(customer_id)
+        if position is None:
+            return []
+        entries = slice(self.top_indptr[position], self.top_indptr[position + 1])
+        return [
+            {"category": self.category_names[c], "unused_potential": float(u), "turnover": float(t), "potential": float(p)}
+            for c, u, t, p in zip(
+                self.top_category[entries], self.top_unused_potential[entries], self.top_turnover[entries], self.top_potential[entries]
+            )
+        ]
+
+    def cross_sell(self, customer_id: int) -> List[Dict[str, Any]]:
+        """
+        Returns the categories bought by similar customers but not by this customer, best first.
+
+        Args:
+            customer_id (int): The customer id.
+
+        Returns:
+            List[Dict[str, Any]]: Dictionaries with category and score (0-1).
+        """
+        position = self._position(customer_id)
+        if position is None:
+            return []
+        entries = slice(self.cross_indptr[position], self.cross_indptr[position + 1])
+        return [
+            {"category": self.category_names[c], "score": float(s)}
+            for c, s in zip(self.cross_category[entries], self.cross_score[entries])
+        ]
+
+    def branch_top(self, branch: str, n: int = 5) -> pd.DataFrame:
+        """
+        Returns the categories with the largest unused potential summed over a branch.
+
+        Args:
+            branch (str): The branch name.
+            n (int, optional): Number of categories. Defaults to 5.
+
+        Returns:
+            pd.DataFrame: Columns Branch, Name, Turnover, Potential, UnusedPotential and Customers.
+        """
+        return self.branch_categories[self.branch_categories["Branch"] == branch].head(n)
+
+    def insights(self, customer_id: int) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Returns the growth insights of a customer for the report.
+
+        Args:
+            customer_id (int): The customer id.
+
+        Returns:
+            Dict[str, List[Dict[str, Any]]]: 'unused' (see `top_unused`) and 'cross_sell' (see `cross_sell`).
+        """
+        return {"unused": self.top_unused(customer_id), "cross_sell": self.cross_sell(customer_id)}
+
+
+_growth: Optional[GrowthIndex] = None
+
+
+def growth_index() -> GrowthIndex:
+    """
+    Returns the process-wide growth index, building it from `intelisale_data()` on first use.
+
+    Returns:
+        GrowthIndex: The shared index.
+    """
+    global _growth
+    if _growth is None:
+        data = intelisale_data()
+        with _data_lock:
+            if _growth is None:
+                _growth = GrowthIndex(data)
+    return _growth
+
+
+class AttributeMatrix:
+    """
+    The customer attributes (an EAV table: CustomerId, Name, Value) pivoted into a compact matrix.
+
+    Every attribute becomes one column of categorical codes aligned with the customers table (`codes[name][i]`
+    is the code of the value for the customer at position i of `customer_ids`, -1 if the customer has no
+    value), and every (attribute, value) pair gets a bitmap of the customers having it, packed 8 customers
+    per byte. A filter over several attributes is an AND of bitmaps (values of the same attribute are OR-ed),
+    so "Ugovor = Ne and Eshop kupac = Da" costs two byte-array operations instead of a scan and a pivot.
+
+    Values are matched case-insensitively, e.g. {"Ugovor": "ne"} or {"Kanal kupca za cenovnik": ["1", "2"]}.
+    """
+
+    def __init__(self, data: IntelisaleData) -> None:
+        """
+        Builds the matrix and the bitmaps.
+
+        Args:
+            data (IntelisaleData): The loaded Intelisale tables.
+        """
+        start = time.perf_counter()
+        self.customer_ids: np.ndarray = data.customers.index.to_numpy()
+        attributes = data.attributes.dropna(subset=["Name", "Value"])
+        ids = attributes["CustomerId"].to_numpy()
+        positions = np.searchsorted(self.customer_ids, ids).clip(0, max(len(self.customer_ids) - 1, 0))
+        known = self.customer_ids[positions] == ids if len(self.customer_ids) else np.zeros(len(ids), dtype=bool)
+
+        self.codes: Dict[str, np.ndarray] = {}
+        self.values: Dict[str, List[str]] = {}
+        self.bitmaps: Dict[Tuple[str, str], np.ndarray] = {}
+        names = attributes["Name"].astype(str).to_numpy()
+        values = attributes["Value"].astype(str).to_numpy()
+        for name in sorted(set(names)):
+            rows = (names == name) & known
+            categories, codes = np.unique(values[rows], return_inverse=True)
+            column = np.full(len(self.customer_ids), -1, dtype=np.int16)
+            column[positions[rows]] = codes
+            self.codes[name] = column
+            self.values[name] = [str(value) for value in categories]
+            for code, value in enumerate(self.values[name]):
+                self.bitmaps[(name, value.casefold())] = np.packbits(column == code)
+        self._empty = np.zeros_like(np.packbits(np.zeros(len(self.customer_ids), dtype=bool)))
+        self.build_seconds: float = time.perf_counter() - start
+
+    def bitmap(self, name: str, value: Any) -> np.ndarray:
+        """
+        Returns the packed bitmap of the customers whose attribute `name` has the value `value`.
+
+        Raises:
+            KeyError: If the attribute does not exist.
+        """
+        if name not in self.codes:
+            raise KeyError(f"Unknown customer attribute: {name}")
+        return self.bitmaps.get((name, str(value).strip().casefold()), self._empty)
+
+    def select(self, conditions: Dict[str, Any]) -> np.ndarray:
+        """
+        Intersects the bitmaps of the conditions.
+
+        Args:
+            conditions (Dict[str, Any]): Attribute name to a value or a list of values.
+
+        Returns:
+            np.ndarray: The packed bitmap of the matching customers.
+        """
+        result = np.full_like(self._empty, 0xFF)
+        for name, value in conditions.items():
+            options = value if isinstance(value, (list, tuple, set)) else [value]
+            bitmap = self._empty
+            for option in options:
+                bitmap = bitmap | self.bitmap(name, option)
+            result &= bitmap
+        return result
+
+    def mask(self, conditions: Dict[str, Any]) -> np.ndarray:
+        """
+        Returns one bool per row of the customers table, True for the customers matching the conditions.
+        """
+        return np.unpackbits(self.select(conditions), count=len(self.customer_ids)).astype(bool)
+
+    def customer_ids_where(self, conditions: Dict[str, Any]) -> np.ndarray:
+        """
+        Returns the ids of the customers matching the conditions (see `select`).
+        """
+        return self.customer_ids[self.mask(conditions)]
+
+    def count(self, conditions: Dict[str, Any]) -> int:
+        """
+        Returns the number of customers matching the conditions.
+        """
+        # unpackbits (ne np.bitwise_count, koji trazi NumPy 2) i bez bitova dopune poslednjeg bajta
+        return int(np.count_nonzero(self.mask(conditions)))
+
+    def frame(self) -> pd.DataFrame:
+        """
+        Returns the pivoted matrix as a DataFrame (one categorical column per attribute, indexed by CustomerId).
+        """
+        return pd.DataFrame(
+            {name: pd.Categorical.from_codes(codes, self.values[name]) for name, codes in self.codes.items()},
+            index=pd.Index(self.customer_ids, name="CustomerId"),
+        )
+
+
+_attributes: Optional[AttributeMatrix] = None
+
+
+def attribute_matrix() -> AttributeMatrix:
+    """
+    Returns the process-wide attribute matrix, building it from `intelisale_data()` on first use.
+
+    Returns:
+        AttributeMatrix: The shared matrix.
+    """
+    global _attributes
+    if _attributes is None:
+        data = intelisale_data()
+        with _data_lock:
+            if _attributes is None:
+                _attributes = AttributeMatrix(data)
+    return _attributes
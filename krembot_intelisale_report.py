@@ -0,0 +1,257 @@
+import os
+
+from decimal import Decimal
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Polje izvestaja: (oznaka, kolona reda, format)
+ReportField = Tuple[str, str, str]
+
+CUSTOMER_REPORT: List[ReportField] = [
+    ("Naziv kupca", "cn", "text"),
+    ("Šifra kupca", "Code", "text"),
+    ("Branša", "Branch", "text"),
+    ("Broj plavih mantila", "BlueCoatsNo", "int"),
+    ("Plan tekuće godine", "PlanCurrentYear", "money"),
+    ("Promet tekuće godine", "TurnoverCurrentYear", "money"),
+    ("Ostvarenje plana", "FullfilmentCurrentYear", "percent"),
+    ("Planirani iznos po poseti", "PlaniraniIznosPoPoseti", "money"),
+    ("Ukupan broj poseta", "CalculatedNumberOfVisits", "int"),
+    ("Prosečni dani plaćanja", "PaymentAvgDays", "number"),
+    ("Dugovanje izvan valute", "BalanceOutOfLimit", "money"),
+    ("Kritični saldo", "BalanceCritical", "money"),
+    ("Beleška sa prethodne posete", "PoslednjaBeleska", "text"),
+]
+
+REPORT_TEMPLATES: Dict[str, List[ReportField]] = {
+    "customer": CUSTOMER_REPORT,
+}
+
+NOT_FOUND = "Kupac nije pronađen u Intelisale podacima."
+MISSING = "nema podatka"
+
+
+def _number(value: Any, decimals: int) -> str:
+    """
+    Formats a number the Serbian way: '.' for thousands and ',' for decimals (1.234.567,89).
+    """
+    text = f"{float(value):,.{decimals}f}"
+    return text.replace(",", " ").replace(".", ",").replace(" ", ".")
+
+
+FORMATTERS: Dict[str, Callable[[Any], str]] = {
+    "text": lambda value: str(value).strip() or MISSING,
+    "int": lambda value: _number(value, 0),
+    "number": lambda value: _number(value, 2),
+    "money": lambda value: f"{_number(value, 2)} RSD",
+    "percent": lambda value: f"{_number(value, 2)}%",
+}
+
+
+def format_value(value: Any, kind: str) -> str:
+    """
+    Formats one report value; missing values (None, NaN, empty text) are shown as `MISSING`.
+
+    Args:
+        value (Any): The value from the row (str, int, float, Decimal or None).
+        kind (str): One of the `FORMATTERS` keys.
+
+    Returns:
+        str: The formatted value.
+    """
+    if value is None or (isinstance(value, float) and value != value):
+        return MISSING
+    if isinstance(value, Decimal) and not value.is_finite():
+        return MISSING
+    return FORMATTERS[kind](value)
+
+
+def row_value(row: Any, column: str) -> Any:
+    """
+    Reads a column from a pyodbc row, namedtuple or dictionary.
+    """
+    if isinstance(row, dict):
+        return row.get(column)
+    return getattr(row, column, None)
+
+
+def fulfilment(row: Any) -> Optional[float]:
+    """
+    Returns the plan fulfilment in percent, computed from plan and turnover when the row has none.
+    """
+    value = row_value(row, "FullfilmentCurrentYear")
+    if value not in (None, 0):
+        return float(value)
+    plan = row_value(row, "PlanCurrentYear")
+    turnover = row_value(row, "TurnoverCurrentYear")
+    if plan and turnover is not None:
+        return float(turnover) / float(plan) * 100
+    return None if value is None else float(value)
+
+
+def render_growth(insights: Dict[str, List[Dict[str, Any]]]) -> List[str]:
+    """
+    Renders the "where to grow" lines of a customer: largest unused potential and cross-sell categories.
+
+    Args:
+        insights (Dict[str, List[Dict[str, Any]]]): The result of `GrowthIndex.insights`.
+
+    Returns:
+        List[str]: Report lines (empty if there are no insights).
+    """
+    lines = []
+    if insights.get("unused"):
+        lines.append("- Najveći neiskorišćeni potencijal: " + "; ".join(
+            f"{item['category']} ({format_value(item['unused_potential'], 'money')})" for item in insights["unused"]
+        ))
+    if insights.get("cross_sell"):
+        lines.append("- Slični kupci kupuju i: " + ", ".join(item["category"] for item in insights["cross_sell"]))
+    return lines
+
+
+def render_customer(row: Any, template: Sequence[ReportField] = CUSTOMER_REPORT, growth: Optional[Any] = None) -> str:
+    """
+    Renders the report of one customer as Markdown.
+
+    Args:
+        row (Any): The report row (columns of `krembot_intelisale.SNAPSHOT_COLUMNS`).
+        template (Sequence[ReportField], optional): The fields to show. Defaults to `CUSTOMER_REPORT`.
+        growth (Optional[Any], optional): A `GrowthIndex`; when given, the growth insights of the customer
+                                          are added to the report. Defaults to None.
+
+    Returns:
+        str: The report, a title line followed by one bullet per field.
+    """
+    lines = [f"**{format_value(row_value(row, 'cn'), 'text')}**"]
+    for label, column, kind in template:
+        if column == "cn":
+            continue
+        value = fulfilment(row) if column == "FullfilmentCurrentYear" else row_value(row, column)
+        lines.append(f"- {label}: {format_value(value, kind)}")
+    if growth is not None:
+        lines += render_growth(growth.insights(int(row_value(row, "CustomerId"))))
+    return "\n".join(lines)
+
+
+def render_report(rows: Sequence[Any], report_type: str = "customer", growth: Optional[Any] = None) -> str:
+    """
+    Renders the Intelisale report for the fetched rows, without calling a model.
+
+    Every value is formatted from the typed row (amounts in RSD with Serbian separators, percentages,
+    counts), so the report is deterministic and produced in microseconds. The main chat completion
+    receives it as the tool context and streams the answer to the user.
+
+    Args:
+        rows (Sequence[Any]): The report rows, one per customer.
+        report_type (str, optional): A key of `REPORT_TEMPLATES`. Defaults to 'customer'.
+        growth (Optional[Any], optional): A `GrowthIndex` for the growth insights. Defaults to None.
+
+    Returns:
+        str: The report in Serbian (Markdown), or `NOT_FOUND` if there are no rows.
+    """
+    if not rows:
+        return NOT_FOUND
+    template = REPORT_TEMPLATES[report_type]
+    return "\n\n".join(render_customer(row, template, growth) for row in rows)
+
+
+def _float(row: Any, column: str) -> float:
+    value = row_value(row, column)
+    return 0.0 if value is None or value != value else float(value)
+
+
+def render_batch_summary(
+    rows: Sequence[Any],
+    selector: Dict[str, Any],
+    top: int = 5,
+    growth: Optional[Any] = None
+) -> str:
+    """
+    Renders the totals of a multi-customer report and the customers with the largest debt out of limit.
+
+    Args:
+        rows (Sequence[Any]): The report rows.
+        selector (Dict[str, Any]): The selector the rows were fetched with, shown in the title.
+        top (int, optional): Number of customers in the debt ranking. Defaults to 5.
+        growth (Optional[Any], optional): A `GrowthIndex`; for a branch selector the branch categories with
+                                          the largest unused potential are added. Defaults to None.
+
+    Returns:
+        str: The summary (Markdown).
+    """
+    plan = sum(_float(row, "PlanCurrentYear") for row in rows)
+    turnover = sum(_float(row, "TurnoverCurrentYear") for row in rows)
+    out_of_limit = sum(_float(row, "BalanceOutOfLimit") for row in rows)
+    conditions = ", ".join(
+        [f"{key.replace('__', ' ')} = {value}" for key, value in selector.items() if key != "Attributes"]
+        + [f"{name} = {value}" for name, value in selector.get("Attributes", {}).items()]
+    )
+    lines = [
+        f"**Izveštaj za {len(rows)} kupaca** ({conditions})",
+        f"- Ukupan plan tekuće godine: {format_value(plan, 'money')}",
+        f"- Ukupan promet tekuće godine: {format_value(turnover, 'money')}",
+        f"- Ostvarenje plana: {format_value(turnover / plan * 100 if plan else None, 'percent')}",
+        f"- Ukupno dugovanje izvan valute: {format_value(out_of_limit, 'money')}",
+        f"- Kritični saldo ukupno: {format_value(sum(_float(row, 'BalanceCritical') for row in rows), 'money')}",
+    ]
+    debtors = sorted(rows, key=lambda row: _float(row, "BalanceOutOfLimit"), reverse=True)[:top]
+    debtors = [row for row in debtors if _float(row, "BalanceOutOfLimit") > 0]
+    if debtors:
+        lines.append("- Najveće dugovanje izvan valute: " + "; ".join(
+            f"{row_value(row, 'cn')} ({format_value(row_value(row, 'BalanceOutOfLimit'), 'money')})" for row in debtors
+        ))
+    if growth is not None and isinstance(selector.get("Branch"), str):
+        categories = growth.branch_top(selector["Branch"], top)
+        if len(categories):
+            lines.append("- Najveći neiskorišćeni potencijal branše: " + "; ".join(
+                f"{name} ({format_value(unused, 'money')})"
+                for name, unused in zip(categories["Name"], categories["UnusedPotential"])
+            ))
+    return "\n".join(lines)
+
+
+def render_batch(
+    rows: Sequence[Any],
+    selector: Dict[str, Any],
+    on_report: Optional[Callable[[str, int, int], None]] = None,
+    render: Optional[Callable[[Any], str]] = None,
+    context_limit: Optional[int] = None,
+    growth: Optional[Any] = None
+) -> str:
+    """
+    Renders a report over many customers: a summary plus one report per customer.
+
+    Per-customer reports are rendered one by one and handed to `on_report` as they are ready, so the
+    UI can show progress. Rendering is pure string formatting (thousands of customers per second), so it
+    runs inline; worker threads would only contend for the GIL. The returned text, which becomes the context of
+    the main completion, holds the summary and only the reports of the customers with the largest
+    debt out of limit, so a branch with hundreds of customers does not overflow the prompt.
+
+    Args:
+        rows (Sequence[Any]): The report rows.
+        selector (Dict[str, Any]): The selector the rows were fetched with.
+        on_report (Optional[Callable[[str, int, int], None]], optional): Called with (report, done, total)
+                                                                        for every customer. Defaults to None.
+        render (Optional[Callable[[Any], str]], optional): Renders one row. Defaults to `render_customer`
+                                                          (with the growth insights if `growth` is given).
+        context_limit (Optional[int], optional): Customer reports included in the returned text. Defaults to
+                                                 the environment variable 'INTELISALE_BATCH_CONTEXT_LIMIT' or 20.
+        growth (Optional[Any], optional): A `GrowthIndex` for the growth insights. Defaults to None.
+
+    Returns:
+        str: The summary and the selected customer reports (Markdown), or `NOT_FOUND` if there are no rows.
+    """
+    if not rows:
+        return NOT_FOUND
+    limit = context_limit if context_limit is not None else int(os.getenv("INTELISALE_BATCH_CONTEXT_LIMIT", "20"))
+    render = render or partial(render_customer, growth=growth)
+    reports: Dict[int, str] = {}
+    for done, row in enumerate(rows, 1):
+        report = reports[id(row)] = render(row)
+        if on_report is not None:
+            on_report(report, done, len(rows))
+    ranked = sorted(rows, key=lambda row: _float(row, "BalanceOutOfLimit"), reverse=True)[:limit]
+    parts = [render_batch_summary(rows, selector, growth=growth)] + [reports[id(row)] for row in ranked]
+    if len(rows) > limit:
+        parts.append(f"_Prikazano {limit} od {len(rows)} kupaca, sortirano po dugovanju izvan valute._")
+    return "\n\n".join(parts)
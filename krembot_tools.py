@@ -1,34 +1,94 @@
+import importlib
 import json
-import neo4j
-import pyodbc
 import requests
+import threading
+import time
 import xml.etree.ElementTree as ET
 
-from langchain.chains.query_constructor.base import AttributeInfo
-from langchain.retrievers.self_query.base import SelfQueryRetriever
-from langchain_community.vectorstores import Pinecone as LangPine
-from langchain_openai import OpenAIEmbeddings
-from langchain_openai.chat_models import ChatOpenAI
-
 from openai import OpenAI
 import os
 from os import getenv
-from pinecone import Pinecone
-from pinecone_text.sparse import BM25Encoder
-from typing import List, Dict, Any, Tuple, Union, Optional
+from typing import Callable, List, Dict, Any, Tuple, Union, Optional, TYPE_CHECKING
 from krembot_db import work_prompts
+from krembot_intelisale import (
+    customer_name_index,
+    fetch_customer_rows,
+    fetch_customer_rows_where,
+    growth_insights,
+    route_query,
+    start_snapshot_refresh,
+)
+from krembot_intelisale_report import render_batch, render_report
+from krembot_usage import record_usage, tracked_chat_completion, tracked_embedding
+
+if TYPE_CHECKING:
+    import neo4j
+
+# Teske zavisnosti (langchain, neo4j, pinecone, pinecone_text/nltk, pyodbc) se uvoze tek u alatu koji ih koristi.
+# Ovde je spisak modula koje alati svake aplikacije koriste, da bi mogli da se zagreju u pozadini.
+APP_TOOL_MODULES: Dict[str, List[str]] = {
+    "InteliBot": ["pyodbc", "krembot_intelisale_data"],
+    "DentyBot": ["pinecone", "pinecone_text.sparse"],
+    "DentyBotS": ["pinecone", "pinecone_text.sparse"],
+    "ECDBot": ["pinecone", "pinecone_text.sparse"],
+    "DelfiBot": [
+        "pinecone",
+        "pinecone_text.sparse",
+        "neo4j",
+        "langchain.chains.query_constructor.base",
+        "langchain.retrievers.self_query.base",
+        "langchain_community.callbacks",
+        "langchain_community.vectorstores",
+        "langchain_openai",
+    ],
+}
 
 mprompts = work_prompts()
 client = OpenAI(api_key=getenv("OPENAI_API_KEY"))
+_preload_thread: Optional[threading.Thread] = None
+
+
+def preload_tool_modules(app_id: Optional[str] = None, background: bool = True) -> None:
+    """
+    Imports the heavy modules used by the tools of the given application.
+
+    Tools import their dependencies lazily, so the first question of a fresh worker would pay for the
+    import. Calling this right after startup moves that cost off the first question, without putting it
+    back on the startup critical path. Applications not listed in `APP_TOOL_MODULES` get the Delfi set.
+
+    Args:
+        app_id (Optional[str], optional): The application identifier. Defaults to the 'APP_ID' environment variable.
+        background (bool, optional): Import in a daemon thread (only once per process). Defaults to True.
+
+    Returns:
+        None
+    """
+    global _preload_thread
+    modules = APP_TOOL_MODULES.get(app_id or getenv("APP_ID"), APP_TOOL_MODULES["DelfiBot"])
+
+    def run() -> None:
+        for module in modules:
+            try:
+                importlib.import_module(module)
+            except Exception as e:
+                print(f"Error preloading {module}: {e}")
+
+    if not background:
+        run()
+    elif _preload_thread is None:
+        _preload_thread = threading.Thread(target=run, name="tool-preload", daemon=True)
+        _preload_thread.start()
 
 
-def connect_to_neo4j() -> neo4j.Driver:
+def connect_to_neo4j() -> "neo4j.Driver":
     """
     Establishes a connection to the Neo4j database using credentials from environment variables.
 
     Returns:
         neo4j.Driver: A Neo4j driver instance for interacting with the database.
     """
+    import neo4j
+
     uri = getenv("NEO4J_URI")
     user = getenv("NEO4J_USER")
     password = getenv("NEO4J_PASS")
@@ -46,6 +106,8 @@ def connect_to_pinecone(x: int) -> Any:
     Returns:
         Any: An instance of Pinecone Index connected to the specified host.
     """
+    from pinecone import Pinecone
+
     pinecone_api_key = getenv('PINECONE_API_KEY')
     pinecone_host = (
         "https://delfi-a9w1e6k.svc.aped-4627-b74a.pinecone.io"
@@ -56,7 +118,11 @@ def connect_to_pinecone(x: int) -> Any:
     return pinecone_client.Index(host=pinecone_host)
 
 
-def rag_tool_answer(prompt: str, x: int) -> Tuple[Any, str]:
+def rag_tool_answer(
+    prompt: str,
+    x: int,
+    on_report: Optional[Callable[[str, int, int], None]] = None
+) -> Tuple[Any, str]:
     """
     Generates an answer using the RAG (Retrieval-Augmented Generation) tool based on the provided prompt and context.
 
@@ -66,6 +132,8 @@ def rag_tool_answer(prompt: str, x: int) -> Tuple[Any, str]:
     Args:
         prompt (str): The input query or prompt for which an answer is to be generated.
         x (int): Additional parameter that may influence the processing logic, such as device selection.
+        on_report (Optional[Callable[[str, int, int], None]], optional): For InteliBot multi-customer reports,
+            called with (report, done, total) as each customer report is ready. Defaults to None.
 
     Returns:
         Tuple[Any, str]: A tuple containing the generated context or search results and the RAG tool used.
@@ -74,7 +142,7 @@ def rag_tool_answer(prompt: str, x: int) -> Tuple[Any, str]:
     app_id = os.getenv("APP_ID")
 
     if app_id == "InteliBot":
-        return intelisale(prompt), rag_tool
+        return intelisale(prompt, on_report), rag_tool
 
     elif app_id == "DentyBot":
         processor = HybridQueryProcessor(namespace="denty-serviser", delfi_special=1)
@@ -137,7 +205,9 @@ def get_structured_decision_from_model(user_query: str) -> str:
              it returns the first value from the JSON response.
     """
     client = OpenAI()
-    response = client.chat.completions.create(
+    response = tracked_chat_completion(
+        client,
+        "router",
         model=getenv("OPENAI_MODEL"),
         temperature=0,
         response_format={"type": "json_object"},
@@ -177,6 +247,8 @@ def graphp(pitanje):
 
     The function performs error handling to manage invalid Cypher queries or errors during data fetching.
     """
+    import neo4j
+
     driver = connect_to_neo4j()
 
     def run_cypher_query(driver, query):
@@ -226,7 +298,9 @@ def graphp(pitanje):
 
     def generate_cypher_query(question):
         prompt = f"Translate the following user question into a Cypher query. Use the given structure of the database: {question}"
-        response = client.chat.completions.create(
+        response = tracked_chat_completion(
+            client,
+            "cypher_generation",
             model="gpt-4o",
             temperature=0.0,
             messages=[
@@ -527,7 +601,9 @@ def pineg(pitanje):
             return book_data
 
     def get_embedding(text, model="text-embedding-3-large"):
-        response = client.embeddings.create(
+        response = tracked_embedding(
+            client,
+            "pineg_embedding",
             input=[text],
             model=model
         ).data[0].embedding
@@ -747,7 +823,9 @@ def get_items_by_category(prompt: str) -> str:
         str: A formatted string containing the details of items in the identified category. If an error occurs
              during the API request, it returns an error message.
     """
-    response = client.chat.completions.create(
+    response = tracked_chat_completion(
+        client,
+        "category_router",
         model=getenv("OPENAI_MODEL"),
         temperature=0.0,
         response_format={"type": "json_object"},
@@ -1210,6 +1288,31 @@ def API_search_aks(order_ids: List[str]) -> List[Dict[str, Any]]:
     return orders_info
 
 
+def _tracked_langchain_embeddings(model: str, stage: str) -> Any:
+    """
+    Returns a LangChain embeddings object that calls OpenAI through `tracked_embedding`, so vector store
+    lookups made inside LangChain chains are recorded on the usage collector.
+
+    Args:
+        model (str): The OpenAI embedding model.
+        stage (str): The pipeline stage the embedding tokens are recorded under.
+
+    Returns:
+        Any: A `langchain_core.embeddings.Embeddings` instance.
+    """
+    from langchain_core.embeddings import Embeddings
+
+    class TrackedEmbeddings(Embeddings):
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            response = tracked_embedding(client, stage, input=texts, model=model)
+            return [item.embedding for item in response.data]
+
+        def embed_query(self, text: str) -> List[float]:
+            return self.embed_documents([text])[0]
+
+    return TrackedEmbeddings()
+
+
 def SelfQueryDelfi(
     upit: str,
     api_key: Optional[str] = None,
@@ -1241,6 +1344,12 @@ def SelfQueryDelfi(
              If an error occurs, returns the error message as a string.
     """
     
+    from langchain.chains.query_constructor.base import AttributeInfo
+    from langchain.retrievers.self_query.base import SelfQueryRetriever
+    from langchain_community.callbacks import get_openai_callback
+    from langchain_community.vectorstores import Pinecone as LangPine
+    from langchain_openai.chat_models import ChatOpenAI
+
     # Use the passed values if available, otherwise default to environment variables
     api_key = api_key if api_key is not None else getenv('PINECONE_API_KEY')
     environment = environment if environment is not None else getenv('PINECONE_API_KEY')
@@ -1249,7 +1358,8 @@ def SelfQueryDelfi(
     openai_api_key = openai_api_key if openai_api_key is not None else getenv("OPENAI_API_KEY")
     host = host if host is not None else getenv("PINECONE_HOST")
    
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
+    # embedding upita ide kroz nas klijent, da bi i ti tokeni bili u usage pregledu
+    embeddings = _tracked_langchain_embeddings("text-embedding-3-large", "self_query")
 
     # prilagoditi stvanim potrebama metadata
     metadata_field_info = [
@@ -1285,7 +1395,17 @@ def SelfQueryDelfi(
     )
     try:
         result = ""
-        doc_result = retriever.get_relevant_documents(upit)
+        # LangChain ne ide kroz nas OpenAI klijent, pa tokene brojimo preko callback-a
+        start = time.perf_counter()
+        with get_openai_callback() as cb:
+            doc_result = retriever.get_relevant_documents(upit)
+        record_usage(
+            "self_query",
+            "gpt-4o",
+            time.perf_counter() - start,
+            prompt_tokens=cb.prompt_tokens,
+            completion_tokens=cb.completion_tokens,
+        )
         for doc in doc_result:
             print("DOC: ", doc)
             metadata = doc.metadata
@@ -1359,7 +1479,7 @@ class HybridQueryProcessor:
         """
         
         text = text.replace("\n", " ")
-        result = client.embeddings.create(input=[text], model=model).data[0].embedding
+        result = tracked_embedding(client, "hybrid_embedding", input=[text], model=model).data[0].embedding
        
         return result
     
@@ -1415,6 +1535,8 @@ class HybridQueryProcessor:
             - Results are only added if the 'context' field exists in the result metadata.
             - When running under the environment variable `APP_ID="ECDBot"`, the 'source' field is conditionally modified for non-first results.
         """
+        from pinecone_text.sparse import BM25Encoder
+
         # Get embedding and unpack results
         dense = self.get_embedding(text=upit)
 
@@ -1507,182 +1629,74 @@ class HybridQueryProcessor:
             return tematika
 
 
-def intelisale(query: str) -> str:
+def intelisale(query: str, on_report: Optional[Callable[[str, int, int], None]] = None) -> str:
     """
     Processes a user query to retrieve and generate a comprehensive customer report.
 
-    This function connects to the 'IntelisaleTest' SQL Server database using credentials from environment variables.
-    It sends the user's query to the OpenAI API to extract the client name in the standardized format 'Customer x'.
-    Using the extracted client name, it executes a predefined SQL query to fetch relevant customer information,
+    The customer is resolved locally from the query with the customer name index (exact or fuzzy name, code or
+    number, see `krembot_intelisale.CustomerNameIndex`). Only when that is ambiguous, the query is sent to the
+    OpenAI API to extract the client name in the standardized format 'Customer x'. It then looks the customer up
+    in the precomputed `customer_snapshot` table of the 'IntelisaleTest' database to fetch relevant customer information,
     including details such as Code, Name, CustomerId, Branch, BlueCoatsNo, PlanCurrentYear, TurnoverCurrentYear,
     FullfilmentCurrentYear, PlaniraniIznosPoPoseti, CalculatedNumberOfVisits, PaymentAvgDays, BalanceOutOfLimit,
     BalanceCritical, and the latest activity log note.
 
-    After retrieving the data, the function formats the results into a structured string and invokes the
-    inner `generate_defined_report` function to create a formatted report in Serbian based on the fetched data.
+    After retrieving the data, the report is rendered in Serbian from the typed rows with the templates in
+    `krembot_intelisale_report` (no model call); the main chat completion turns it into the streamed answer.
+
+    A query about many customers (a branch, customers over the limit, a priority, see
+    `krembot_intelisale.parse_selector`) that names no single customer is answered in batch mode instead: all
+    matching customers are fetched with one set-based query and their reports are passed to `on_report` as they
+    are rendered.
 
     Args:
         query (str): The user's input query containing information to identify and retrieve the customer's details.
+        on_report (Optional[Callable[[str, int, int], None]], optional): Receives (report, done, total) for every
+            customer of a batch report. Defaults to None.
 
     Returns:
-        str: A formatted report containing detailed customer information as generated by the OpenAI API.
-             If an error occurs during processing, the function returns the error message as a string.
-    """
-    # Povezivanje na bazu podataka
-    server = os.getenv('MSSQL_HOST')
-    database = 'IntelisaleTest'
-    username = os.getenv('MSSQL_USER')
-    password = os.getenv('MSSQL_PASS')
-
-    connection_string = (
-        f'DRIVER={{ODBC Driver 18 for SQL Server}};'
-        f'SERVER={server};'
-        f'DATABASE={database};'
-        f'UID={username};'
-        f'PWD={password};'
-        'Encrypt=yes;'
-        'TrustServerCertificate=yes;'
-    )
-    
-    conn = pyodbc.connect(connection_string)
-    cursor = conn.cursor()
-
-    # Unos korisnika
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0.0,
-        messages=[
-            {
-                "role": "system",
-                "content": """Your only task is to return the client name from the user query.
-                Client name that you return should only be in the form: 'Customer x', where x is the integer that will appear in the user query.
-                So the user might call it 'Customer 15' right away, or maybe 'Company 133', or 'klijent 44', or maybe even just a number like '123', but you always return in the same format: 'Customer x'."""
-            },
-            {
-                "role": "user",
-                "content": query
-            }
-        ])
-    
-    client_name = response.choices[0].message.content.strip()
-
-    query = """
-    SELECT 
-        c.Code, 
-        c.Name as cn,
-        c.CustomerId, 
-        c.Branch, 
-        c.BlueCoatsNo, 
-        c.PlanCurrentYear, 
-        c.TurnoverCurrentYear, 
-        c.FullfilmentCurrentYear, 
-        CASE 
-            WHEN c.CalculatedNumberOfVisits = 0 OR c.CalculatedNumberOfVisits IS NULL THEN 0
-            ELSE c.Plan12Months / 12 / NULLIF(c.CalculatedNumberOfVisits, 0)
-        END AS [PlaniraniIznosPoPoseti],
-        c.CalculatedNumberOfVisits,
-        c.PaymentAvgDays, 
-        c.BalanceOutOfLimit, 
-        c.BalanceCritical,
-        ac.ActivityLogNoteContent AS [PoslednjaBeleska]
-    FROM 
-        customers c
-    LEFT JOIN 
-        (
-            SELECT 
-                ac.CustomerID, 
-                ac.ActivityLogNoteContent
-            FROM 
-                activities ac
-            WHERE 
-                ac.VisitStartDayTypeDescription = 'Poseta'
-            AND 
-                ac.VisitArrivalTime = (
-                    SELECT MAX(VisitArrivalTime)
-                    FROM activities
-                    WHERE CustomerID = ac.CustomerID
-                    AND VisitStartDayTypeDescription = 'Poseta'
-                )
-        ) ac ON c.CustomerId = ac.CustomerID
-    WHERE 
-        c.Name = ?
+        str: A formatted report containing detailed customer information, or a message that the customer was not found.
     """
-
-    cursor.execute(query, client_name)
-    rows = cursor.fetchall()
-
-    output = "Rezultati pretrage:\n"
-    for row in rows:
-        output += (
-            f"CustomerId: {row.CustomerId}, "
-            f"Name: {row.cn}, "
-            f"Code: {row.Code}, "
-            f"Branch: {row.Branch}, "
-            f"BlueCoatsNo: {row.BlueCoatsNo}, "
-            f"PlanCurrentYear: {row.PlanCurrentYear}, "
-            f"TurnoverCurrentYear: {row.TurnoverCurrentYear}, "
-            f"FullfilmentCurrentYear: {row.FullfilmentCurrentYear}, "
-            f"CalculatedNumberOfVisits: {row.CalculatedNumberOfVisits}, "
-            f"PaymentAvgDays: {row.PaymentAvgDays}, "
-            f"BalanceOutOfLimit: {row.BalanceOutOfLimit}, "
-            f"BalanceCritical: {row.BalanceCritical}, "
-            f"Planirani iznos po poseti: {row.PlaniraniIznosPoPoseti}, "
-            f"Poslednja beleška: {row.PoslednjaBeleska}"
-        )
-
-    conn.close()
-
-
-    def generate_defined_report(data: str) -> str:
-        """
-        Generates a structured report based on the provided customer data.
-
-        This inner function takes a formatted string containing customer data and sends a prompt to the OpenAI API
-        to generate a detailed report in Serbian. The report includes specific fields such as:
-            - Naziv kupca (Customer Name)
-            - Šifra kupca, naziv branše i broj plavih mantila (Customer Code, Branch Name, and Blue Coats Number)
-            - Plan kupca i trenutno ostvarenje (Plan for the Customer and Current Achievement)
-            - Planirani iznos po poseti i ukupan broj poseta (Planned Amount per Visit and Total Number of Visits)
-            - Prosečni dani plaćanja, dugovanje izvan valute i kritični saldo (Average Payment Days, Debt Outside Currency, and Critical Balance)
-            - Beleška sa prethodne posete (Note from the Previous Visit)
-
-        The report is generated without a summary, containing only the requested data to ensure clarity and focus.
-
-        Args:
-            data (str): The formatted string containing customer data to be included in the report.
-
-        Returns:
-            str: A generated report in Serbian containing the specified customer information.
-        """
-        prompt = f"Generate report from the given data: {data}"
-        response = client.chat.completions.create(
-            model="gpt-4o",
+    # Snapshot kupaca se odrzava u pozadini, upit po kupcu je jedan index seek
+    start_snapshot_refresh()
+
+    # Kupac se prepoznaje lokalno (naziv, sifra, broj, slicnost), LLM se zove samo za dvosmislen upit.
+    # Imenovan kupac ima prednost; upit za vise kupaca (bransa, preko limita, prioritet) ide u batch mod
+    # samo kad ne imenuje kupca (brojevi i nazivi iz uslova se pri tome ne racunaju)
+    growth = growth_insights()
+    customer_ids, selector = route_query(query)
+    if selector:
+        return render_batch(fetch_customer_rows_where(selector), selector, on_report, growth=growth)
+
+    name_index = customer_name_index()
+    client_name = None
+
+    if customer_ids is None:
+        response = tracked_chat_completion(
+            client,
+            "intelisale_client_name",
+            model="gpt-4o-mini",
             temperature=0.0,
             messages=[
                 {
-            "role": "system",
-            "content": (
-                """Traženi podaci za izveštaj su sledeći:
-                    •   Naziv kupca (Name)
-                    •	Šifra kupca, naziv branše i broj plavih mantila 
-                    •	Plan kupca i trenutno ostvarenje (promet i %)
-                    •	Planirani iznos po poseti, ukupan broj poseta
-                    •	Prosečni dani plaćanja, dugovanje izvan valute i kritični saldo
-                    •	Beleška sa prethodne posete
-
-                    Izveštaj mora biti na srpskom jeziku.
-                    Ne treba da sadrži rezime, već samo tražene podatke.
-                """
-            )
-        },
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        return response.choices[0].message.content
-    
-    fin_output = generate_defined_report(output)
-    return fin_output
+                    "role": "system",
+                    "content": """Your only task is to return the client name from the user query.
+                    Client name that you return should only be in the form: 'Customer x', where x is the integer that will appear in the user query.
+                    So the user might call it 'Customer 15' right away, or maybe 'Company 133', or 'klijent 44', or maybe even just a number like '123', but you always return in the same format: 'Customer x'."""
+                },
+                {
+                    "role": "user",
+                    "content": query
+                }
+            ])
+
+        client_name = response.choices[0].message.content.strip()
+        customer_ids = name_index.resolve_ids(client_name)
+
+    rows = fetch_customer_rows(client_name, customer_ids)
+
+    # Izvestaj se formatira lokalno iz tipiziranih redova, bez drugog poziva modela
+    return render_report(rows, growth=growth)
 
 
 ZA_FUNC_CALL = """
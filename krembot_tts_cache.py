@@ -0,0 +1,241 @@
+import hashlib
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from os import getenv
+from typing import Any, List, Optional, Tuple
+
+from krembot_async import http_session
+from krembot_usage import record_usage, tracked_speech
+
+DEFAULT_MODEL = "tts-1-hd"
+DEFAULT_VOICE = "nova"
+
+
+class TTSCache:
+    """
+    Synthesized speech, content-addressed by the hash of (model, voice, format, text).
+
+    Hot items are kept in memory (LRU, `memory_items` entries); every item is also stored as a file in
+    `cache_dir`, so the same text is synthesized once per deployment, not once per process. The directory
+    is capped at `max_bytes`: beyond it the least recently used files (by modification time, which a hit
+    refreshes) are deleted. Hits are recorded under the 'tts_cache' stage of the usage summary.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None, memory_items: int = 128) -> None:
+        """
+        Initializes the cache.
+
+        Args:
+            cache_dir (Optional[str], optional): Directory of the audio files. Defaults to the environment
+                                                 variable 'TTS_CACHE_DIR' or '.krembot_cache/tts'.
+            max_bytes (Optional[int], optional): Size cap of the directory. Defaults to the environment
+                                                 variable 'TTS_CACHE_MAX_MB' (megabytes) or 200 MB.
+            memory_items (int, optional): Items kept in memory. Defaults to 128.
+        """
+        self.cache_dir: str = cache_dir or getenv("TTS_CACHE_DIR", os.path.join(".krembot_cache", "tts"))
+        self.max_bytes: int = max_bytes if max_bytes is not None else int(float(getenv("TTS_CACHE_MAX_MB", "200")) * 1024 * 1024)
+        self.memory_items: int = memory_items
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._disk_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, voice: str, text: str, response_format: str = "mp3") -> str:
+        """
+        Returns the cache key of a synthesis request.
+        """
+        return hashlib.sha256(f"{model}\0{voice}\0{response_format}\0{text.strip()}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, response_format: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{response_format}")
+
+    def _remember(self, key: str, audio: bytes) -> None:
+        self._memory[key] = audio
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, model: str, voice: str, text: str, response_format: str = "mp3") -> Optional[bytes]:
+        """
+        Returns the cached audio of a text, or None.
+
+        Args:
+            model (str): The TTS model.
+            voice (str): The TTS voice.
+            text (str): The text.
+            response_format (str, optional): The audio format. Defaults to 'mp3'.
+
+        Returns:
+            Optional[bytes]: The audio, or None if it was not synthesized before.
+        """
+        key = self.key(model, voice, text, response_format)
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+        if audio is None:
+            path = self._path(key, response_format)
+            try:
+                with open(path, "rb") as f:
+                    audio = f.read()
+                os.utime(path)
+            except OSError:
+                return None
+            with self._lock:
+                self._remember(key, audio)
+        record_usage("tts_cache", model, hits=1, saved_chars=len(text))
+        return audio
+
+    def put(self, model: str, voice: str, text: str, audio: bytes, response_format: str = "mp3") -> None:
+        """
+        Stores synthesized audio in memory and on disk, evicting old files beyond the size cap.
+
+        Args:
+            model (str): The TTS model.
+            voice (str): The TTS voice.
+            text (str): The text.
+            audio (bytes): The audio returned by the API.
+            response_format (str, optional): The audio format. Defaults to 'mp3'.
+        """
+        if not audio:
+            return
+        key = self.key(model, voice, text, response_format)
+        path = self._path(key, response_format)
+        with self._lock:
+            self._remember(key, audio)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing TTS cache: {e}")
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._files())
+            else:
+                self._disk_bytes += len(audio)
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _files(self) -> List[Tuple[float, int, str]]:
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _evict(self) -> None:
+        # brise se do 90% limita, da se ne skenira direktorijum posle svakog novog fajla
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+        self._disk_bytes = total
+
+
+_tts_cache: Optional[TTSCache] = None
+_tts_cache_lock = threading.Lock()
+
+
+def tts_cache() -> TTSCache:
+    """
+    Returns the process-wide TTS cache.
+    """
+    global _tts_cache
+    with _tts_cache_lock:
+        if _tts_cache is None:
+            _tts_cache = TTSCache()
+        return _tts_cache
+
+
+def cached_speech(
+    client: Any,
+    text: str,
+    model: str = DEFAULT_MODEL,
+    voice: str = DEFAULT_VOICE,
+    response_format: str = "mp3",
+    stage: str = "tts"
+) -> bytes:
+    """
+    Returns the synthesized audio of a text from the TTS cache, calling the speech API only on a miss.
+
+    Args:
+        client (Any): The OpenAI client.
+        text (str): The text to speak.
+        model (str, optional): The TTS model. Defaults to 'tts-1-hd'.
+        voice (str, optional): The TTS voice. Defaults to 'nova'.
+        response_format (str, optional): The audio format. Defaults to 'mp3'.
+        stage (str, optional): The pipeline stage for the usage log. Defaults to 'tts'.
+
+    Returns:
+        bytes: The audio.
+    """
+    cache = tts_cache()
+    audio = cache.get(model, voice, text, response_format)
+    if audio is None:
+        response = tracked_speech(client, stage, model=model, voice=voice, input=text, response_format=response_format)
+        audio = response.read()
+        cache.put(model, voice, text, audio, response_format)
+    return audio
+
+
+async def cached_speech_async(
+    api_key: str,
+    text: str,
+    model: str = DEFAULT_MODEL,
+    voice: str = DEFAULT_VOICE,
+    response_format: str = "mp3",
+    stage: str = "tts"
+) -> bytes:
+    """
+    `cached_speech` for the background loop: on a miss the speech API is called through the shared aiohttp
+    session of `krembot_async`, so the connection to api.openai.com is reused between segments and turns.
+
+    Args:
+        api_key (str): The OpenAI API key.
+        text (str): The text to speak.
+        model (str, optional): The TTS model. Defaults to 'tts-1-hd'.
+        voice (str, optional): The TTS voice. Defaults to 'nova'.
+        response_format (str, optional): The audio format. Defaults to 'mp3'.
+        stage (str, optional): The pipeline stage for the usage log. Defaults to 'tts'.
+
+    Returns:
+        bytes: The audio.
+
+    Raises:
+        Exception: If the API request fails with a status code other than 200.
+    """
+    cache = tts_cache()
+    audio = cache.get(model, voice, text, response_format)
+    if audio is not None:
+        return audio
+    session = await http_session()
+    start = time.perf_counter()
+    async with session.post(
+        url="https://api.openai.com/v1/audio/speech",
+        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        json={"model": model, "voice": voice, "input": text, "response_format": response_format},
+    ) as response:
+        if response.status != 200:
+            raise Exception(f"API request failed with status {response.status}")
+        audio = await response.read()
+    record_usage(stage, model, time.perf_counter() - start, tts_tokens=len(text))
+    cache.put(model, voice, text, audio, response_format)
+    return audio
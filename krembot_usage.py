@@ -0,0 +1,339 @@
+import time
+
+from contextvars import ContextVar
+from os import getenv
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from krembot_db import ConversationDatabase
+
+USAGE_FIELDS = ("embedding_tokens", "prompt_tokens", "completion_tokens", "stt_tokens", "tts_tokens")
+
+_current_collector: ContextVar[Optional["UsageCollector"]] = ContextVar("krembot_usage_collector", default=None)
+
+
+class UsageCollector:
+    """
+    Aggregates OpenAI usage units for a single chatbot request.
+
+    Every OpenAI call site reports its usage here through the `tracked_*` wrappers. Units are
+    aggregated per model (this is what gets written to `chatbot_token_log`) and per stage
+    (router, retrieval, main completion, TTS, ...) together with the time spent in each stage,
+    so it is visible which stages dominate cost and latency. The collector is thread-safe, because
+    parts of a request may run in worker threads or in the background event loop.
+    """
+
+    def __init__(self, app_id: Optional[str] = None) -> None:
+        """
+        Initializes an empty collector.
+
+        Args:
+            app_id (Optional[str], optional): The application identifier written to the token log.
+                                              Defaults to the 'APP_ID' environment variable.
+        """
+        self.app_id: str = app_id if app_id is not None else getenv("APP_ID")
+        self.calls: List[Dict[str, Any]] = []
+        self._by_model: Dict[str, Dict[str, int]] = {}
+        self._by_stage: Dict[str, Dict[str, float]] = {}
+        self._lock = Lock()
+
+    def add(self, stage: str, model: str, latency: float = 0.0, **units: int) -> None:
+        """
+        Records the usage of a single OpenAI call.
+
+        Args:
+            stage (str): The pipeline stage that made the call (e.g. 'router', 'main_completion').
+            model (str): The OpenAI model used.
+            latency (float, optional): Wall-clock duration of the call in seconds. Defaults to 0.0.
+            **units (int): Usage units, any of `USAGE_FIELDS`. Other units (`cached_tokens`, `saved_tokens`)
+                           are only summed per stage.
+
+        Returns:
+            None
+        """
+        model = model or "unknown"
+        with self._lock:
+            per_model = self._by_model.setdefault(model, dict.fromkeys(USAGE_FIELDS, 0))
+            per_stage = self._by_stage.setdefault(stage, {"calls": 0, "latency": 0.0, "units": 0})
+            for field in USAGE_FIELDS:
+                per_model[field] += int(units.get(field) or 0)
+            per_stage["calls"] += 1
+            per_stage["latency"] += latency
+            per_stage["units"] += sum(int(units.get(field) or 0) for field in USAGE_FIELDS)
+            # cached_tokens, saved_tokens, ... nisu kolone token loga, ali se sabiraju po fazi
+            for field, value in units.items():
+                if field not in USAGE_FIELDS:
+                    per_stage[field] = per_stage.get(field, 0) + int(value or 0)
+            if "cached_tokens" in units:
+                per_stage["prompt_tokens"] = per_stage.get("prompt_tokens", 0) + int(units.get("prompt_tokens") or 0)
+            self.calls.append({"stage": stage, "model": model, "latency": round(latency, 3), **units})
+
+    def add_chat_usage(self, stage: str, model: str, usage: Any, latency: float = 0.0, **extra: int) -> None:
+        """
+        Records the `usage` object returned by a chat completion (streamed or not).
+
+        Args:
+            stage (str): The pipeline stage that made the call.
+            model (str): The OpenAI model used.
+            usage (Any): The `CompletionUsage` object (or dict) returned by the API. Ignored if None.
+            latency (float, optional): Wall-clock duration of the call in seconds. Defaults to 0.0.
+            **extra (int): Additional per-stage units, e.g. `first_token_ms` of a streamed call.
+
+        Returns:
+            None
+        """
+        if usage is None:
+            return
+        if isinstance(usage, dict):
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+            details = usage.get("prompt_tokens_details") or {}
+            cached_tokens = details.get("cached_tokens", 0)
+        else:
+            prompt_tokens = getattr(usage, "prompt_tokens", 0)
+            completion_tokens = getattr(usage, "completion_tokens", 0)
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached_tokens = getattr(details, "cached_tokens", 0) if details is not None else 0
+        self.add(
+            stage,
+            model,
+            latency,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens or 0,
+            **extra,
+        )
+
+    def token_rows(self) -> List[Tuple[str, str, int, int, int, int, int]]:
+        """
+        Builds one `chatbot_token_log` row per model for the collected usage.
+
+        Returns:
+            List[Tuple[str, str, int, int, int, int, int]]: Rows in the order
+                (app_id, model_name, embedding_tokens, prompt_tokens, completion_tokens, stt_tokens, tts_tokens).
+        """
+        with self._lock:
+            return [
+                (self.app_id, model, *(units[field] for field in USAGE_FIELDS))
+                for model, units in self._by_model.items()
+                if any(units.values())
+            ]
+
+    def cache_summary(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Returns the prompt tokens and the cached prompt tokens (OpenAI prompt caching) per chat stage.
+
+        Returns:
+            Dict[str, Tuple[int, int]]: A mapping of stage name to (prompt_tokens, cached_tokens).
+        """
+        with self._lock:
+            return {
+                stage: (int(stats.get("prompt_tokens", 0)), int(stats.get("cached_tokens", 0)))
+                for stage, stats in self._by_stage.items()
+                if "prompt_tokens" in stats
+            }
+
+    def stage_summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the number of calls, summed latency and summed units per stage (plus any extra units).
+
+        Returns:
+            Dict[str, Dict[str, float]]: A mapping of stage name to its aggregated statistics.
+        """
+        with self._lock:
+            return {stage: dict(stats) for stage, stats in self._by_stage.items()}
+
+    def reset(self) -> None:
+        """
+        Clears all collected usage.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.calls = []
+            self._by_model = {}
+            self._by_stage = {}
+
+    def flush(self) -> None:
+        """
+        Writes the aggregated per-model rows to `chatbot_token_log` in one batch and resets the collector.
+
+        Nothing is written (and no connection is opened) when no usage was collected. Database errors
+        are printed and swallowed, token logging must never break the chat.
+
+        Returns:
+            None
+        """
+        rows = self.token_rows()
+        summary = self.stage_summary()
+        self.reset()
+        if not rows:
+            return
+        for stage, stats in summary.items():
+            extra = "".join(f", {key}={value}" for key, value in stats.items() if key not in ("calls", "latency", "units"))
+            if stats.get("prompt_tokens"):
+                extra += f", cache_hit={stats.get('cached_tokens', 0) / stats['prompt_tokens']:.0%}"
+            print(f"Usage [{stage}]: calls={stats['calls']}, latency={stats['latency']:.2f}s, units={stats['units']}{extra}")
+        try:
+            with ConversationDatabase() as db:
+                db.add_token_records_openai(rows)
+        except Exception as e:
+            print(f"Error flushing token usage: {e}")
+
+
+def start_request(app_id: Optional[str] = None) -> UsageCollector:
+    """
+    Starts a new usage collector for the current request and makes it the active one.
+
+    Args:
+        app_id (Optional[str], optional): The application identifier. Defaults to the 'APP_ID' environment variable.
+
+    Returns:
+        UsageCollector: The new active collector.
+    """
+    collector = UsageCollector(app_id)
+    _current_collector.set(collector)
+    return collector
+
+
+def current_collector() -> UsageCollector:
+    """
+    Returns the active usage collector, creating one if no request has been started in this context.
+
+    Returns:
+        UsageCollector: The active collector.
+    """
+    collector = _current_collector.get()
+    if collector is None:
+        collector = start_request()
+    return collector
+
+
+def record_usage(stage: str, model: str, latency: float = 0.0, **units: int) -> None:
+    """
+    Records usage on the active collector. Used by call sites that do not go through the OpenAI client.
+
+    Args:
+        stage (str): The pipeline stage that made the call.
+        model (str): The OpenAI model used.
+        latency (float, optional): Wall-clock duration of the call in seconds. Defaults to 0.0.
+        **units (int): Usage units, any of `USAGE_FIELDS` plus `cached_tokens`.
+
+    Returns:
+        None
+    """
+    current_collector().add(stage, model, latency, **units)
+
+
+def tracked_chat_completion(client: Any, stage: str, **kwargs: Any) -> Any:
+    """
+    Calls `client.chat.completions.create` and records its token usage.
+
+    For streamed calls `include_usage` is switched on, and the returned iterator records the usage
+    chunk when it arrives at the end of the stream. The usage chunk has no choices, so callers that
+    index `choices[0]` must skip it.
+
+    Args:
+        client (Any): The OpenAI client.
+        stage (str): The pipeline stage making the call.
+        **kwargs (Any): Arguments passed through to `chat.completions.create`.
+
+    Returns:
+        Any: The completion, or an iterator over the stream chunks when `stream=True`.
+    """
+    start = time.perf_counter()
+    if kwargs.get("stream"):
+        kwargs.setdefault("stream_options", {"include_usage": True})
+        return _track_stream(client.chat.completions.create(**kwargs), stage, kwargs.get("model"), start)
+    response = client.chat.completions.create(**kwargs)
+    current_collector().add_chat_usage(stage, response.model or kwargs.get("model"), response.usage, time.perf_counter() - start)
+    return response
+
+
+def _track_stream(stream: Any, stage: str, model: str, start: float) -> Iterator[Any]:
+    """
+    Passes stream chunks through and records the usage chunk of a streamed chat completion, together
+    with the time to the first content chunk (`first_token_ms`).
+    """
+    collector = current_collector()
+    first_token = None
+    for chunk in stream:
+        if first_token is None and getattr(chunk, "choices", None):
+            first_token = time.perf_counter() - start
+        if getattr(chunk, "usage", None) is not None:
+            collector.add_chat_usage(
+                stage,
+                chunk.model or model,
+                chunk.usage,
+                time.perf_counter() - start,
+                first_token_ms=int((first_token or 0) * 1000),
+            )
+        yield chunk
+
+
+def tracked_embedding(client: Any, stage: str, **kwargs: Any) -> Any:
+    """
+    Calls `client.embeddings.create` and records the embedding tokens.
+
+    Args:
+        client (Any): The OpenAI client.
+        stage (str): The pipeline stage making the call.
+        **kwargs (Any): Arguments passed through to `embeddings.create`.
+
+    Returns:
+        Any: The embeddings response.
+    """
+    start = time.perf_counter()
+    response = client.embeddings.create(**kwargs)
+    usage = getattr(response, "usage", None)
+    record_usage(
+        stage,
+        kwargs.get("model"),
+        time.perf_counter() - start,
+        embedding_tokens=getattr(usage, "prompt_tokens", 0) if usage is not None else 0,
+    )
+    return response
+
+
+def tracked_transcription(client: Any, stage: str, **kwargs: Any) -> Any:
+    """
+    Calls `client.audio.transcriptions.create` and records the speech-to-text units.
+
+    Whisper reports duration-based usage (seconds of audio), token-based transcription models report
+    input tokens. Whichever is present is logged as `stt_tokens`.
+
+    Args:
+        client (Any): The OpenAI client.
+        stage (str): The pipeline stage making the call.
+        **kwargs (Any): Arguments passed through to `audio.transcriptions.create`.
+
+    Returns:
+        Any: The transcription response.
+    """
+    start = time.perf_counter()
+    response = client.audio.transcriptions.create(**kwargs)
+    usage = getattr(response, "usage", None)
+    units = 0
+    if usage is not None:
+        units = getattr(usage, "seconds", None) or getattr(usage, "input_tokens", None) or 0
+    record_usage(stage, kwargs.get("model"), time.perf_counter() - start, stt_tokens=int(round(units)))
+    return response
+
+
+def tracked_speech(client: Any, stage: str, **kwargs: Any) -> Any:
+    """
+    Calls `client.audio.speech.create` and records the text-to-speech units (input characters).
+
+    Args:
+        client (Any): The OpenAI client.
+        stage (str): The pipeline stage making the call.
+        **kwargs (Any): Arguments passed through to `audio.speech.create`.
+
+    Returns:
+        Any: The speech response.
+    """
+    start = time.perf_counter()
+    response = client.audio.speech.create(**kwargs)
+    record_usage(stage, kwargs.get("model"), time.perf_counter() - start, tts_tokens=len(kwargs.get("input") or ""))
+    return response
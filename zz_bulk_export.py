@@ -0,0 +1,222 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from krembot_db import ConversationDatabase
+
+MESSAGE_COLUMNS = ["conversation_id", "app_name", "user_name", "thread_id", "message_index", "role", "content"]
+FEEDBACK_COLUMNS = ["thread_id", "app_name", "previous_question", "tool_answer", "given_answer", "Thumbs", "Feedback_text"]
+
+_decoder = json.JSONDecoder()
+
+
+def iter_messages(conversation_json: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the messages of a stored conversation (a JSON array) one at a time.
+
+    The array is decoded element by element with `raw_decode`, so a long conversation is never
+    materialized as a whole list next to its source string.
+    """
+    length = len(conversation_json)
+    pos = conversation_json.index("[") + 1
+    while True:
+        while pos < length and conversation_json[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= length or conversation_json[pos] == "]":
+            return
+        message, pos = _decoder.raw_decode(conversation_json, pos)
+        yield message
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"day": datetime.date.today().isoformat()}
+
+
+def save_checkpoint(path: str, state: Dict[str, Any]) -> None:
+    """Writes the checkpoint atomically, a crash never leaves a half-written file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class CsvSink:
+    """
+    Appends rows to one CSV file per table.
+
+    On resume the file is truncated back to the size recorded in the checkpoint, so rows written
+    after the last checkpoint (by a run that crashed) are not duplicated.
+    """
+
+    def __init__(self, path: str, columns: List[str], resume_bytes: int) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, "a+", encoding="utf-8", newline="")
+        self.file.truncate(resume_bytes)
+        self.file.seek(resume_bytes)
+        self.writer = csv.writer(self.file)
+        if resume_bytes == 0:
+            self.writer.writerow(columns)
+
+    def write(self, rows: List[tuple]) -> None:
+        self.writer.writerows(rows)
+
+    def tell(self) -> int:
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetSink:
+    """
+    Writes each batch as Parquet files partitioned by app_name and day (Hive style directories).
+
+    A part file is named after the checkpoint key of its batch, so re-running a batch after a crash
+    overwrites the same file instead of adding a duplicate.
+    """
+
+    def __init__(self, root: str, columns: List[str], day: str) -> None:
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.root = root
+        self.columns = columns
+        self.day = day
+        self.app_index = columns.index("app_name")
+
+    def write(self, rows: List[tuple], part_key: str) -> None:
+        by_app: Dict[str, List[tuple]] = defaultdict(list)
+        for row in rows:
+            by_app[row[self.app_index]].append(row)
+        for app_name, app_rows in by_app.items():
+            directory = os.path.join(self.root, f"app_name={app_name}", f"day={self.day}")
+            os.makedirs(directory, exist_ok=True)
+            data = {column: [row[i] for row in app_rows] for i, column in enumerate(self.columns) if i != self.app_index}
+            self.pq.write_table(self.pa.table(data), os.path.join(directory, f"part-{part_key}.parquet"))
+
+    def close(self) -> None:
+        pass
+
+
+def open_sinks(
+    out_dir: str,
+    table: str,
+    columns: List[str],
+    formats: List[str],
+    state: Dict[str, Any]
+) -> Tuple[Optional[CsvSink], Optional[ParquetSink]]:
+    csv_sink = parquet_sink = None
+    if "csv" in formats:
+        csv_sink = CsvSink(os.path.join(out_dir, "csv", f"{table}.csv"), columns, state.get("csv_bytes", 0))
+    if "parquet" in formats:
+        try:
+            parquet_sink = ParquetSink(os.path.join(out_dir, "parquet", table), columns, state["day"])
+        except ImportError:
+            print("pyarrow is not installed, Parquet output is skipped (pip install pyarrow).")
+    return csv_sink, parquet_sink
+
+
+def conversation_rows(batch: List[tuple], include_system: bool) -> List[tuple]:
+    """Flattens a batch of conversations into one row per message."""
+    rows = []
+    for conversation_id, app_name, user_name, thread_id, conversation_json in batch:
+        try:
+            for index, message in enumerate(iter_messages(conversation_json)):
+                role = message.get("role")
+                if role == "system" and not include_system:
+                    continue
+                content = message.get("content")
+                if not isinstance(content, str):
+                    content = json.dumps(content, ensure_ascii=False)
+                rows.append((conversation_id, app_name, user_name, thread_id, index, role, content))
+        except ValueError as e:
+            print(f"Skipping conversation {conversation_id}, invalid JSON: {e}")
+    return rows
+
+
+def export_table(
+    table: str,
+    out_dir: str,
+    checkpoint_path: str,
+    checkpoint: Dict[str, Any],
+    formats: List[str],
+    batch_size: int,
+    app_name: Optional[str],
+    include_system: bool
+) -> int:
+    """
+    Exports one table batch by batch, saving the checkpoint after every batch. Returns the number of rows written.
+    """
+    state = checkpoint.setdefault(table, {})
+    state.setdefault("day", checkpoint["day"])
+    columns = MESSAGE_COLUMNS if table == "conversations" else FEEDBACK_COLUMNS
+    csv_sink, parquet_sink = open_sinks(out_dir, table, columns, formats, state)
+    written = 0
+    try:
+        with ConversationDatabase() as db:
+            if table == "conversations":
+                batches = db.iter_conversation_batches(state.get("last_id", 0), batch_size, app_name)
+            else:
+                db.add_feedback_id()
+                batches = db.iter_feedback_batches(state.get("last_id", 0), batch_size, app_name)
+            for batch in batches:
+                if table == "conversations":
+                    rows = conversation_rows(batch, include_system)
+                else:
+                    rows = [row[1:] for row in batch]
+                part_key = f"{batch[0][0]:012d}"
+                if csv_sink:
+                    csv_sink.write(rows)
+                    state["csv_bytes"] = csv_sink.tell()
+                if parquet_sink and rows:
+                    parquet_sink.write(rows, part_key)
+                state["last_id"] = batch[-1][0]
+                state["rows_written"] = state.get("rows_written", 0) + len(rows)
+                save_checkpoint(checkpoint_path, checkpoint)
+                written += len(rows)
+                print(f"{table}: {state['rows_written']} rows exported")
+    finally:
+        for sink in (csv_sink, parquet_sink):
+            if sink:
+                sink.close()
+    return written
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Export conversations and feedback to partitioned Parquet and CSV.")
+    parser.add_argument("--out", default="export", help="output directory")
+    parser.add_argument("--tables", nargs="*", default=["conversations", "feedback"], choices=["conversations", "feedback"])
+    parser.add_argument("--format", nargs="*", default=["parquet", "csv"], choices=["parquet", "csv"], dest="formats")
+    parser.add_argument("--batch-size", type=int, default=500, help="rows per fetchmany batch")
+    parser.add_argument("--app", default=None, help="export a single app_name")
+    parser.add_argument("--include-system", action="store_true", help="also export system prompt messages")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the beginning")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    checkpoint_path = os.path.join(args.out, "checkpoint.json")
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = load_checkpoint(checkpoint_path)
+    for table in args.tables:
+        written = export_table(
+            table, args.out, checkpoint_path, checkpoint, args.formats, args.batch_size, args.app, args.include_system
+        )
+        print(f"{table}: {written} new rows written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
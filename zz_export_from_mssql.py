@@ -6,6 +6,17 @@ from krembot_db import ConversationDatabase
 
 st.set_page_config(layout="wide")
 
+@st.cache_resource(show_spinner=False)
+def ensure_viewer_indexes():
+    # Jednom po procesu; bez prava na CREATE INDEX viewer radi i bez indeksa, samo sporije
+    try:
+        with ConversationDatabase() as db:
+            db.create_viewer_indexes()
+    except Exception as e:
+        print(f"Viewer indexes not created: {e}")
+
+ensure_viewer_indexes()
+
 st.title("Viewer Application")
 st.caption("Choose to view feedback or conversations, and select an application name.")
 
@@ -20,17 +31,13 @@ def get_app_names(table_name):
         app_names = [row[0] for row in results]
     return app_names
 
-def get_feedback_records(app_name):
+@st.cache_data(ttl=60, show_spinner=False)
+def get_feedback_page(app_name, search_text, page, page_size):
+    # Filtriranje i paginacija se rade u SQL-u, u Streamlit stize samo jedna stranica
     with ConversationDatabase() as db:
-        query = """
-        SELECT thread_id, previous_question, tool_answer, given_answer, Thumbs, Feedback_text
-        FROM Feedback
-        WHERE app_name = ?
-        """
-        db.cursor.execute(query, app_name)
-        records = db.cursor.fetchall()
+        records, total = db.query_feedback_page(app_name, search_text, page * page_size, page_size)
         columns = ['thread_id', 'previous_question', 'tool_answer', 'given_answer', 'Thumbs', 'Feedback_text']
-    return records, columns
+    return records, columns, total
 
 def get_user_names(app_name):
     with ConversationDatabase() as db:
@@ -44,65 +51,31 @@ def get_user_names(app_name):
         user_names = [row[0] for row in results]
     return user_names
 
-def get_conversation_records(app_name, user_name):
+@st.cache_data(ttl=60, show_spinner=False)
+def get_conversation_page(app_name, user_name, search_text, page, page_size):
+    # Razgovori sa samo sistemskim promptom i tekstualni filter se iskljucuju u SQL-u
     with ConversationDatabase() as db:
-        query = """
-        SELECT thread_id, conversation
-        FROM [PositiveAI].[dbo].[conversations]
-        WHERE app_name = ? AND user_name = ?
-        """
-        db.cursor.execute(query, (app_name, user_name))
-        records = db.cursor.fetchall()
-        columns = ['thread_id', 'conversation']
-    return records, columns
-
-def filter_out_system_only_conversations(records):
-    """Filter out conversations that only contain system prompts."""
-    filtered_records = []
-    for record in records:
-        conversation_json = record[1]
-        conversation = json.loads(conversation_json)
-
-        # Check if there are any non-system messages
-        non_system_messages = [msg for msg in conversation if msg['role'] != 'system']
-
-        if non_system_messages:  # Keep conversations with user/assistant messages
-            filtered_records.append(record)
-
-    return filtered_records
-
-def filter_feedbacks_by_text(records, search_text):
-    """Filter feedback records by text found in previous_question, tool_answer, or given_answer."""
-    filtered_records = []
-    for record in records:
-        previous_question = record[1] or ""
-        tool_answer = record[2] or ""
-        given_answer = record[3] or ""
-        feedback_text = record[5] or ""
-        
-        # Search in all three columns (case-insensitive)
-        if (search_text.lower() in previous_question.lower() or
-            search_text.lower() in tool_answer.lower() or
-            search_text.lower() in given_answer.lower() or
-            search_text.lower() in feedback_text.lower()):
-            filtered_records.append(record)
-    
-    return filtered_records
-
-def filter_conversations_by_text(records, search_text):
-    """Filter conversation records by text found in any message content."""
-    filtered_records = []
-    for record in records:
-        conversation_json = record[1]
-        conversation = json.loads(conversation_json)
-
-        # Search in all message contents (case-insensitive)
-        for msg in conversation:
-            if search_text.lower() in msg['content'].lower():
-                filtered_records.append(record)
-                break  # No need to check further once a match is found
-    
-    return filtered_records
+        records, total = db.query_conversation_page(app_name, user_name, search_text, page * page_size, page_size)
+        columns = ['id', 'thread_id', 'preview']
+    return records, columns, total
+
+def page_controls(total, key):
+    """Render page size and page number controls and return (page, page_size)."""
+    col_size, col_page, col_info = st.columns([1, 1, 2])
+    page_size = col_size.selectbox("Rows per page", [25, 50, 100, 250], index=1, key=f"{key}_size")
+    page_count = max(1, -(-total // page_size))
+    if st.session_state.get(f"{key}_page", 1) > page_count:
+        st.session_state[f"{key}_page"] = page_count
+    page = col_page.number_input("Page", min_value=1, max_value=page_count, step=1, key=f"{key}_page") - 1
+    col_info.caption(f"{total} matching rows, page {page + 1} of {page_count}")
+    return page, page_size
+
+def current_page(key, *filters):
+    """Return (page, page_size) for the grid, going back to the first page when the filters change."""
+    if st.session_state.get(f"{key}_filters") != filters:
+        st.session_state[f"{key}_filters"] = filters
+        st.session_state[f"{key}_page"] = 1
+    return st.session_state.get(f"{key}_page", 1) - 1, st.session_state.get(f"{key}_size", 50)
 
 def extract_feedback_by_thread_id(thread_id, records):
     # Filter records by the given thread_id
@@ -152,14 +125,11 @@ if selected_app_name:
         # Text input for filtering feedbacks
         search_text = st.text_input("Enter text to filter by:")
 
-        # Fetch feedback records for the selected app name
-        records, columns = get_feedback_records(selected_app_name)
+        # Fetch one page of feedback records, the page controls below the grid keep their state by key
+        page, page_size = current_page("feedback", selected_app_name, search_text)
+        records, columns, total = get_feedback_page(selected_app_name, search_text, page, page_size)
 
         if records:
-            # Apply text filter
-            if search_text:
-                records = filter_feedbacks_by_text(records, search_text)
-
             # Convert records to DataFrame for display in AgGrid
             df = pd.DataFrame.from_records(records, columns=columns)
 
@@ -170,6 +140,7 @@ if selected_app_name:
 
             # Display interactive grid
             grid_response = AgGrid(df, gridOptions=grid_options, update_mode='SELECTION_CHANGED')
+            page_controls(total, "feedback")
 
             # Access the selected rows (as a DataFrame)
             selected_rows = pd.DataFrame(grid_response['selected_rows'])
@@ -196,6 +167,9 @@ if selected_app_name:
                     st.write(f"**FEEDBACK:** {feedback[5]}")    # feedback text
                 else:
                     st.write(f"No feedback found for Thread ID: {selected_thread_id}")
+        elif total:
+            page_controls(total, "feedback")
+            st.write("No records on this page.")
         else:
             st.write("No feedback records found for the selected application name.")
 
@@ -208,19 +182,13 @@ if selected_app_name:
             # Text input for filtering conversations
             search_text = st.text_input("Enter text to filter by:")
 
-            # Fetch conversation records for the selected app name and user name
-            records, columns = get_conversation_records(selected_app_name, selected_user_name)
-
-            # Filter out conversations that contain only system prompts
-            filtered_records = filter_out_system_only_conversations(records)
-
-            # Apply text filter
-            if search_text:
-                filtered_records = filter_conversations_by_text(filtered_records, search_text)
+            # Fetch one page of conversations for the selected app name and user name
+            page, page_size = current_page("conversation", selected_app_name, selected_user_name, search_text)
+            records, columns, total = get_conversation_page(selected_app_name, selected_user_name, search_text, page, page_size)
 
-            if filtered_records:
-                # Convert filtered records to DataFrame for display in AgGrid
-                df = pd.DataFrame.from_records(filtered_records, columns=columns)
+            if records:
+                # Convert records to DataFrame for display in AgGrid
+                df = pd.DataFrame.from_records(records, columns=columns)
 
                 # Configure AgGrid for single-row selection
                 gb = GridOptionsBuilder.from_dataframe(df)
@@ -229,6 +197,7 @@ if selected_app_name:
 
                 # Display interactive grid
                 grid_response = AgGrid(df, gridOptions=grid_options, update_mode='SELECTION_CHANGED')
+                page_controls(total, "conversation")
 
                 # Access the selected rows (as a DataFrame)
                 selected_rows = pd.DataFrame(grid_response['selected_rows'])
@@ -249,6 +218,9 @@ if selected_app_name:
                         parse_and_display_conversation(conversation_text)
                     else:
                         st.write(f"No conversation found for Thread ID: {selected_thread_id}")
+            elif total:
+                page_controls(total, "conversation")
+                st.write("No records on this page.")
             else:
                 st.write(f"No conversation records found for the selected user.")
 else:
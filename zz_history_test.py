@@ -0,0 +1,66 @@
+"""
+Checks of the token-windowed history (krembot_history), runnable with pytest or directly:
+python zz_history_test.py
+"""
+from concurrent.futures import Future
+from typing import Any, Dict, List
+
+import krembot_history
+from krembot_history import SUMMARY_PREFIX, ThreadHistory, message_tokens
+
+
+def conversation(turns: int, words: int = 200) -> List[Dict[str, Any]]:
+    messages = [{"role": "system", "content": "Ti si asistent."}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"pitanje {turn} " + "reč " * words})
+        messages.append({"role": "assistant", "content": f"odgovor {turn} " + "reč " * words})
+    return messages
+
+
+def test_large_prompt_keeps_unsummarized_turns() -> None:
+    # pitanje sa velikim kontekstom alata (npr. 20 izvestaja o kupcima) nije deo istorije
+    history = ThreadHistory(keep_turns=4, budget=3000)
+    messages = conversation(6)
+    tool_prompt = {"role": "user", "content": "kupac " * 20000}
+    window = history.window(messages) + [tool_prompt]
+    # nista nije sazeto, pa se svih 6 poteza salje doslovno
+    assert [m for m in window if m["role"] != "system"][:-1] == messages[1:]
+
+
+def test_window_never_drops_past_summary() -> None:
+    history = ThreadHistory(keep_turns=4, budget=100)
+    messages = conversation(6)
+    history.summary, history.summarized_turns = "Korisnik pita o kupcima.", 2
+    window = history.window(messages)
+    assert window[1]["content"] == SUMMARY_PREFIX + "Korisnik pita o kupcima."
+    assert window[2:] == messages[5:]
+
+
+def test_update_folds_turns_over_budget() -> None:
+    submitted = []
+
+    class Pool:
+        def submit(self, fn: Any, *args: Any) -> Future:
+            submitted.append(args)
+            future: Future = Future()
+            future.set_result(None)
+            return future
+
+    original, krembot_history._summarizer = krembot_history._summarizer, Pool()
+    try:
+        messages = conversation(6)
+        turn_tokens = message_tokens(messages[1]) + message_tokens(messages[2])
+        history = ThreadHistory(keep_turns=4, budget=2 * turn_tokens + 10)
+        history.update(None, messages)
+    finally:
+        krembot_history._summarizer = original
+    # bez budzeta bi se sazela 2 poteza (6 - keep_turns); u budzet staju poslednja 2, pa se sazimaju 4
+    _, _, turns, target, _ = submitted[0]
+    assert target == 4 and len(turns) == 4
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"{name}: ok")
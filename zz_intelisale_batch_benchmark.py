@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from typing import Any, Dict, List
+
+os.environ.setdefault("INTELISALE_SOURCE", "local")
+
+from krembot_intelisale import customer_name_index, fetch_customer_rows_where, route_query  # noqa: E402
+from krembot_intelisale_report import render_batch, render_customer  # noqa: E402
+
+SELECTORS: List[Dict[str, Any]] = [
+    {"Branch": "DIY Sistemi"},
+    {"BalanceOutOfLimit__gt": 0},
+    {"Priority": 12},
+    {"BalanceOutOfLimit__gt": 0, "Attributes": {"Ugovor": "Ne", "Eshop kupac": "Da"}},
+    {"CustomerId__gt": 0},
+]
+
+# Upit -> ocekivano: naziv jednog kupca, ili selektor batch moda
+ROUTING_CASES: List[Any] = [
+    ("Da li je Customer 15 preko limita? Daj sve podatke", "Customer 15"),
+    ("izvestaj za Customer 44 prioritet 2 sve", "Customer 44"),
+    ("Da li Customer 15 ima ugovor? Daj sve", "Customer 15"),
+    ("svi kupci preko limita", {"BalanceOutOfLimit__gt": 0}),
+    ("svi kupci iz branše DIY Sistemi", {"Branch": "DIY Sistemi"}),
+    ("kupci sa prioritetom 2", {"Priority": 2}),
+    ("kupci bez ugovora", {"Attributes": {"Ugovor": "Ne"}}),
+]
+
+
+def check_routing() -> int:
+    """Checks that single-customer questions are not routed to batch mode and batch questions are. Returns the failures."""
+    failures = 0
+    for query, expected in ROUTING_CASES:
+        customer_ids, selector = route_query(query)
+        if isinstance(expected, dict):
+            ok = customer_ids is None and selector == expected
+        else:
+            ok = selector is None and customer_ids == customer_name_index().resolve_ids(expected)
+        if not ok:
+            failures += 1
+            print(f"ROUTING FAILED {query!r}: expected {expected}, got ids={customer_ids} selector={selector}")
+    print(f"routing: {len(ROUTING_CASES) - failures}/{len(ROUTING_CASES)} ok")
+    return failures
+
+
+def slow_render(delay: float):
+    """Wraps `render_customer` with a fixed per-customer delay, standing in for per-customer I/O."""
+    def render(row: Any) -> str:
+        time.sleep(delay)
+        return render_customer(row)
+    return render
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure Intelisale batch report throughput (local exports by default).")
+    parser.add_argument("--render-delay-ms", type=float, default=0.0, help="simulated I/O per customer report")
+    parser.add_argument("--selector", type=json.loads, action="append", help="JSON selector, repeatable")
+    args = parser.parse_args()
+
+    if check_routing():
+        return 1
+    render = slow_render(args.render_delay_ms / 1000) if args.render_delay_ms else render_customer
+    for selector in args.selector or SELECTORS:
+        start = time.perf_counter()
+        rows = fetch_customer_rows_where(selector)
+        fetch_ms = (time.perf_counter() - start) * 1000
+        print(f"{json.dumps(selector, ensure_ascii=False)}: {len(rows)} customers, fetched in {fetch_ms:.1f} ms")
+        first = []
+        start = time.perf_counter()
+        render_batch(rows, selector, lambda report, done, total: first or first.append(time.perf_counter()), render=render)
+        elapsed = time.perf_counter() - start
+        first_ms = (first[0] - start) * 1000 if first else 0.0
+        print(f"  rendered in {elapsed * 1000:8.1f} ms, first report after {first_ms:6.1f} ms, "
+              f"{len(rows) / elapsed if elapsed else 0:9.0f} customers/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import argparse
+import datetime
+import random
+import sqlite3
+import sys
+import time
+
+from typing import Callable, List, Tuple
+
+# Upiti su prevedeni na SQLite da bi benchmark radio bez MSSQL-a; oblik upita je isti kao u krembot_tools/krembot_intelisale
+
+CORRELATED_SQL = """
+SELECT c.Code, c.Name AS cn, c.CustomerId, c.Branch, c.PlanCurrentYear, c.BalanceOutOfLimit,
+       ac.ActivityLogNoteContent AS PoslednjaBeleska
+FROM customers c
+LEFT JOIN (
+    SELECT ac.CustomerID, ac.ActivityLogNoteContent
+    FROM activities ac
+    WHERE ac.VisitStartDayTypeDescription = 'Poseta'
+    AND ac.VisitArrivalTime = (
+        SELECT MAX(VisitArrivalTime) FROM activities
+        WHERE CustomerID = ac.CustomerID AND VisitStartDayTypeDescription = 'Poseta'
+    )
+) ac ON c.CustomerId = ac.CustomerID
+WHERE c.Name = ?
+"""
+
+SNAPSHOT_SQL = """
+SELECT Code, Name AS cn, CustomerId, Branch, PlanCurrentYear, BalanceOutOfLimit, LastVisitNote AS PoslednjaBeleska
+FROM customer_snapshot WHERE Name = ?
+"""
+
+REFRESH_CUSTOMERS_SQL = """
+INSERT INTO customer_snapshot (CustomerId, Code, Name, Branch, PlanCurrentYear, PlannedAmountPerVisit, BalanceOutOfLimit)
+SELECT CustomerId, Code, Name, Branch, PlanCurrentYear,
+       CASE WHEN IFNULL(CalculatedNumberOfVisits, 0) = 0 THEN 0 ELSE Plan12Months / 12.0 / CalculatedNumberOfVisits END,
+       BalanceOutOfLimit
+FROM customers WHERE true
+ON CONFLICT (CustomerId) DO UPDATE SET
+    Code = excluded.Code, Name = excluded.Name, Branch = excluded.Branch, PlanCurrentYear = excluded.PlanCurrentYear,
+    PlannedAmountPerVisit = excluded.PlannedAmountPerVisit, BalanceOutOfLimit = excluded.BalanceOutOfLimit
+"""
+
+REFRESH_VISITS_SQL = """
+UPDATE customer_snapshot SET LastVisitTime = v.VisitArrivalTime, LastVisitNote = v.ActivityLogNoteContent
+FROM (
+    SELECT CustomerID, VisitArrivalTime, ActivityLogNoteContent,
+           ROW_NUMBER() OVER (PARTITION BY CustomerID ORDER BY VisitArrivalTime DESC) AS rn
+    FROM activities
+    WHERE VisitStartDayTypeDescription = 'Poseta'
+      AND (?1 IS NULL OR VisitArrivalTime > ?1
+           OR CustomerID IN (SELECT CustomerId FROM customer_snapshot WHERE LastVisitTime IS NULL))
+) v
+WHERE v.CustomerID = customer_snapshot.CustomerId AND v.rn = 1
+  AND (customer_snapshot.LastVisitTime IS NULL OR v.VisitArrivalTime > customer_snapshot.LastVisitTime)
+"""
+
+
+def build_database(customers: int, visits_per_customer: int, seed: int) -> sqlite3.Connection:
+    """
+    Creates an in-memory database with synthetic customers and activities (a third of them visits).
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE customers (CustomerId INTEGER PRIMARY KEY, Code TEXT, Name TEXT, Branch TEXT,
+            PlanCurrentYear REAL, Plan12Months REAL, CalculatedNumberOfVisits REAL, BalanceOutOfLimit REAL);
+        CREATE TABLE activities (Id INTEGER PRIMARY KEY, CustomerID INTEGER, VisitStartDayTypeDescription TEXT,
+            VisitArrivalTime TEXT, ActivityLogNoteContent TEXT);
+        CREATE TABLE customer_snapshot (CustomerId INTEGER PRIMARY KEY, Code TEXT, Name TEXT, Branch TEXT,
+            PlanCurrentYear REAL, PlannedAmountPerVisit REAL, BalanceOutOfLimit REAL, LastVisitTime TEXT, LastVisitNote TEXT);
+        CREATE INDEX IX_customer_snapshot_Name ON customer_snapshot (Name);
+        """
+    )
+    conn.executemany(
+        "INSERT INTO customers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (i, f"{i:05d}", f"Customer {i}", f"Branch {i % 40}", rng.uniform(0, 1e7), rng.uniform(0, 1e7),
+             rng.choice([0, 12, 24, 52]), rng.uniform(0, 1e5))
+            for i in range(1, customers + 1)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO activities (CustomerID, VisitStartDayTypeDescription, VisitArrivalTime, ActivityLogNoteContent) "
+        "VALUES (?, ?, ?, ?)",
+        activity_rows(rng, customers, customers * visits_per_customer, datetime.datetime(2020, 1, 1)),
+    )
+    conn.commit()
+    return conn
+
+
+def activity_rows(rng: random.Random, customers: int, count: int, start: datetime.datetime) -> List[Tuple]:
+    rows = []
+    for _ in range(count):
+        when = start + datetime.timedelta(minutes=rng.randrange(0, 4 * 365 * 24 * 60))
+        kind = "Poseta" if rng.random() < 0.33 else rng.choice(["Telefon", "Email", "Sastanak"])
+        rows.append((rng.randint(1, customers), kind, when.isoformat(sep=" "), f"Beleska {rng.random():.6f}"))
+    return rows
+
+
+def refresh_snapshot(conn: sqlite3.Connection, watermark: str) -> str:
+    conn.execute(REFRESH_CUSTOMERS_SQL)
+    conn.execute(REFRESH_VISITS_SQL, (watermark,))
+    new_watermark = conn.execute(
+        "SELECT MAX(VisitArrivalTime) FROM activities WHERE VisitStartDayTypeDescription = 'Poseta'"
+    ).fetchone()[0]
+    conn.commit()
+    return new_watermark
+
+
+def timed(fn: Callable[[], object], repeat: int = 1) -> Tuple[float, object]:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def lookup(conn: sqlite3.Connection, sql: str, names: List[str]) -> List[Tuple]:
+    return [row for name in names for row in conn.execute(sql, (name,)).fetchall()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare the per-request Intelisale query with the customer snapshot.")
+    parser.add_argument("--customers", type=int, default=7500)
+    parser.add_argument("--visits-per-customer", type=int, default=40, help="activities per customer")
+    parser.add_argument("--lookups", type=int, default=20, help="customer lookups per measurement")
+    parser.add_argument("--new-activities", type=int, default=5000, help="activities added before the incremental refresh")
+    parser.add_argument("--activities-index", action="store_true", help="index activities as create_snapshot_table does")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    build_time, conn = timed(lambda: build_database(args.customers, args.visits_per_customer, args.seed))
+    activities = conn.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+    print(f"{args.customers} customers, {activities} activities (built in {build_time:.1f}s)")
+    if args.activities_index:
+        conn.execute(
+            "CREATE INDEX IX_activities_visit ON activities (VisitStartDayTypeDescription, CustomerID, VisitArrivalTime DESC)"
+        )
+
+    rng = random.Random(args.seed + 1)
+    names = [f"Customer {rng.randint(1, args.customers)}" for _ in range(args.lookups)]
+
+    correlated, old_rows = timed(lambda: lookup(conn, CORRELATED_SQL, names))
+    full_refresh, watermark = timed(lambda: refresh_snapshot(conn, None))
+    snapshot, new_rows = timed(lambda: lookup(conn, SNAPSHOT_SQL, names), repeat=20)
+
+    conn.executemany(
+        "INSERT INTO activities (CustomerID, VisitStartDayTypeDescription, VisitArrivalTime, ActivityLogNoteContent) "
+        "VALUES (?, ?, ?, ?)",
+        activity_rows(rng, args.customers, args.new_activities, datetime.datetime(2024, 1, 1)),
+    )
+    conn.commit()
+    incremental, _ = timed(lambda: refresh_snapshot(conn, watermark))
+
+    same = sorted(map(str, old_rows)) == sorted(map(str, new_rows))
+    print(f"correlated query:      {correlated / len(names) * 1000:9.3f} ms per customer")
+    print(f"snapshot lookup:       {snapshot / len(names) * 1000:9.3f} ms per customer")
+    print(f"full snapshot refresh: {full_refresh * 1000:9.1f} ms")
+    print(f"incremental refresh:   {incremental * 1000:9.1f} ms ({args.new_activities} new activities)")
+    print(f"results identical:     {same}")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
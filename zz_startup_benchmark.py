@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Dict, List, Tuple
+
+APP_IDS = ["DelfiBot", "DentyBot", "DentyBotS", "ECDBot", "InteliBot"]
+PROMPT_NAMES = [
+    "text_from_image",
+    "contextual_compression",
+    "rag_self_query",
+    "hyde_rag",
+    "choose_rag",
+    "sys_ragbot",
+    "rag_answer_reformat",
+]
+STARTUP_MODULES = "krembot_db, krembot_usage, krembot_funcs, krembot_tools"
+
+
+def app_env(app_id: str, snapshot_dir: str) -> Dict[str, str]:
+    """
+    Builds the environment for a benchmark run of one application.
+
+    A prompt snapshot matching the environment is written first, so the import does not wait on MSSQL,
+    and the background prompt refresh is disabled.
+    """
+    env = dict(os.environ, APP_ID=app_id, PROMPT_REFRESH_SECONDS="0")
+    snapshot_path = os.path.join(snapshot_dir, f"prompts_{app_id}.json")
+    env_map = {name: env.get(name.upper()) for name in PROMPT_NAMES}
+    with open(snapshot_path, "w", encoding="utf-8") as f:
+        json.dump({"version": "benchmark", "env_map": env_map, "prompts": {}}, f)
+    env["PROMPT_SNAPSHOT"] = snapshot_path
+    return env
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """
+    Parses `python -X importtime` output into (module, self_us, cumulative_us) tuples.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.rstrip()[1:], int(self_us), int(cumulative_us)))  # the column starts with one space
+    return rows
+
+
+def run_import(app_id: str, code: str, snapshot_dir: str) -> Tuple[float, List[Tuple[str, int, int]]]:
+    """
+    Runs `code` in a fresh interpreter with `-X importtime` and returns the wall time and import report.
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=app_env(app_id, snapshot_dir),
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{app_id}: import failed\n{proc.stderr[-2000:]}")
+    return elapsed, parse_importtime(proc.stderr)
+
+
+def top_level_report(rows: List[Tuple[str, int, int]], top: int) -> List[Tuple[str, int]]:
+    """
+    Returns the `top` most expensive top-level packages by cumulative import time (microseconds).
+    """
+    totals: Dict[str, int] = {}
+    for name, _, cumulative_us in rows:
+        if name.startswith(" "):
+            continue  # nested import, already counted in its parent
+        package = name.strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + cumulative_us
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure krembot cold-start import time per APP_ID.")
+    parser.add_argument("--apps", nargs="*", default=APP_IDS, help="APP_IDs to measure")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per APP_ID, the best one is reported")
+    parser.add_argument("--top", type=int, default=10, help="number of packages in the import report")
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if a startup import exceeds this")
+    args = parser.parse_args()
+
+    over_budget = []
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        for app_id in args.apps:
+            startup = min(
+                (run_import(app_id, f"import {STARTUP_MODULES}", snapshot_dir) for _ in range(args.repeat)),
+                key=lambda result: result[0],
+            )
+            first_tool = run_import(
+                app_id,
+                f"import {STARTUP_MODULES}; krembot_tools.preload_tool_modules({app_id!r}, background=False)",
+                snapshot_dir,
+            )
+            startup_ms = startup[0] * 1000
+            print(f"\n== {app_id}: startup {startup_ms:.0f} ms, startup + tool modules {first_tool[0] * 1000:.0f} ms")
+            for package, cumulative_us in top_level_report(startup[1], args.top):
+                print(f"   {package:<30} {cumulative_us / 1000:8.1f} ms")
+            if args.budget_ms is not None and startup_ms > args.budget_ms:
+                over_budget.append(app_id)
+
+    if over_budget:
+        print(f"\nOver the {args.budget_ms:.0f} ms budget: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())